@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+
+"""
+Batch generation of Climb! MELD data for many performance workbooks
+
+A jobs file is a JSON list of objects, each describing a generation job:
+
+    name:       job name (default: the output directory)
+    workbook:   game engine spreadsheet (default "mkGameEngine2.xlsx")
+    json:       stage and Muzicode descriptions (default "mkGameEngine2.json")
+    output:     output root directory, created if needed; generated data is
+                written to its 'd/' directory (or as selected by 'args')
+    args:       optional list of further climbgen options, e.g.
+                ["--bundle", "climb.ndjson"] or ["--check-mei", "--mei-dir", "../mei"]
+
+Relative paths in a job are relative to the directory containing the jobs file
+(option paths in 'args' are relative to the output root, as for climbgen).
+
+Jobs are run in up to N worker processes at a time, each job in a fresh process.
+A job that fails (with a nonzero status or an exception), whose worker process
+dies, or that exceeds the time limit (if given) does not affect the others.
+"--profile" and "--cprofile" options in 'args' are honoured, with the report
+written in the job's output root.
+A summary is printed giving, for each job, its status, elapsed time, number of
+entities generated and the time spent in the main generation phases.
+
+Usage:
+    python batchgen.py JOBS [--processes N] [--timeout SECONDS] [--summary FILE]
+"""
+
+__author__      = "Graham Klyne (GK@ACM.ORG)"
+__copyright__   = "Copyright 2017, G. Klyne"
+__license__     = "MIT (http://opensource.org/licenses/MIT)"
+
+import sys
+import os
+import os.path
+import json
+import time
+import traceback
+import multiprocessing
+import argparse
+
+from climbgen import parse_args as climbgen_args, generate_climb_meld_options
+from profiling import profiler
+
+import logging
+log = logging.getLogger(__name__)
+
+SUMMARY_PHASES = ["open_spreadsheet", "analyze_table_data", "generate_meld_data"]
+
+def load_jobs(filename):
+    """
+    Read jobs file, returning list of jobs with defaults filled in and paths made
+    absolute.
+    """
+    with open(filename, "r") as instr:
+        jobs = json.load(instr)
+    base = os.path.dirname(os.path.abspath(filename))
+    def path(p):
+        return os.path.normpath(os.path.join(base, p))
+    result = []
+    for (i, job) in enumerate(jobs):
+        if "output" not in job:
+            raise ValueError("%s: job %d has no output directory"%(filename, i+1))
+        result.append(
+            { "name":       job.get("name", job["output"])
+            , "workbook":   path(job.get("workbook", "mkGameEngine2.xlsx"))
+            , "json":       path(job.get("json", "mkGameEngine2.json"))
+            , "output":     path(job["output"])
+            , "args":       list(job.get("args", []))
+            })
+    return result
+
+def run_job(job):
+    """
+    Run one generation job (in a worker process), returning a result dictionary:
+    name, status (None if an exception occurred), error, elapsed time, entity
+    count and phase timings.
+    """
+    result  = { "name": job["name"], "status": None, "error": None }
+    t0      = time.time()
+    options = None
+    try:
+        options = climbgen_args(
+            ["climbgen"] + job["args"] + ["--workbook", job["workbook"], "--json", job["json"]]
+            )
+        profiler.enable(cprofile_phase=options.cprofile)
+        if not os.path.isdir(job["output"]):
+            os.makedirs(job["output"])
+        result["status"] = generate_climb_meld_options(job["output"], options)
+    except SystemExit, e:
+        # Option errors are reported by argparse, which exits
+        result["error"] = "invalid options: %r"%(job["args"],)
+    except Exception, e:
+        log.error("run_job: %s: %s"%(job["name"], e))
+        result["error"] = "%s: %s"%(type(e).__name__, e)
+        result["traceback"] = traceback.format_exc()
+    if options and options.profile and profiler.enabled:
+        profiler.save_report(os.path.join(job["output"], options.profile))
+    result["elapsed"]  = time.time() - t0
+    report             = profiler.report()
+    result["entities"] = sum(
+        n for (c, n) in report["counters"].items() if c.startswith("entities:")
+        )
+    result["phases"]   = dict( (p, v["wall"]) for (p, v) in report["phases"].items() )
+    return result
+
+def run_job_process(job, conn):
+    """
+    Run one generation job, sending its result on a connection.
+    """
+    try:
+        conn.send(run_job(job))
+    finally:
+        conn.close()
+    return
+
+def failed_job(job, error, elapsed):
+    return (
+        { "name": job["name"], "status": None, "error": error
+        , "elapsed": elapsed, "entities": 0, "phases": {}
+        })
+
+def run_batch(jobs, processes=None, timeout=None):
+    """
+    Run jobs, each in a fresh worker process, with up to 'processes' (default: the
+    number of CPUs) at a time, and return list of results in job order.  A job
+    whose worker process dies, or that runs for more than 'timeout' seconds (if
+    given), is recorded as failed.
+
+    (multiprocessing.Pool is not used, as its 'map' waits forever for the result
+    of a job whose worker process has died.)
+    """
+    processes = processes or multiprocessing.cpu_count()
+    results   = [None]*len(jobs)
+    waiting   = list(enumerate(jobs))
+    running   = {}      # job index -> (process, connection, start time)
+    while waiting or running:
+        while waiting and len(running) < processes:
+            (i, job)     = waiting.pop(0)
+            (recv, send) = multiprocessing.Pipe(duplex=False)
+            proc = multiprocessing.Process(target=run_job_process, args=(job, send))
+            proc.start()
+            send.close()
+            running[i] = (proc, recv, time.time())
+        finished = []
+        for (i, (proc, recv, t0)) in running.items():
+            if recv.poll():
+                # A result, or end of file if the worker process has died
+                try:
+                    results[i] = recv.recv()
+                except EOFError:
+                    proc.join()
+                    results[i] = failed_job(
+                        jobs[i], "worker process exited with code %s"%(proc.exitcode,),
+                        time.time() - t0
+                        )
+            elif timeout and time.time() - t0 > timeout:
+                proc.terminate()
+                results[i] = failed_job(
+                    jobs[i], "timed out after %.0fs"%(timeout,), time.time() - t0
+                    )
+            else:
+                continue
+            proc.join()
+            recv.close()
+            finished.append(i)
+        for i in finished:
+            del running[i]
+        if not finished:
+            time.sleep(0.05)
+    return results
+
+def job_failed(result):
+    return result["error"] is not None or result["status"] != 0
+
+def print_summary(results, elapsed):
+    print("%-24s %-8s %8s %8s %s"%("job", "status", "time", "entities", "  ".join(SUMMARY_PHASES)))
+    for r in results:
+        status = "error" if r["error"] else ("ok" if r["status"] == 0 else "status %s"%(r["status"],))
+        phases = "  ".join(
+            "%*.3f"%(len(p), r["phases"][p]) if p in r["phases"] else "%*s"%(len(p), "-")
+            for p in SUMMARY_PHASES
+            )
+        print("%-24s %-8s %7.3fs %8d %s"%(r["name"], status, r["elapsed"], r["entities"], phases))
+        if r["error"]:
+            print("    %s"%(r["error"],))
+    failed = len([ r for r in results if job_failed(r) ])
+    total  = sum( r["elapsed"] for r in results )
+    print("%d jobs, %d failed: %.3fs elapsed, %.3fs total job time, %.2f jobs/s"%
+        (len(results), failed, elapsed, total, len(results)/elapsed if elapsed else 0)
+        )
+    return
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog=os.path.basename(argv[0]),
+        description="Generate Climb! MELD data for a batch of workbooks"
+        )
+    parser.add_argument("jobs", help="JSON file listing generation jobs")
+    parser.add_argument("--processes", type=int, default=None,
+        help="Number of worker processes (default: number of CPUs)")
+    parser.add_argument("--timeout", type=float, default=None,
+        help="Maximum time in seconds for each job (default: no limit)")
+    parser.add_argument("--summary", metavar="FILE",
+        help="Also write the results of all jobs to FILE, as JSON")
+    return parser.parse_args(argv[1:])
+
+def runMain():
+    options = parse_args(sys.argv)
+    jobs    = load_jobs(options.jobs)
+    t0      = time.time()
+    results = run_batch(jobs, options.processes, options.timeout)
+    elapsed = time.time() - t0
+    print_summary(results, elapsed)
+    if options.summary:
+        with open(options.summary, "w") as outstr:
+            json.dump(
+                { "elapsed": elapsed, "jobs": results }, outstr,
+                sort_keys=True, indent=2, separators=(',', ': ')
+                )
+    return 1 if any( job_failed(r) for r in results ) else 0
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    sys.exit(runMain())
+
+# End.
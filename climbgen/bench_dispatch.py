@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+"""
+Benchmark Muzicode dispatch latency.
+
+Usage:
+    python bench_dispatch.py [triggers] [dir]
+
+A Dispatcher is loaded from the collection 'd/' directory (default "d/"), then the
+given number of triggers (default 1000000), chosen at random from the Muzicodes
+of each stage plus some unknown names, are dispatched one at a time.  Each
+dispatch is timed individually, and percentiles of the dispatch time are reported.
+"""
+
+__author__      = "Graham Klyne (GK@ACM.ORG)"
+__copyright__   = "Copyright 2017, G. Klyne"
+__license__     = "MIT (http://opensource.org/licenses/MIT)"
+
+import sys
+import time
+import random
+import array
+
+from dispatch import Dispatcher
+
+def synthetic_triggers(dispatcher, ntriggers, seed=1):
+    """
+    Return list of (stage_id, mc_name) triggers; about 1 in 10 does not match.
+    """
+    rnd      = random.Random(seed)
+    choices  = [ (s, m) for s in dispatcher.stages() for m in dispatcher.muzicodes(s) ]
+    stages   = dispatcher.stages()
+    triggers = []
+    for i in xrange(ntriggers):
+        if rnd.random() < 0.1:
+            triggers.append((rnd.choice(stages), "unknown_%d"%(i % 100,)))
+        else:
+            triggers.append(rnd.choice(choices))
+    return triggers
+
+def time_dispatch(dispatcher, triggers):
+    """
+    Dispatch each trigger, returning an array of elapsed times in seconds.
+    """
+    dispatch = dispatcher.dispatch
+    timer    = time.time
+    elapsed  = array.array('d')
+    append   = elapsed.append
+    for (stage_id, mc_name) in triggers:
+        t0 = timer()
+        dispatch(stage_id, mc_name)
+        append(timer() - t0)
+    return elapsed
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values)-1, int(len(sorted_values)*p/100.0))]
+
+def runMain():
+    ntriggers = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    base_dir  = sys.argv[2] if len(sys.argv) > 2 else "d/"
+    emitted   = []
+    t0 = time.time()
+    dispatcher = Dispatcher(emit=emitted.append).load_collection(base_dir)
+    print("load %.3fs: %d stages, %d Muzicodes"%
+        ( time.time()-t0, len(dispatcher.stages()),
+          sum( len(dispatcher.muzicodes(s)) for s in dispatcher.stages() )
+        ))
+    triggers = synthetic_triggers(dispatcher, ntriggers)
+    elapsed  = sorted(time_dispatch(dispatcher, triggers))
+    print("%d triggers, %d dispatched: p50 %.2fus  p99 %.2fus  max %.2fus  mean %.2fus"%
+        ( ntriggers, len(emitted),
+          percentile(elapsed, 50)*1e6, percentile(elapsed, 99)*1e6, elapsed[-1]*1e6,
+          sum(elapsed)/len(elapsed)*1e6
+        ))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(runMain())
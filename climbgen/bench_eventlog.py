@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+
+"""
+Benchmark performance event log throughput.
+
+Usage:
+    python bench_eventlog.py [events] [segment_size]
+
+The given number of events (default 200000) are appended to an event log in a
+temporary directory as fast as possible, with group fsync, and then synced.  The
+rate of appending, the time to complete the final sync, and the number of segments
+are reported.  The log is then read back and checked.
+"""
+
+__author__      = "Graham Klyne (GK@ACM.ORG)"
+__copyright__   = "Copyright 2017, G. Klyne"
+__license__     = "MIT (http://opensource.org/licenses/MIT)"
+
+import sys
+import shutil
+import tempfile
+import time
+
+from eventlog import EventLog, read_events, segment_files
+
+def runMain():
+    nevents      = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    segment_size = int(sys.argv[2]) if len(sys.argv) > 2 else 4*1024*1024
+    log_dir = tempfile.mkdtemp(prefix="eventlog")
+    try:
+        evlog = EventLog(log_dir, segment_size=segment_size)
+        t0 = time.time()
+        for i in xrange(nevents):
+            evlog.append("%s_%d"%("1a", i % 3), "1a", {"midi": "90407f"})
+        t1 = time.time()
+        evlog.sync()
+        t2 = time.time()
+        evlog.close()
+        print("%d events: append %.3fs (%.0f events/s), append+sync %.3fs (%.0f events/s)"%
+            (nevents, t1-t0, nevents/(t1-t0), t2-t0, nevents/(t2-t0))
+            )
+        t3 = time.time()
+        count = 0
+        for (i, event) in enumerate(read_events(log_dir)):
+            assert event["seq"] == i+1, "Event %d has sequence number %d"%(i+1, event["seq"])
+            count += 1
+        assert count == nevents, "Read %d events, expected %d"%(count, nevents)
+        print("read %.3fs, %d segments"%(time.time()-t3, len(segment_files(log_dir))))
+    finally:
+        shutil.rmtree(log_dir)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(runMain())
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+"""
+Benchmark GridCSV, which loads all rows, against lazily parsed GridCSVLazy and
+compact GridColumnar.
+
+Usage:
+    python bench_gridcsv.py [rows]
+
+A synthetic CSV file is written to a temporary file, then read back through each
+grid class, visiting every cell.  The GridColumnar grid is converted from a 
+GridCSVLazy grid.  Each class is run in a separate process so that peak memory 
+use can be reported for each.
+"""
+
+__author__      = "Graham Klyne (GK@ACM.ORG)"
+__copyright__   = "Copyright 2017, G. Klyne"
+__license__     = "MIT (http://opensource.org/licenses/MIT)"
+
+import sys
+import os
+import csv
+import tempfile
+import time
+import multiprocessing
+
+from grid.grid import GridCSV, GridCSVLazy, GridColumnar
+from climbbench import peak_rss_kb
+
+def make_csv(filename, nrows, ncols=56):
+    """
+    Write a synthetic CSV file with a header row and 'nrows' data rows.  As in the 
+    game engine spreadsheet, the first column is a distinct stage identifier and 
+    most other values are drawn from a small vocabulary or are empty.
+    """
+    vocab = ["Y", "N", "True", "False", "0", "1"] + [ "action_%d"%k for k in range(50) ]
+    with open(filename, "wb") as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow([ "col%d"%(j,) for j in range(ncols) ])
+        for i in range(nrows):
+            writer.writerow(
+                [ "stage_%d"%(i,) ] + 
+                [ (vocab[(i*7+j) % len(vocab)] if (i+j) % 3 else "") for j in range(1, ncols) ]
+                )
+    return
+
+def open_csv(filename):
+    return GridCSV(filename, dialect="excel")
+
+def open_csv_lazy(filename):
+    return GridCSVLazy(filename, dialect="excel")
+
+def open_columnar(filename):
+    return GridColumnar(GridCSVLazy(filename, dialect="excel"))
+
+def time_class(opener, filename, nrows):
+    t0 = time.time()
+    grid = opener(filename)
+    t1 = time.time()
+    count = 0
+    for row in grid.rows(0, nrows+1):
+        for v in row:
+            count += 1
+    t2 = time.time()
+    return (t1-t0, t2-t1, count, peak_rss_kb())
+
+def run_class(args):
+    return time_class(*args)
+
+def runMain():
+    nrows = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    fd, filename = tempfile.mkstemp(suffix=".csv")
+    os.close(fd)
+    try:
+        make_csv(filename, nrows)
+        for (label, opener) in (
+                ("GridCSV",         open_csv),
+                ("GridCSVLazy",     open_csv_lazy),
+                ("GridColumnar",    open_columnar)
+                ):
+            pool = multiprocessing.Pool(1)
+            try:
+                (topen, tscan, count, rss) = pool.apply(run_class, [(opener, filename, nrows)])
+            finally:
+                pool.close()
+                pool.join()
+            print("%-12s open %8.3fs  scan %8.3fs  peak %8dkB  (%d cells)"%
+                  (label, topen, tscan, rss, count))
+    finally:
+        os.remove(filename)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(runMain())
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+
+"""
+Benchmark GridExcel full-workbook access against read-only cached row access.
+
+Usage:
+    python bench_gridexcel.py [rows]
+
+A synthetic workbook with the game engine column layout is written to a temporary
+file, then read back through each GridExcel mode, visiting every cell.
+"""
+
+__author__      = "Graham Klyne (GK@ACM.ORG)"
+__copyright__   = "Copyright 2017, G. Klyne"
+__license__     = "MIT (http://opensource.org/licenses/MIT)"
+
+import sys
+import os
+import tempfile
+import time
+
+import openpyxl
+
+from grid.grid import GridExcel
+
+def make_workbook(filename, nrows, ncols=56):
+    """
+    Write a synthetic workbook with a header row and 'nrows' data rows.
+    """
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append([ "col%d"%(j,) for j in range(ncols) ])
+    for i in range(nrows):
+        ws.append([ ("r%d_c%d"%(i, j) if (i+j) % 3 else None) for j in range(ncols) ])
+    wb.save(filename)
+    return
+
+def scan_grid(grid, nrows):
+    """
+    Visit every cell of every row, as analyze_table_data does.
+    """
+    count = 0
+    for row in grid.rows(0, nrows+1):
+        for v in row:
+            count += 1
+    return count
+
+def time_mode(filename, nrows, readonly):
+    t0 = time.time()
+    grid = GridExcel(filename, readonly=readonly)
+    t1 = time.time()
+    count = scan_grid(grid, nrows)
+    t2 = time.time()
+    return (t1-t0, t2-t1, count)
+
+def runMain():
+    nrows = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    fd, filename = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
+    try:
+        make_workbook(filename, nrows)
+        for label, readonly in (("full", False), ("readonly", True)):
+            (topen, tscan, count) = time_mode(filename, nrows, readonly)
+            print("%-8s open %8.3fs  scan %8.3fs  total %8.3fs  (%d cells)"%
+                  (label, topen, tscan, topen+tscan, count))
+    finally:
+        os.remove(filename)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(runMain())
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+
+"""
+Benchmark gridmatch template matching.
+
+Usage:
+    python bench_gridmatch.py [rules]
+    python bench_gridmatch.py --check
+
+Two cases are timed:
+
+- a pathological template of nested alternatives that share a prefix, for which 
+  plain matching takes time exponential in the nesting depth, and memoized 
+  (packrat) matching takes linear time;
+- the checklist template (grid/checklist_template.py) applied to a synthetic 
+  checklist with the given number of rules, using plain, memoized and compiled 
+  matching, and also applied to a checklist with no "End:" row, for which the 
+  match fails.
+
+Each mode is checked to give the same result or error as plain matching, and
+memoized matching of the pathological template is checked to grow at most
+linearly between two larger depths.  If a check fails, the failure is reported
+and the exit status is 1.
+
+With "--check", just these checks are run, on small cases that take a second or
+so.  This is the verification step for changes to grid/gridmatch.py.
+"""
+
+__author__      = "Graham Klyne (GK@ACM.ORG)"
+__copyright__   = "Copyright 2017, G. Klyne"
+__license__     = "MIT (http://opensource.org/licenses/MIT)"
+
+import sys
+import os
+import csv
+import tempfile
+import time
+
+from grid.grid import GridCSV
+from grid.gridmatch import GridMatchMemo, GridMatchError, anyval, text
+from grid import checklist_template
+
+CHECK_RULES = 30
+
+class CheckFailed(Exception):
+    pass
+
+def check(condition, message):
+    """
+    Raise CheckFailed with the given message if the condition is false (unlike
+    'assert', this is not disabled by "python -O").
+    """
+    if not condition:
+        raise CheckFailed(message)
+    return
+
+def write_csv(rows):
+    """
+    Write rows to a temporary CSV file, and return the file name.
+    """
+    fd, filename = tempfile.mkstemp(suffix=".csv")
+    with os.fdopen(fd, "wb") as csvfile:
+        writer = csv.writer(csvfile)
+        for row in rows:
+            writer.writerow(row)
+    return filename
+
+def pathological_matcher(depth):
+    """
+    Return template in which each level tries two alternatives that both start by 
+    matching the whole of the level below, and fail only after doing so.
+    """
+    m = anyval("first")
+    for i in range(depth):
+        m = (m // text("b")) | (m // text("c"))
+    return m
+
+def pathological_rows(depth):
+    return [ ["a"] ] + [ ["c"] for i in range(depth) ]
+
+def checklist_rows(nrules):
+    """
+    Return rows for a checklist spreadsheet with 'nrules' rules
+    """
+    rows = (
+        [ ["Prefixes:", "Prefix", "URI"]
+        , ["", "rdf",  "http://www.w3.org/1999/02/22-rdf-syntax-ns#"]
+        , ["", "rdfs", "http://www.w3.org/2000/01/rdf-schema#"]
+        , []
+        , ["Checklists:", "Target", "Purpose", "Model"]
+        , ["", "{+targetro}", "ready-to-release", "#complete_model"]
+        , []
+        , ["Model:", "#complete_model"]
+        , ["Items:", "Level", "Rule"]
+        ])
+    for i in range(nrules):
+        rows.append(["%03d"%i, ("MUST", "SHOULD", "MAY")[i%3], "#rule_%d"%i])
+    rows.append([])
+    for i in range(nrules):
+        rows.append(["Rule:", "#rule_%d"%i])
+        if i % 3 == 0:
+            rows.append(["", "ForEach:", "?x rdf:type ex:Thing%d"%i])
+            rows.append(["", "IsLive:", "{+x}"])
+        elif i % 3 == 1:
+            rows.append(["", "Exists:", "?x rdf:type ex:Thing%d"%i])
+        else:
+            rows.append(["", "Command:", "check %d"%i])
+            rows.append(["", "Response:", "ok"])
+        rows.append(["", "Pass:", "Rule %d passed"%i])
+        rows.append(["", "Fail:", "Rule %d failed"%i])
+        rows.append([])
+    rows.append(["End:"])
+    return rows
+
+def time_match(matcher, grid, mode):
+    """
+    Time a match using mode "plain", "memo" or "compiled".  Returns the elapsed time,
+    the match result and position (or None and the error text), and the memo table.
+    """
+    memo = GridMatchMemo() if mode == "memo" else None
+    if mode == "compiled":
+        matcher = matcher.compile()
+    t0 = time.time()
+    try:
+        if memo:
+            (result, pos) = matcher.memomatch(grid, 0, 0, memo)
+        else:
+            (result, pos) = matcher.match(grid, 0, 0)
+    except GridMatchError, e:
+        (result, pos) = (None, repr(e)+str(e))
+    return (time.time()-t0, result, pos, memo)
+
+def compare_modes(label, matcher, grid, modes):
+    (tplain, rplain, pplain, _) = time_match(matcher, grid, "plain")
+    report("%s plain"%label, tplain, None)
+    for mode in modes:
+        (t, r, p, memo) = time_match(matcher, grid, mode)
+        check((r, p) == (rplain, pplain), "%s %s: different result"%(label, mode))
+        report("%s %s"%(label, mode), t, memo)
+    return
+
+def check_linear_memo(depths=(40, 80), repeat=5):
+    """
+    Check that memoized matching of the pathological template grows at most
+    linearly between two nesting depths (too deep for plain matching), in both
+    memo table entries and best-of-'repeat' time, and that it gives the result
+    that plain matching gives at smaller depths.
+    """
+    measured = []
+    for depth in depths:
+        filename = write_csv(pathological_rows(depth))
+        try:
+            grid = GridCSV(filename, dialect="excel")
+            runs = [ time_match(pathological_matcher(depth), grid, "memo") for i in range(repeat) ]
+        finally:
+            os.remove(filename)
+        (t, result, pos, memo) = min(runs, key=lambda r: r[0])
+        check((result, pos) == ({"first": "a"}, (depth+1, 1)),
+            "pathological depth %d memo: unexpected result %r, %r"%(depth, result, pos)
+            )
+        report("pathological depth %d memo"%depth, t, memo)
+        measured.append((depth, t, memo.stats()["entries"]))
+    ((d1, t1, e1), (d2, t2, e2)) = measured
+    scale = float(d2)/d1
+    check(e2 <= e1*scale*1.1,
+        "memo entries grew from %d to %d for depth %d to %d"%(e1, e2, d1, d2)
+        )
+    # Allow for timing noise; exponential growth would be many orders larger
+    check(t2 <= t1*scale*2,
+        "memo time grew from %.4fs to %.4fs for depth %d to %d"%(t1, t2, d1, d2)
+        )
+    return
+
+def report(label, elapsed, memo):
+    txt = "%-34s %9.4fs"%(label, elapsed)
+    if memo:
+        txt += "  (hit rate %(hit_rate).2f, %(entries)d entries)"%memo.stats()
+    print(txt)
+    return
+
+def run_cases(nrules, depths):
+    for depth in depths:
+        filename = write_csv(pathological_rows(depth))
+        try:
+            grid = GridCSV(filename, dialect="excel")
+            compare_modes(
+                "pathological depth %d"%depth, pathological_matcher(depth), grid, 
+                ["memo", "compiled"]
+                )
+        finally:
+            os.remove(filename)
+    check_linear_memo()
+    for (label, rows) in (
+            ("checklist %d rules"%nrules, checklist_rows(nrules)),
+            ("checklist no End:",         checklist_rows(nrules)[:-1])
+            ):
+        filename = write_csv(rows)
+        try:
+            grid = GridCSV(filename, dialect="excel")
+            compare_modes(label, checklist_template.checklist, grid, ["memo", "compiled"])
+        finally:
+            os.remove(filename)
+    return
+
+def runMain():
+    checking = sys.argv[1:] == ["--check"]
+    try:
+        if checking:
+            run_cases(CHECK_RULES, (8, 12))
+        else:
+            run_cases(int(sys.argv[1]) if len(sys.argv) > 1 else 500, (8, 12, 16))
+    except CheckFailed, e:
+        print("FAILED: %s"%(e,))
+        return 1
+    if checking:
+        print("All checks passed")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(runMain())
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+"""
+Benchmark streaming Muzicode matching.
+
+Usage:
+    python bench_matcher.py [notes] [mode] [max_extra]
+
+Note sequences are extracted from "mkGameEngine2.json" and the MEI files in "mei"
+into a temporary directory, and matchers compiled for every stage.  For each
+stage, a synthetic performance of the given number of notes (default 100000) is
+generated: random notes, with each of the stage's Muzicodes played from time to
+time with up to 'max_extra' (default 2) random notes inserted between pattern
+notes.  The performance is written to a MIDI file, which is then replayed through
+the matcher.  The rate of matching, the time taken by each note that completes a
+Muzicode (match latency), and the number of played Muzicodes recognized (at their
+last note) are reported.  Further matches are expected where patterns are short
+or shared by several Muzicodes.
+"""
+
+__author__      = "Graham Klyne (GK@ACM.ORG)"
+__copyright__   = "Copyright 2017, G. Klyne"
+__license__     = "MIT (http://opensource.org/licenses/MIT)"
+
+import sys
+import os
+import os.path
+import json
+import shutil
+import tempfile
+import random
+import time
+import array
+import logging
+
+from noteseq import extract_stages
+from midifile import write_midi_notes, read_midi_notes
+from matcher import load_automata, Matcher, MAX_EXTRA_NOTES
+
+def automaton_patterns(automaton):
+    """
+    Return list of (name, [symbol, ...]) for the patterns compiled in an automaton.
+    """
+    symbols = {}
+    for (sym, mask) in automaton.masks.items():
+        pos = 0
+        while mask:
+            if mask & 1:
+                symbols[pos] = sym
+            mask >>= 1
+            pos  += 1
+    patterns = []
+    for pos in sorted(symbols):
+        if automaton.init & (1 << pos):
+            patterns.append([])
+        patterns[-1].append(symbols[pos])
+        if pos in automaton.ends:
+            patterns[-1] = (automaton.ends[pos], patterns[-1])
+    return patterns
+
+def synthetic_performance(automaton, nnotes, max_extra, rnd):
+    """
+    Return list of (time, pitch, velocity, channel) and list of (note number,
+    Muzicode name) for the last note of each Muzicode played.
+    """
+    patterns = automaton_patterns(automaton)
+    pitches  = []
+    played   = []
+    while len(pitches) < nnotes:
+        if rnd.random() < 0.01:
+            (name, pattern) = rnd.choice(patterns)
+            if automaton.mode == "interval":
+                seq = [0]
+                for interval in pattern:
+                    seq.append(seq[-1] + interval)
+                base = rnd.randint(21 - min(seq), 108 - max(seq))
+                seq  = [ base + p for p in seq ]
+            else:
+                seq = []
+                for p in pattern:
+                    seq.extend(rnd.randint(21, 108) for i in range(rnd.randint(0, max_extra)))
+                    seq.append(p)
+            pitches.extend(seq)
+            played.append((len(pitches)-1, name))
+        else:
+            pitches.append(rnd.randint(21, 108))
+    return ([ (i*0.1, p, 64, 0) for (i, p) in enumerate(pitches) ], played)
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values)-1, int(len(sorted_values)*p/100.0))]
+
+def runMain():
+    nnotes    = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    mode      = sys.argv[2] if len(sys.argv) > 2 else "pitch"
+    max_extra = int(sys.argv[3]) if len(sys.argv) > 3 else MAX_EXTRA_NOTES
+    if mode == "interval":
+        max_extra = 0
+    tmp_dir = tempfile.mkdtemp(prefix="matcher")
+    try:
+        with open("mkGameEngine2.json", "r") as instr:
+            jsondata = json.load(instr)
+        extract_stages(jsondata, "mei", tmp_dir)
+        automata = load_automata(tmp_dir, mode, max_extra)
+        rnd      = random.Random(1)
+        timer    = time.time
+        total    = 0
+        elapsed  = 0.0
+        latency  = array.array('d')
+        played   = 0
+        found    = 0
+        matched  = 0
+        for stage in sorted(automata):
+            if not automata[stage].names:
+                continue
+            (notes, expected) = synthetic_performance(automata[stage], nnotes, max_extra, rnd)
+            midifile = os.path.join(tmp_dir, stage+".mid")
+            write_midi_notes(midifile, notes)
+            pitches  = [ p for (t, p, v, c) in read_midi_notes(midifile) if v ]
+            matcher  = Matcher(automata, stage)
+            note_on  = matcher.note_on
+            reported = set()
+            t_start  = timer()
+            for (i, p) in enumerate(pitches):
+                t0 = timer()
+                m  = note_on(p)
+                if m:
+                    latency.append(timer() - t0)
+                    matched += len(m)
+                    reported.update( (i, name) for name in m )
+            elapsed += timer() - t_start
+            total   += len(pitches)
+            played  += len(expected)
+            found   += len([ e for e in expected if e in reported ])
+        latency = sorted(latency)
+        print("%d stages, %d notes: %.3fs, %.0f notes/s (mode %s, max_extra %d)"%
+            (len([ a for a in automata.values() if a.names ]), total, elapsed, total/elapsed, mode, max_extra)
+            )
+        if latency:
+            print("match latency: p50 %.2fus, p99 %.2fus, max %.2fus"%
+                (percentile(latency, 50)*1e6, percentile(latency, 99)*1e6, latency[-1]*1e6)
+                )
+        print("%d Muzicodes played, %d recognized, %d matches reported"%(played, found, matched))
+    finally:
+        shutil.rmtree(tmp_dir)
+    return 0
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    sys.exit(runMain())
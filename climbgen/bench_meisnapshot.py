@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+"""
+Benchmark MEI snapshot loading against XML parsing.
+
+Usage:
+    python bench_meisnapshot.py [MEIDIR] [repeat]
+
+For each MEI file in MEIDIR (default "mei"), the time to parse the file with
+ElementTree (where it is well-formed XML) and with the tolerant parser used to
+build snapshots is compared with the time to open its snapshot and look up one
+measure by xml:id.  Snapshots are built in a temporary directory.  Times are the
+best of 'repeat' (default 5) runs.
+"""
+
+__author__      = "Graham Klyne (GK@ACM.ORG)"
+__copyright__   = "Copyright 2017, G. Klyne"
+__license__     = "MIT (http://opensource.org/licenses/MIT)"
+
+import sys
+import os
+import os.path
+import shutil
+import tempfile
+import time
+import hashlib
+import xml.etree.cElementTree as ElementTree
+
+from meiindex import TAG_RE
+from meisnapshot import build_snapshot, open_snapshot, parse_mei
+
+def best_time(repeat, fn, *args):
+    best = None
+    for i in range(repeat):
+        t0 = time.time()
+        fn(*args)
+        t = time.time() - t0
+        best = t if best is None or t < best else best
+    return best
+
+def parse_etree(filename):
+    try:
+        ElementTree.parse(filename)
+    except ElementTree.ParseError:
+        return False
+    return True
+
+def parse_tolerant(filename):
+    with open(filename, "rb") as f:
+        data = f.read()
+    return parse_mei(data, hashlib.sha1(data).hexdigest())
+
+def last_measure_id(data):
+    xmlid = None
+    for m in TAG_RE.finditer(data):
+        if m.group(2) == "measure" and not m.group(1):
+            i = m.group(3).find('xml:id="')
+            if i >= 0:
+                xmlid = m.group(3)[i+8:m.group(3).index('"', i+8)]
+    return xmlid
+
+def load_snapshot(filename, snap_dir, digest, xmlid):
+    snap = open_snapshot(filename, snap_dir, digest)
+    e = snap.element_by_id(xmlid)
+    n = len(e.to_xml())
+    snap.close()
+    return n
+
+def runMain():
+    meidir = sys.argv[1] if len(sys.argv) > 1 else "mei"
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    snap_dir = tempfile.mkdtemp(prefix="meisnapshot")
+    totals = [0.0, 0.0, 0.0]
+    try:
+        print("%-32s %8s %10s %10s %10s"%("file", "bytes", "etree", "tolerant", "snapshot"))
+        for meifile in sorted(f for f in os.listdir(meidir) if f.endswith(".mei")):
+            filename = os.path.join(meidir, meifile)
+            with open(filename, "rb") as f:
+                data = f.read()
+            digest = hashlib.sha1(data).hexdigest()
+            xmlid  = last_measure_id(data)
+            build_snapshot(filename, snap_dir, digest)
+            if parse_etree(filename):
+                t_etree = best_time(repeat, parse_etree, filename)
+                totals[0] += t_etree
+                etree = "%8.2fms"%(t_etree*1000,)
+            else:
+                etree = "%10s"%("(invalid)",)
+            t_tolerant = best_time(repeat, parse_tolerant, filename)
+            t_snap     = best_time(repeat, load_snapshot, filename, snap_dir, digest, xmlid)
+            totals[1] += t_tolerant
+            totals[2] += t_snap
+            print("%-32s %8d %s %8.2fms %8.3fms"%
+                (meifile, len(data), etree, t_tolerant*1000, t_snap*1000)
+                )
+        print("%-32s %8s %8.2fms %8.2fms %8.3fms"%
+            ("total", "", totals[0]*1000, totals[1]*1000, totals[2]*1000)
+            )
+    finally:
+        shutil.rmtree(snap_dir)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(runMain())
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+"""
+Load test for the collection and MEI server.
+
+Usage:
+    python bench_server.py [requests] [concurrency] [base_url]
+
+Unless a base URL (e.g. "http://localhost:8000") is given, a server for "d/" and
+"mei" is started in a separate process on a free port.  The given number of
+requests (default 20000) are made by 'concurrency' (default 8) client threads,
+each using a persistent connection.  Requests are for entities (90%) and stage
+MEI files (10%), chosen at random; a quarter of them are conditional requests
+with the ETag from an earlier response.  Requests per second, latency
+percentiles and response status counts are reported.
+"""
+
+__author__      = "Graham Klyne (GK@ACM.ORG)"
+__copyright__   = "Copyright 2017, G. Klyne"
+__license__     = "MIT (http://opensource.org/licenses/MIT)"
+
+import sys
+import os
+import time
+import random
+import array
+import threading
+import multiprocessing
+import httplib
+import urlparse
+
+from refgraph import collection_files
+from climbserver import ClimbServer
+
+def request_paths(base_dir="d/", meidir="mei"):
+    entities = [ "/d/%s/"%(ref,) for (ref, filename) in collection_files(base_dir) ]
+    meifiles = [ "/mei/%s"%(f,) for f in sorted(os.listdir(meidir)) if f.endswith(".mei") ]
+    return (entities, meifiles)
+
+def client(host, port, paths, nrequests, seed, results):
+    """
+    Make requests on a persistent connection, appending latencies and status codes
+    to 'results'.
+    """
+    (entities, meifiles) = paths
+    rnd     = random.Random(seed)
+    conn    = httplib.HTTPConnection(host, port)
+    etags   = {}
+    latency = array.array('d')
+    status  = {}
+    nbytes  = 0
+    for i in xrange(nrequests):
+        path    = rnd.choice(meifiles) if rnd.random() < 0.1 else rnd.choice(entities)
+        headers = {}
+        if path in etags and rnd.random() < 0.25:
+            headers["If-None-Match"] = etags[path]
+        t0 = time.time()
+        conn.request("GET", path, headers=headers)
+        resp = conn.getresponse()
+        body = resp.read()
+        latency.append(time.time() - t0)
+        status[resp.status] = status.get(resp.status, 0) + 1
+        nbytes += len(body)
+        if resp.getheader("ETag"):
+            etags[path] = resp.getheader("ETag")
+    conn.close()
+    results.append((latency, status, nbytes))
+    return
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values)-1, int(len(sorted_values)*p/100.0))]
+
+def runMain():
+    nrequests   = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    base_url    = sys.argv[3] if len(sys.argv) > 3 else None
+    server_proc = None
+    if base_url:
+        url  = urlparse.urlparse(base_url)
+        host = url.hostname
+        port = url.port or 80
+    else:
+        server = ClimbServer(("127.0.0.1", 0), "d/", "mei")
+        (host, port) = server.server_address
+        server_proc  = multiprocessing.Process(target=server.serve_forever)
+        server_proc.daemon = True
+        server_proc.start()
+        server.socket.close()
+    try:
+        paths   = request_paths()
+        results = []
+        threads = [ threading.Thread(target=client,
+                        args=(host, port, paths, nrequests//concurrency, i, results))
+                    for i in range(concurrency) ]
+        t0 = time.time()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.time() - t0
+    finally:
+        if server_proc:
+            server_proc.terminate()
+            server_proc.join()
+    latency = sorted( l for (ls, s, b) in results for l in ls )
+    status  = {}
+    for (ls, s, b) in results:
+        for (code, n) in s.items():
+            status[code] = status.get(code, 0) + n
+    print("%d requests, %d clients: %.3fs, %.0f requests/s, %.1f MB"%
+        (len(latency), concurrency, elapsed, len(latency)/elapsed,
+         sum( b for (ls, s, b) in results )/1e6)
+        )
+    print("latency: p50 %.2fms, p99 %.2fms, p99.9 %.2fms, max %.2fms"%
+        tuple( v*1000 for v in
+               (percentile(latency, 50), percentile(latency, 99), percentile(latency, 99.9), latency[-1]) )
+        )
+    print("status: %s"%(", ".join( "%d: %d"%(c, n) for (c, n) in sorted(status.items()) ),))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(runMain())
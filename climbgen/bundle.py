@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+
+"""
+Single-file bundles of generated MELD entities
+
+A bundle holds all generated entities in one file, in one of two formats:
+
+- "ndjson": a header line containing the shared JSON-LD '@context', followed by
+  one line of compact JSON for each entity.
+- "graph": a single JSON-LD document with the shared '@context' and an '@graph'
+  array of entities, one per line.
+
+An entity's own '@context' is omitted when it is the same as the shared context
+(the context of the first entity written), and restored when the bundle is loaded.
+Entity contexts are relative to the entity's location in an Annalist collection
+'d/' directory.  The entity reference ("<type_id>/<entity_id>") is the entity's
+'@id'.
+
+Usage:
+    python bundle.py expand BUNDLE [DIR]
+
+expands a bundle into the Annalist 'd/' layout under DIR (default "d/").
+"""
+
+__author__      = "Graham Klyne (GK@ACM.ORG)"
+__copyright__   = "Copyright 2017, G. Klyne"
+__license__     = "MIT (http://opensource.org/licenses/MIT)"
+
+import sys
+import os
+import os.path
+import json
+import tempfile
+
+from entitywriter import EntityWriter, FILE_MODE, replace_file
+from profiling import profiler
+
+import logging
+log = logging.getLogger(__name__)
+
+BUNDLE_FORMATS = ("ndjson", "graph")
+
+def bundle_json_text(jsondata):
+    """
+    Return compact, single-line serialized JSON, with keys in a stable order.
+    """
+    return json.dumps(jsondata, sort_keys=True, separators=(',', ':'))
+
+class BundleWriter(object):
+    """
+    Output sink that writes generated entities to a single bundle file.
+
+    The bundle is written to a temporary file in the same directory, which is
+    renamed into place by 'close'.  The sink interface is the same as EntityWriter.
+
+    @param filename:    name of bundle file to create or replace.
+    @param format:      bundle format: "ndjson" or "graph".
+    """
+
+    def __init__(self, filename, format="ndjson"):
+        if format not in BUNDLE_FORMATS:
+            raise ValueError("Unknown bundle format: %s"%(format,))
+        self._filename = filename
+        self._format   = format
+        self._context  = None
+        self._count    = 0
+        fd, self._tmpname = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(filename)), prefix=".tmp_"
+            )
+        self._outstr   = os.fdopen(fd, "w")
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type:
+            self.abort()
+        else:
+            self.close()
+        return False
+
+    def write(self, entity_ref, jsondata):
+        """
+        Append entity data to the bundle.
+
+        @param entity_ref:  entity reference of the form "<type_id>/<entity_id>",
+                            which must be the same as the entity '@id'.
+        @param jsondata:    entity data.
+        """
+        log.info("BundleWriter.write: %s"%(entity_ref,))
+        profiler.count("entities:%s"%(jsondata.get("annal:type_id"),))
+        if jsondata.get("@id") != entity_ref:
+            raise ValueError(
+                "Entity @id %s does not match reference %s"%(jsondata.get("@id"), entity_ref)
+                )
+        if self._count == 0:
+            self._context = jsondata.get("@context")
+            self._write_header()
+        else:
+            self._outstr.write(",\n" if self._format == "graph" else "\n")
+        if jsondata.get("@context") == self._context:
+            jsondata = dict(jsondata)
+            del jsondata["@context"]
+        self._outstr.write(bundle_json_text(jsondata))
+        self._count += 1
+        return
+
+    def _write_header(self):
+        header = {"@context": self._context}
+        if self._format == "graph":
+            self._outstr.write(bundle_json_text(header)[:-1] + ',\n"@graph":[\n')
+        else:
+            self._outstr.write(bundle_json_text(header) + "\n")
+        return
+
+    def close(self):
+        """
+        Complete the bundle and rename it into place.
+        """
+        if self._outstr is None:
+            return
+        if self._count == 0:
+            self._write_header()
+        if self._format == "graph":
+            self._outstr.write("\n]}")
+        self._outstr.write("\n")
+        self._outstr.close()
+        self._outstr = None
+        try:
+            os.chmod(self._tmpname, FILE_MODE)
+            replace_file(self._tmpname, self._filename)
+        except:
+            os.remove(self._tmpname)
+            raise
+        log.info("BundleWriter: %d entities written to %s"%(self._count, self._filename))
+        return
+
+    def abort(self):
+        """
+        Discard the partly written bundle.
+        """
+        if self._outstr is not None:
+            self._outstr.close()
+            self._outstr = None
+            os.remove(self._tmpname)
+        return
+
+def load_bundle(filename):
+    """
+    Generator yields (entity_ref, jsondata) for each entity in a bundle file, in the
+    order written, with entity contexts restored.  The bundle format is detected from
+    the first line.
+    """
+    with open(filename, "r") as instr:
+        first = instr.readline()
+        try:
+            header = json.loads(first)
+        except ValueError, e:
+            header = None
+        if isinstance(header, dict) and "@graph" not in header:
+            # NDJSON: header line, then one entity per line
+            context  = header.get("@context")
+            entities = ( json.loads(line) for line in instr if line.strip() )
+        else:
+            instr.seek(0)
+            doc      = json.load(instr)
+            context  = doc.get("@context")
+            entities = iter(doc.get("@graph", []))
+        for jsondata in entities:
+            if "@context" not in jsondata:
+                jsondata["@context"] = context
+            yield (jsondata["@id"], jsondata)
+    return
+
+def expand_bundle(filename, base_dir, sink=None):
+    """
+    Write the entities in a bundle file to the Annalist 'd/' layout under 'base_dir',
+    or to the supplied sink.  Returns the number of entities written.
+    """
+    if sink is None:
+        with EntityWriter(base_dir) as sink:
+            return expand_bundle(filename, base_dir, sink=sink)
+    count = 0
+    for (entity_ref, jsondata) in load_bundle(filename):
+        sink.write(entity_ref, jsondata)
+        count += 1
+    return count
+
+def runMain():
+    if len(sys.argv) not in (3, 4) or sys.argv[1] != "expand":
+        print("Usage: %s expand BUNDLE [DIR]"%(sys.argv[0],))
+        return 2
+    base_dir = sys.argv[3] if len(sys.argv) > 3 else "d/"
+    count = expand_bundle(sys.argv[2], base_dir)
+    print("%d entities written to %s"%(count, base_dir))
+    return 0
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    sys.exit(runMain())
+
+# End.
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+
+"""
+Benchmark the climbgen pipeline on synthetic game engine workbooks.
+
+Usage:
+    python climbbench.py [--stages N [N ...]] [--output results.json]
+
+For each number of stages, a workbook and matching JSON file with the game engine
+column layout (stage columns A-J, auto actions K-S, Muzicode groups mc1: to mc5:)
+are generated in a temporary directory.  Each phase of the pipeline is timed 
+separately:
+
+    open        open the workbook (climbgen.open_spreadsheet)
+    analyze     extract stage data (climbgen.analyze_table_data)
+    construct   build entity data (climbgen.generate_meld_data, collecting entities 
+                in memory)
+    output      write entities to a 'd/' directory (entitywriter.EntityWriter)
+
+Each number of stages is run in a fresh worker process, so that memory used for
+one run does not affect the next.  Peak memory is the worker process peak resident
+set size (from getrusage) at the end of each phase, which includes earlier phases
+of the same run; the peak before the first phase is also reported.
+
+Results are printed and, if requested, saved as JSON so that runs can be compared 
+across commits.
+"""
+
+__author__      = "Graham Klyne (GK@ACM.ORG)"
+__copyright__   = "Copyright 2017, G. Klyne"
+__license__     = "MIT (http://opensource.org/licenses/MIT)"
+
+import sys
+import os
+import os.path
+import argparse
+import json
+import multiprocessing
+import platform
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+
+import openpyxl
+
+import climbgen
+from entitywriter import EntityWriter
+
+# Header row of the game engine spreadsheet (see mkGameEngine2.xlsx)
+HEADER = (
+    [ "stage", "next", "meifile", "no_effect", "rain_effect", "snow_effect"
+    , "wind_effect", "storm_effect", "sun_effect", "default_cue"
+    , "auto:", "cue", "midi", "delay", "midi2", "monitor", "v.animate", "v.background", "v.mc"
+    , "mc1:", "name", "cue", "midi", "monitor", "v.animate", "v.mc.delay", "v.mc", "app"
+    , "mc2:", "name", "cue", "midi", "monitor", "v.animate", "v.mc"
+    , "mc3:", "name", "cue", "midi", "monitor", "v.animate", "v.mc"
+    , "mc4:", "name", "cue", "midi", "monitor", "v.animate", "v.mc"
+    , "mc5:", "name", "cue", "midi", "monitor", "v.animate", "v.mc"
+    ])
+
+MC_GROUPS   = ["mc1:", "mc2:", "mc3:", "mc4:", "mc5:"]
+MC_TYPES    = ["choice", "disklavier", "challenge", "approaching"]
+MEI_FILES   = ["BaseCamp.mei", "1aTheAngryDeer.mei", "Path1a.mei", "5cFallingTrees.mei"]
+DEFAULT_STAGES = [27, 1000, 10000]
+
+def stage_id(i):
+    return "s%d"%(i,)
+
+def synthetic_stage(i, nstages):
+    """
+    Return (spreadsheet row, JSON entry) for stage i of nstages.
+
+    Stage i has (i % 5) + 1 Muzicodes, which cue stages further on.
+    """
+    row = [None]*len(HEADER)
+    def setcol(name, value, start=0):
+        row[HEADER.index(name, start)] = value
+        return
+    sid     = stage_id(i)
+    nxt     = stage_id(i+1) if i+1 < nstages else None
+    meifile = MEI_FILES[i % len(MEI_FILES)]
+    setcol("stage",   sid)
+    setcol("next",    nxt)
+    setcol("meifile", meifile)
+    for e in ("no_effect", "rain_effect", "snow_effect", "wind_effect", "storm_effect", "sun_effect"):
+        setcol(e, "Y" if (i+len(e)) % 2 else "N")
+    auto = HEADER.index("auto:")
+    setcol("cue",  nxt, auto)
+    setcol("midi", "90%02x7f"%(i % 128,), auto)
+    mcs = []
+    for g in range(i % 5 + 1):
+        beg  = HEADER.index(MC_GROUPS[g])
+        name = "%s_%d"%(sid, g+1)
+        cue  = stage_id(min(i+g+1, nstages-1))
+        row[beg] = str(g*4+1)
+        setcol("name", name, beg)
+        setcol("cue",  cue,  beg)
+        setcol("midi", "90%02x7f"%((i+g) % 128,), beg)
+        mcs.append(
+            { "name":           name
+            , "meielements":    [ "#measure-%015d"%(i*10+g) ] + 
+                                [ "#note-%015d"%(i*100+g*10+n) for n in range(4) ]
+            , "cue":            cue
+            , "type":           MC_TYPES[(i+g) % len(MC_TYPES)]
+            , "app":            "Muzicode %d of stage %s"%(g+1, sid)
+            })
+    stage_json = (
+        { "stage":      sid
+        , "next":       nxt
+        , "cue":        [ mc["cue"] for mc in mcs ]
+        , "meifile":    meifile
+        , "mcs":        mcs
+        })
+    return (row, stage_json)
+
+def make_synthetic_inputs(dirname, nstages):
+    """
+    Write synthetic mkGameEngine2.xlsx and mkGameEngine2.json files to 'dirname'.
+    """
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(HEADER)
+    jsondata = []
+    for i in range(nstages):
+        (row, stage_json) = synthetic_stage(i, nstages)
+        ws.append(row)
+        jsondata.append(stage_json)
+    wb.save(os.path.join(dirname, "mkGameEngine2.xlsx"))
+    with open(os.path.join(dirname, "mkGameEngine2.json"), "w") as outstr:
+        json.dump(jsondata, outstr)
+    return
+
+class CollectSink(object):
+    """
+    Output sink that keeps generated entities in memory
+    """
+    def __init__(self):
+        self.entities = []
+        return
+    def write(self, entity_ref, jsondata):
+        self.entities.append((entity_ref, jsondata))
+        return
+
+def peak_rss_kb():
+    # ru_maxrss is in kilobytes on Linux, bytes on Mac OS X
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+def run_phase(phases, name, func, *args):
+    t0 = time.time()
+    c0 = time.clock()
+    result = func(*args)
+    phases[name] = (
+        { "wall":           time.time() - t0
+        , "cpu":            time.clock() - c0
+        , "peak_rss_kb":    peak_rss_kb()
+        })
+    return result
+
+def bench_pipeline(nstages, threads=4):
+    """
+    Run the pipeline on synthetic inputs with nstages stages, and return a dictionary 
+    of results for each phase.
+    """
+    base_rss = peak_rss_kb()
+    workdir  = tempfile.mkdtemp(prefix="climbbench_")
+    try:
+        make_synthetic_inputs(workdir, nstages)
+        phases = {}
+        table  = run_phase(phases, "open", 
+            climbgen.open_spreadsheet, os.path.join(workdir, "mkGameEngine2.xlsx")
+            )
+        data   = run_phase(phases, "analyze", climbgen.analyze_table_data, table)
+        jsondata = climbgen.open_json(workdir, "mkGameEngine2.json")
+        sink   = CollectSink()
+        run_phase(phases, "construct", 
+            climbgen.generate_meld_data, data, jsondata, None, sink
+            )
+        def output():
+            with EntityWriter(os.path.join(workdir, "d"), threads=threads) as writer:
+                for (entity_ref, jsondata) in sink.entities:
+                    writer.write(entity_ref, jsondata)
+            return
+        run_phase(phases, "output", output)
+        return (
+            { "stages":     nstages
+            , "entities":   len(sink.entities)
+            , "base_rss_kb": base_rss
+            , "phases":     phases
+            })
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def bench_pipeline_process(nstages, threads=4):
+    """
+    Run 'bench_pipeline' in a fresh worker process, and return its results.
+    """
+    pool = multiprocessing.Pool(1, maxtasksperchild=1)
+    try:
+        return pool.apply(bench_pipeline, (nstages, threads))
+    finally:
+        pool.close()
+        pool.join()
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], 
+            cwd=os.path.dirname(os.path.abspath(__file__))
+            ).strip()
+    except (OSError, subprocess.CalledProcessError), e:
+        return None
+
+def runMain():
+    parser = argparse.ArgumentParser(description="Benchmark the climbgen pipeline")
+    parser.add_argument("--stages", type=int, nargs="+", default=DEFAULT_STAGES,
+        help="Numbers of stages to benchmark (default: %(default)s; up to 100000)")
+    parser.add_argument("--threads", type=int, default=4,
+        help="Number of output writer threads (default: %(default)s)")
+    parser.add_argument("--output",
+        help="File to which JSON results are written")
+    options = parser.parse_args()
+    results = (
+        { "commit":     git_commit()
+        , "timestamp":  time.strftime("%Y-%m-%dT%H:%M:%S")
+        , "python":     platform.python_version()
+        , "runs":       []
+        })
+    for nstages in options.stages:
+        run = bench_pipeline_process(nstages, threads=options.threads)
+        results["runs"].append(run)
+        print("%7d stages %-10s %43s  peak %8dKB"%(nstages, "start", "", run["base_rss_kb"]))
+        for name in ("open", "analyze", "construct", "output"):
+            phase = run["phases"][name]
+            print("%7d stages %-10s wall %8.3fs  cpu %8.3fs  peak %8dKB"%
+                  (nstages, name, phase["wall"], phase["cpu"], phase["peak_rss_kb"]))
+    if options.output:
+        with open(options.output, "w") as outstr:
+            json.dump(results, outstr, sort_keys=True, indent=2, separators=(',', ': '))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(runMain())
@@ -13,46 +13,53 @@ import os.path
 # import shutil
 import json
 # import errno
+import argparse
 
 import logging
 log = logging.getLogger(__name__)
 
 from grid.grid import GridExcel
+from entitywriter import EntityWriter
+from manifest import GenerationManifest, MANIFEST_FILE
+from meiindex import MEIIndex
+from bundle import BundleWriter, BUNDLE_FORMATS
+from entitystore import EntityStore
+from meistore import MEIStore, check_stage_mei
+from transitions import build_transitions, save_transitions, print_diagnostics
+from profiling import profiler
 
-def open_spreadsheet(name):
-    g = GridExcel(name)
+@profiler.profiled("open_spreadsheet")
+def open_spreadsheet(name, readonly=True):
+    g = GridExcel(name, readonly=readonly)
+    if profiler.enabled:
+        g.count_cells()
     return g
 
+@profiler.profiled("open_json")
 def open_json(dirname, filename):
     with open(dirname+"/"+filename) as inpstr:
         jsondata = json.load(inpstr)
     return jsondata
 
-def write_json(dirname, filename, jsondata):
-    log.info("write_json: %s/%s"%(dirname, filename))    
-    try:
-        os.makedirs(dirname)
-    except OSError:
-        pass
-    with open(dirname+"/"+filename, "w") as outstr:
-        json.dump(jsondata, outstr, sort_keys=True, indent=2, separators=(',', ': '))
-    return
+# Column names (per Excel) for the game engine spreadsheet layout
+COL_NAMES = (
+    [ "A", "B", "C", "D", "E", "F", "G", "H", "I", "J"  # stage
+    , "K", "L", "M", "N", "O", "P", "Q", "R", "S"       # auto
+    , "T", "U", "V", "W", "X", "Y", "Z", "AA", "AB"     # mc1
+    , "AC", "AD", "AE", "AF", "AG", "AH", "AI"          # mc2
+    , "AJ", "AK", "AL", "AM", "AN", "AO", "AP"          # mc3
+    , "AQ", "AR", "AS", "AT", "AU", "AV", "AW"          # mc4
+    , "AX", "AY", "AZ", "BC", "BD"                      # mc5
+    , "BE", "BF", "BG", "BH", "BI"                      # unused?
+    ])
+
+COL_INDEXES = dict( (n, i) for (i, n) in enumerate(COL_NAMES) )
 
 def col_index(name):
     """
     Map column name (per Excel) to index
     """
-    col_names = (
-        [ "A", "B", "C", "D", "E", "F", "G", "H", "I", "J"  # stage
-        , "K", "L", "M", "N", "O", "P", "Q", "R", "S"       # auto
-        , "T", "U", "V", "W", "X", "Y", "Z", "AA", "AB"     # mc1
-        , "AC", "AD", "AE", "AF", "AG", "AH", "AI"          # mc2
-        , "AJ", "AK", "AL", "AM", "AN", "AO", "AP"          # mc3
-        , "AQ", "AR", "AS", "AT", "AU", "AV", "AW"          # mc4
-        , "AX", "AY", "AZ", "BC", "BD"                      # mc5
-        , "BE", "BF", "BG", "BH", "BI"                      # unused?
-        ])
-    return col_names.index(name)
+    return COL_INDEXES[name]
 
 def get_col_index(hdr, name, start=0, end=9999):
     """
@@ -75,91 +82,110 @@ def get_col(hdr, row, name, start=0, end=9999):
         return row[j]
     return None
 
+class StageRowExtractor(object):
+    """
+    Extract stage data from spreadsheet rows.
+
+    Column positions for every (group, field) used are located once, when the 
+    extractor is compiled from the header row, so that each data row is then 
+    processed with a single pass over the required fields.
+
+    @param hdr:     header row of the game engine spreadsheet.
+
+    A ValueError is raised if the header does not contain an expected column.
+    """
+
+    stage_fields = (
+        [ "stage", "next", "meifile"
+        , "no_effect", "rain_effect", "snow_effect", "wind_effect", "storm_effect", "sun_effect"
+        , "default_cue"
+        ])
+    auto_fields = (
+        [ "cue", "midi", "midi2", "delay", "monitor"
+        , "v.animate", "v.background", "v.mc", "v.mc.delay", "app"
+        ])
+    auto_required = ["cue", "midi"]
+    mc_groups = ["mc1:", "mc2:", "mc3:", "mc4:", "mc5:"]
+    mc_fields = (
+        [ "name", "cue", "midi", "monitor"
+        , "v.animate", "v.mc", "v.mc.delay", "app"
+        ])
+    mc_unused = ["midi2", "delay", "v.background"]
+    mc_required = ["name", "cue", "midi"]
+
+    def __init__(self, hdr):
+        hdr = list(hdr)
+        self._stage_cols = [ (f, self._find(hdr, None, f)) for f in self.stage_fields ]
+        # Auto actions: columns K up to (but not including) S
+        auto_beg = col_index("K")
+        auto_end = col_index("S")
+        self._auto_cols = self._find_group(
+            hdr, "auto", self.auto_fields, self.auto_required, auto_beg, auto_end
+            )
+        # Muzicode-triggered actions: each group runs up to the start of the next
+        mc_begs = [ self._find(hdr, None, g) for g in self.mc_groups ]
+        self._mc_cols = []
+        for i in range(len(mc_begs)):
+            mc_beg = mc_begs[i]
+            mc_end = mc_begs[i+1] if i+1 < len(mc_begs) else 9999
+            mc_cols = self._find_group(
+                hdr, hdr[mc_beg], self.mc_fields, self.mc_required, mc_beg, mc_end
+                )
+            self._mc_cols.append((hdr[mc_beg], mc_beg, mc_cols))
+        return
+
+    def _find(self, hdr, group, name, start=0, end=9999, required=True):
+        j = get_col_index(hdr, name, start=start, end=end)
+        if j < 0 and required:
+            if group:
+                raise ValueError(
+                    "Spreadsheet header has no column '%s' in group '%s'"%(name, group)
+                    )
+            raise ValueError("Spreadsheet header has no column '%s'"%(name,))
+        return j
+
+    def _find_group(self, hdr, group, fields, required, start, end):
+        return (
+            [ (f, self._find(hdr, group, f, start=start, end=end, required=(f in required)))
+              for f in fields
+            ])
+
+    def stage_id(self, row):
+        """
+        Return stage identifier from row, or None
+        """
+        return row[self._stage_cols[0][1]]
+
+    def extract(self, row):
+        """
+        Return stage data dictionary for the supplied row
+        """
+        stagedata = dict( (f, row[j]) for (f, j) in self._stage_cols )
+        auto_actions = { "mc": None, "mc_hdr": None, "name": None }
+        for (f, j) in self._auto_cols:
+            auto_actions[f] = row[j] if j >= 0 else None
+        stagedata["auto_actions"] = auto_actions
+        stagedata["mc_actions"]   = [None]
+        for (mc_hdr, mc_beg, mc_cols) in self._mc_cols:
+            mc_actions = { "mc_hdr": mc_hdr, "mc": row[mc_beg] }
+            for f in self.mc_unused:
+                mc_actions[f] = None
+            for (f, j) in mc_cols:
+                mc_actions[f] = row[j] if j >= 0 else None
+            stagedata["mc_actions"].append(mc_actions)
+        return stagedata
+
+@profiler.profiled("analyze_table_data")
 def analyze_table_data(table):
     data = { "stages": [] }
-    hdr  = table[0]
-    # log.debug("hdr %r"%(hdr,))
+    extractor = StageRowExtractor(table[0])
     for row in table.rows(1):
         # log.debug("row %r"%(row,))
-        # For each stage-related field...
-        stage_id  = get_col(hdr, row, "stage")
-        if not stage_id:
+        if not extractor.stage_id(row):
             break
-        # log.info("stage_id: %r"%(stage_id,))
-        stagedata = (
-            { "stage":          stage_id
-            , "next":           get_col(hdr, row, "next")
-            , "meifile":        get_col(hdr, row, "meifile")
-            , "no_effect":      get_col(hdr, row, "no_effect")
-            , "rain_effect":    get_col(hdr, row, "rain_effect")
-            , "snow_effect":    get_col(hdr, row, "snow_effect")
-            , "wind_effect":    get_col(hdr, row, "wind_effect")
-            , "storm_effect":   get_col(hdr, row, "storm_effect")
-            , "sun_effect":     get_col(hdr, row, "sun_effect")
-            , "default_cue":    get_col(hdr, row, "default_cue")
-            , "auto_actions":   (
-                { "name":           None
-                , "cue":            None
-                , "midi":           None
-                , "midi2":          None
-                , "delay":          None
-                , "monitor":        None
-                , "v.animate":      None
-                , "v.background":   None
-                , "v.mc":           None
-                , "v.mc.delay":     None
-                , "app":            None
-                })
-            , "mc_actions":     [None]
-            })
-        # log.debug("stage %(stage)s"%stagedata)
-        # Auto actions
-        auto_beg = col_index("K")
-        auto_end = col_index("S")
-        auto_actions = (
-            { "mc":           None
-            , "mc_hdr":       None
-            , "name":         None
-            , "cue":          get_col(hdr, row, "cue",          start=auto_beg, end=auto_end)
-            , "midi":         get_col(hdr, row, "midi",         start=auto_beg, end=auto_end)
-            , "midi2":        get_col(hdr, row, "midi2",        start=auto_beg, end=auto_end)
-            , "delay":        get_col(hdr, row, "delay",        start=auto_beg, end=auto_end)
-            , "monitor":      get_col(hdr, row, "monitor",      start=auto_beg, end=auto_end)
-            , "v.animate":    get_col(hdr, row, "v.animate",    start=auto_beg, end=auto_end)
-            , "v.background": get_col(hdr, row, "v.background", start=auto_beg, end=auto_end)
-            , "v.mc":         get_col(hdr, row, "v.mc",         start=auto_beg, end=auto_end)
-            , "v.mc.delay":   get_col(hdr, row, "v.mc.delay",   start=auto_beg, end=auto_end)
-            , "app":          get_col(hdr, row, "app",          start=auto_beg, end=auto_end)
-            })
-        stagedata["auto_actions"] = auto_actions
-        # Muzicode-triggered actions
-        muzicode_groups = (
-            { 1:  get_col_index(hdr, "mc1:")
-            , 2:  get_col_index(hdr, "mc2:")
-            , 3:  get_col_index(hdr, "mc3:")
-            , 4:  get_col_index(hdr, "mc4:")
-            , 5:  get_col_index(hdr, "mc5:")
-            })
-        for mcg in muzicode_groups:
-            mc_beg = muzicode_groups[mcg]
-            mc_end = muzicode_groups.get(mcg+1, 9999)
-            mc_actions = (
-                { "mc_hdr":       hdr[mc_beg]
-                , "mc":           row[mc_beg]
-                , "name":         get_col(hdr, row, "name",       start=mc_beg, end=mc_end)
-                , "cue":          get_col(hdr, row, "cue",        start=mc_beg, end=mc_end)
-                , "midi":         get_col(hdr, row, "midi",       start=mc_beg, end=mc_end)
-                , "monitor":      get_col(hdr, row, "monitor",    start=mc_beg, end=mc_end)
-                , "midi2":        None
-                , "delay":        None
-                , "v.animate":    get_col(hdr, row, "v.animate",  start=mc_beg, end=mc_end)
-                , "v.background": None
-                , "v.mc":         get_col(hdr, row, "v.mc",       start=mc_beg, end=mc_end)
-                , "v.mc.delay":   get_col(hdr, row, "v.mc.delay", start=mc_beg, end=mc_end)
-                , "app":          get_col(hdr, row, "app",        start=mc_beg, end=mc_end)
-                })
-            stagedata["mc_actions"].append(mc_actions)
-        data["stages"].append(stagedata)
+        data["stages"].append(extractor.extract(row))
+    if profiler.enabled and hasattr(table, "cells_accessed"):
+        profiler.count("cells_accessed", table.cells_accessed)
     return data
 
 def make_id(type_id, entity_id):
@@ -167,16 +193,34 @@ def make_id(type_id, entity_id):
         return "%s/%s"%(type_id, entity_id)
     return ""
 
-def generate_meld_data(data, jsondata, base_dir):
+@profiler.profiled("generate_meld_data")
+def generate_meld_data(data, jsondata, base_dir, sink=None, manifest=None):
+    """
+    Generate MELD entities for all stages.
+
+    @param sink:        output sink for generated entities; if not supplied, entities
+                        are written via the manifest, if supplied, or else under 
+                        'base_dir'.
+    @param manifest:    if supplied, a 'manifest.GenerationManifest' used to skip stages 
+                        whose inputs are unchanged.
+    """
     # See:
     #   https://github.com/oerc-music/meld/blob/master/server/generate_climb_scores.py 
     #   https://github.com/cgreenhalgh/fast-performance-demo/tree/master/scoretools
     #
+    if sink is None and manifest is not None:
+        # The manifest records generated entities and passes them on to its writer
+        return generate_meld_data(data, jsondata, base_dir, sink=manifest, manifest=manifest)
+    if sink is None:
+        with EntityWriter(base_dir) as sink:
+            return generate_meld_data(data, jsondata, base_dir, sink=sink, manifest=manifest)
     status = 0
     stage_json = {}
     for sj in jsondata:
         stage_json[sj["stage"]]= sj 
     for stage in data["stages"]:
+        if manifest and not manifest.start_stage(stage["stage"], stage, stage_json[stage["stage"]]):
+            continue
         log.info("generate_meld_data: stage %(stage)s"%stage)
         # Generate climb_Stage_Score entity
         stage_id              = stage["stage"]
@@ -252,26 +296,24 @@ def generate_meld_data(data, jsondata, base_dir):
         generate_actions(
             auto_actions_id, auto_actions_ref, 
             "Stage %s auto actions"%(stage_id,), 
-            stage["auto_actions"]
+            stage["auto_actions"], sink
             )
         # Generate Muzicode descriptions; add links as "frbr:part {"@id": ...} values
         mc_json = {}
         for mj in stage_json[stage_id]["mcs"]:
             mc_json[mj["name"]] = mj
         for mc in stage["mc_actions"]:
-            mc_ref  = generate_muzicode_data(stage_id, stage["meifile"], mc, mc_json)
+            mc_ref  = generate_muzicode_data(stage_id, stage["meifile"], mc, mc_json, sink)
             mc_part = { "@id": mc_ref }
             if mc_ref:
                 stage_score["frbr:part"].append(mc_part)
         # Write out stage data (locally - ready to copy later)
-        outdir = "d/"+stage_ref
-        write_json(outdir, "entity_data.jsonld", stage_score)
+        sink.write(stage_ref, stage_score)
         # Write out published score description (locally - ready to copy later)
-        outdir = "d/"+published_score_ref
-        write_json(outdir, "entity_data.jsonld", stage_published_score)
+        sink.write(published_score_ref, stage_published_score)
     return status
 
-def generate_actions(actions_id, actions_ref, actions_label, actions_data):
+def generate_actions(actions_id, actions_ref, actions_label, actions_data, sink):
     # See: https://github.com/cgreenhalgh/fast-performance-demo/tree/master/scoretools
     actions_json = (
         {
@@ -304,11 +346,11 @@ def generate_actions(actions_id, actions_ref, actions_label, actions_data):
           "climb:action_app_message":           actions_data["app"]
         })
     # Write out actions data (locally - ready to copy later)
-    outdir = "d/"+actions_ref
-    write_json(outdir, "entity_data.jsonld", actions_json)
+    sink.write(actions_ref, actions_json)
     return
 
-def generate_muzicode_data(stage_id, stage_meifile, mc_actions, mc_actions_json):
+@profiler.profiled("generate_muzicode_data")
+def generate_muzicode_data(stage_id, stage_meifile, mc_actions, mc_actions_json, sink):
     # See:
     #   https://github.com/oerc-music/meld/blob/master/server/generate_climb_scores.py 
     #   https://github.com/cgreenhalgh/fast-performance-demo/tree/master/scoretools
@@ -371,8 +413,7 @@ def generate_muzicode_data(stage_id, stage_meifile, mc_actions, mc_actions_json)
               "mc:type":                mc_type_ref
             })
         # Write out muzicode data (locally - ready to copy later)
-        outdir = "d/"+mc_ref
-        write_json(outdir, "entity_data.jsonld", mc_json)
+        sink.write(mc_ref, mc_json)
         # Generate description of Muzicide embodiment in MEI, if defined
         # (@@ Some "Muzicodes" apear to just generate MIDO outputs with no other aossciated data)
         if mc_mei_ref:
@@ -401,12 +442,11 @@ def generate_muzicode_data(stage_id, stage_meifile, mc_actions, mc_actions_json)
                   "rdfs:member":    [ meielement(e) for e in mc_meielements ]
                 })
             # Write out muzicode MEI embodiment description (locally - ready to copy later)
-            outdir = "d/"+mc_mei_ref
-            write_json(outdir, "entity_data.jsonld", mc_mei_json)
+            sink.write(mc_mei_ref, mc_mei_json)
         # Generate actions description
         actions_ref   = make_id("climb_Actions", mc_id)
         actions_label = mc_label
-        generate_actions(mc_id, actions_ref, actions_label, mc_actions)
+        generate_actions(mc_id, actions_ref, actions_label, mc_actions, sink)
         # Generate event template
         # NOTE: MELD does not define a role for event annotations not within a MELD session.
         #       Event annotations not within a MELD session are here arbitrarily considered to be 
@@ -438,20 +478,172 @@ def generate_muzicode_data(stage_id, stage_meifile, mc_actions, mc_actions_json)
               "oa:motivatedBy":     mc_type_ref
             })
         # Write out event data (locally - ready to copy later)
-        outdir = "d/"+event_ref
-        write_json(outdir, "entity_data.jsonld", event_json)
+        sink.write(event_ref, event_json)
     return mc_ref
 
+def check_muzicode_references(data, jsondata, meiindex):
+    """
+    Check that MEI element references for each Muzicode identify elements in the 
+    stage MEI file.  Returns a list of (stage_id, muzicode name, reference) for 
+    each dangling reference found, including all references from a stage that has
+    no MEI file.
+    """
+    dangling = []
+    stage_json = {}
+    for sj in jsondata:
+        stage_json[sj["stage"]]= sj 
+    meifiles = set( stage["meifile"] for stage in data["stages"] if stage["meifile"] )
+    meiindex.build([ f for f in meifiles if meiindex.has_file(f) ])
+    for stage in data["stages"]:
+        stage_id = stage["stage"]
+        if stage_id not in stage_json:
+            continue
+        if not stage["meifile"]:
+            # No MEI file, so every Muzicode element reference is dangling
+            for mj in stage_json[stage_id]["mcs"]:
+                log.warning(
+                    "check_muzicode_references: stage %s, Muzicode %s: stage has no MEI file"%
+                    (stage_id, mj["name"])
+                    )
+                dangling.extend( (stage_id, mj["name"], ref) for ref in mj["meielements"] )
+            continue
+        for mj in stage_json[stage_id]["mcs"]:
+            for ref in meiindex.dangling_refs(stage["meifile"], mj["meielements"]):
+                log.warning(
+                    "check_muzicode_references: stage %s, Muzicode %s: %s%s not found"%
+                    (stage_id, mj["name"], stage["meifile"], ref)
+                    )
+                dangling.append((stage_id, mj["name"], ref))
+    return dangling
+
 def generate_climb_meld(configbase, argv):
     """
     Top-level logic for MELD generation from spreadsheet data
     """
-    climb_table = open_spreadsheet("mkGameEngine2.xlsx")
-    climb_data  = analyze_table_data(climb_table)
-    climb_json  = open_json(".", "mkGameEngine2.json")
-    status = generate_meld_data(climb_data, climb_json, os.path.join(configbase, "d/"))
+    options  = parse_args(argv)
+    if options.profile:
+        profiler.enable(cprofile_phase=options.cprofile)
+        try:
+            return generate_climb_meld_options(configbase, options)
+        finally:
+            profiler.save_report(options.profile)
+    return generate_climb_meld_options(configbase, options)
+
+def generate_climb_meld_options(configbase, options):
+    """
+    MELD generation from spreadsheet data, using parsed command line options
+    """
+    base_dir = os.path.join(configbase, "d/")
+    inputs   = [options.workbook, options.json]
+    manifest_file = os.path.join(configbase, MANIFEST_FILE)
+    if options.bundle:
+        writer = BundleWriter(os.path.join(configbase, options.bundle), options.bundle_format)
+    elif options.store:
+        writer = EntityStore(os.path.join(configbase, options.store))
+        # The store has its own manifest, as its content may differ from d/
+        manifest_file = os.path.join(configbase, options.store) + "." + MANIFEST_FILE
+        if not options.incremental:
+            # Replace all stored entities, so the store holds just those generated
+            writer.clear()
+    else:
+        writer = EntityWriter(base_dir)
+    manifest = None
+    sink     = writer
+    if options.incremental:
+        manifest = GenerationManifest(manifest_file, writer)
+        sink     = manifest
+        if ( manifest.inputs_unchanged(inputs) and 
+             not ( options.remove_stale or options.check_mei or 
+                   options.mei_store or options.transitions ) ):
+            log.info("generate_climb_meld: inputs unchanged")
+            writer.close()
+            return 0
+    # On failure, a bundle is discarded and store updates are rolled back
+    with writer:
+        climb_table = open_spreadsheet(options.workbook)
+        climb_data  = analyze_table_data(climb_table)
+        climb_json  = open_json(os.path.dirname(options.json) or ".", os.path.basename(options.json))
+        status = generate_meld_data(climb_data, climb_json, base_dir, sink=sink, manifest=manifest)
+        if options.transitions:
+            transitions = build_transitions(climb_data)
+            save_transitions(os.path.join(configbase, options.transitions), transitions)
+            print_diagnostics(transitions["diagnostics"])
+        if manifest:
+            # Stale entities are deleted from a store in the same transaction
+            manifest.remove_stale(remove=options.remove_stale)
+    # MEI indexing may use a process pool, so is done after writer threads have finished
+    if options.check_mei:
+        meiindex = MEIIndex(os.path.join(configbase, options.mei_dir))
+        if check_muzicode_references(climb_data, climb_json, meiindex):
+            status = 1
+    if options.mei_store:
+        meidir   = os.path.join(configbase, options.mei_dir)
+        meifiles = sorted(set( s["meifile"] for s in climb_data["stages"] if s["meifile"] ))
+        problems = check_stage_mei(
+            meifiles, MEIStore(os.path.join(configbase, options.mei_store)), MEIIndex(meidir)
+            )
+        for (meifile, problem) in problems:
+            log.error("MEI file %s: %s"%(meifile, problem))
+        if problems:
+            status = 1
+    if manifest:
+        manifest.save()
     return status
 
+def parse_args(argv):
+    """
+    Parse command line options (argv[0] is the program name)
+    """
+    parser = argparse.ArgumentParser(
+        prog=os.path.basename(argv[0]),
+        description="Generate Climb! MELD data from spreadsheet"
+        )
+    parser.add_argument("--workbook", default="mkGameEngine2.xlsx",
+        help="Game engine spreadsheet (default: %(default)s)")
+    parser.add_argument("--json", default="mkGameEngine2.json",
+        help="Stage and Muzicode descriptions (default: %(default)s)")
+    parser.add_argument("--incremental", action="store_true",
+        help="Regenerate only stages whose inputs have changed, using a manifest "+
+             "of inputs and generated entities (%s)"%(MANIFEST_FILE,))
+    parser.add_argument("--remove-stale", action="store_true",
+        help="With --incremental, remove previously generated entities that are "+
+             "no longer generated from any input (default: report them)")
+    parser.add_argument("--check-mei", action="store_true",
+        help="Check that Muzicode MEI element references exist in the stage MEI files")
+    parser.add_argument("--mei-dir", default="mei",
+        help="Directory containing stage MEI files (default: %(default)s)")
+    parser.add_argument("--bundle", metavar="FILE",
+        help="Write all generated entities to a single bundle file, instead of "+
+             "the Annalist collection layout under d/")
+    parser.add_argument("--bundle-format", choices=BUNDLE_FORMATS, default="ndjson",
+        help="With --bundle, write newline-delimited JSON (ndjson) or a JSON-LD "+
+             "document with an @graph array (graph) (default: %(default)s)")
+    parser.add_argument("--store", metavar="DB",
+        help="Insert or replace all generated entities in an SQLite entity store, "+
+             "instead of the Annalist collection layout under d/ (with "+
+             "--incremental, just new or changed entities, using a manifest DB.%s)"%
+             (MANIFEST_FILE,))
+    parser.add_argument("--mei-store", metavar="STORE",
+        help="Check that stage MEI files are in the content-addressed MEI store "+
+             "STORE, with the same content as files in the MEI directory")
+    parser.add_argument("--transitions", metavar="FILE",
+        help="Also write a precomputed stage transition table to FILE, and print "+
+             "its diagnostics")
+    parser.add_argument("--profile", metavar="REPORT",
+        help="Write a JSON report of phase timings and counters to REPORT")
+    parser.add_argument("--cprofile", metavar="PHASE",
+        help="With --profile, capture cProfile data for the named phase "+
+             "(e.g. generate_meld_data), saved to REPORT.prof")
+    options = parser.parse_args(argv[1:])
+    if options.bundle and options.store:
+        parser.error("--bundle cannot be used with --store")
+    if options.cprofile and profiler.threaded(options.cprofile):
+        parser.error("--cprofile cannot be used for phase %s, which runs on worker threads"%
+                     (options.cprofile,))
+    if options.bundle and options.incremental:
+        parser.error("--incremental cannot be used with --bundle")
+    return options
+
 def runMain():
     """
     Main program transfer function for setup.py console script
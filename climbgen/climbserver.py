@@ -0,0 +1,329 @@
+#!/usr/bin/env python
+
+"""
+Read-only HTTP server for a generated collection and stage MEI files
+
+Serves entity data from a collection 'd/' directory under "/d/" (an entity
+directory URL, e.g. "/d/climb_Stage_Score/1a/", serves its "entity_data.jsonld"),
+and stage MEI files under "/mei/" (so 'climbstage:<meifile>' resolves to
+"/mei/<meifile>").
+
+Each request is handled in its own thread, with persistent (HTTP/1.1)
+connections.  Responses carry a strong ETag (the SHA-1 digest of the content) and
+Last-Modified time, and conditional GET (If-None-Match, If-Modified-Since) and
+single byte-range requests (Range, If-Range) are supported.  Small files are
+cached in memory, least recently used first discarded, and revalidated against
+the file's size and modification time; larger files are streamed in blocks.
+
+Usage:
+    python climbserver.py [--port PORT] [--host HOST] [--dir DIR] [--mei-dir MEIDIR]
+"""
+
+__author__      = "Graham Klyne (GK@ACM.ORG)"
+__copyright__   = "Copyright 2017, G. Klyne"
+__license__     = "MIT (http://opensource.org/licenses/MIT)"
+
+import sys
+import os
+import os.path
+import re
+import socket
+import email.utils
+import hashlib
+import threading
+import collections
+import urllib
+import argparse
+import BaseHTTPServer
+import SocketServer
+
+from entitywriter import ENTITY_DATA_FILE
+
+import logging
+log = logging.getLogger(__name__)
+
+DEFAULT_PORT        = 8000
+CACHE_SIZE          = 32*1024*1024
+CACHE_FILE_SIZE     = 1024*1024
+CACHE_ETAGS         = 4096
+STREAM_BLOCK_SIZE   = 65536
+CONTENT_TYPES       = (
+    { ".jsonld":    "application/ld+json"
+    , ".json":      "application/json"
+    , ".mei":       "application/xml"
+    , ".xml":       "application/xml"
+    })
+RANGE_RE            = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+class FileCache(object):
+    """
+    Cache of file content and ETags, revalidated against file size and
+    modification time.  Files are read and hashed without holding the cache lock,
+    so concurrent misses for a file may each read it; the last result is cached.
+
+    @param cache_size:  maximum total size of cached content.
+    @param file_size:   maximum size of a file whose content is cached.
+    @param etags:       maximum number of ETags cached for larger files.
+    """
+
+    def __init__(self, cache_size=CACHE_SIZE, file_size=CACHE_FILE_SIZE, etags=CACHE_ETAGS):
+        self._cache_size = cache_size
+        self._file_size  = file_size
+        self._max_etags  = etags
+        self._lock       = threading.Lock()
+        self._content    = collections.OrderedDict()   # filename -> (stamp, etag, data)
+        self._etags      = collections.OrderedDict()   # filename -> (stamp, etag)
+        self._cached     = 0
+        self.hits        = 0
+        self.misses      = 0
+        return
+
+    def get(self, filename, st):
+        """
+        Return (etag, data) for a file with the given stat result; 'data' is None
+        if the file is too large to cache, in which case it should be streamed.
+        """
+        stamp = (st.st_size, st.st_mtime, st.st_ino)
+        with self._lock:
+            entry = self._content.pop(filename, None)
+            if entry and entry[0] == stamp:
+                self._content[filename] = entry
+                self.hits += 1
+                return entry[1:]
+            if entry:
+                self._cached -= len(entry[2])
+            etag = self._etags.pop(filename, None)
+            if etag and etag[0] == stamp and st.st_size > self._file_size:
+                self._etags[filename] = etag
+                self.hits += 1
+                return (etag[1], None)
+            self.misses += 1
+        if st.st_size > self._file_size:
+            h = hashlib.sha1()
+            with open(filename, "rb") as f:
+                while True:
+                    block = f.read(STREAM_BLOCK_SIZE)
+                    if not block:
+                        break
+                    h.update(block)
+            etag = '"%s"'%(h.hexdigest(),)
+            with self._lock:
+                self._etags.pop(filename, None)
+                self._etags[filename] = (stamp, etag)
+                while len(self._etags) > self._max_etags:
+                    self._etags.popitem(last=False)
+            return (etag, None)
+        with open(filename, "rb") as f:
+            data = f.read()
+        etag = '"%s"'%(hashlib.sha1(data).hexdigest(),)
+        with self._lock:
+            old = self._content.pop(filename, None)
+            if old:
+                self._cached -= len(old[2])
+            self._content[filename] = (stamp, etag, data)
+            self._cached += len(data)
+            while self._cached > self._cache_size and self._content:
+                (f, (s, e, d)) = self._content.popitem(last=False)
+                self._cached -= len(d)
+        return (etag, data)
+
+def parse_range(header, size):
+    """
+    Return (first, last) byte positions for a single-range "Range" header value,
+    None if the header should be ignored, or False if the range is unsatisfiable.
+    """
+    m = RANGE_RE.match(header.strip())
+    if not m or (not m.group(1) and not m.group(2)):
+        return None
+    if not m.group(1):
+        # Suffix range: last N bytes
+        n = int(m.group(2))
+        if n == 0 or size == 0:
+            return False
+        return (max(0, size-n), size-1)
+    first = int(m.group(1))
+    last  = int(m.group(2)) if m.group(2) else size-1
+    if first >= size:
+        return False
+    if last < first:
+        return None
+    return (first, min(last, size-1))
+
+def etag_matches(header, etag):
+    tags = [ t.strip() for t in header.split(",") ]
+    return "*" in tags or etag in tags
+
+class ClimbRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Handles GET and HEAD requests for collection entities and MEI files.
+    """
+
+    protocol_version = "HTTP/1.1"
+    server_version   = "ClimbServer/1.0"
+    # Buffer each response, which is flushed when complete: with unbuffered
+    # writes, the headers go in separate small packets and persistent connections
+    # stall on delayed acknowledgements.
+    wbufsize         = STREAM_BLOCK_SIZE
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return
+
+    def log_message(self, format, *args):
+        log.debug("%s %s"%(self.address_string(), format%args))
+        return
+
+    def do_GET(self):
+        self.serve(send_body=True)
+        return
+
+    def do_HEAD(self):
+        self.serve(send_body=False)
+        return
+
+    def resolve(self, path):
+        """
+        Return file name for a request path, or None.
+        """
+        path = urllib.unquote(path.split("?", 1)[0].split("#", 1)[0])
+        for (prefix, base_dir) in self.server.roots:
+            if path.startswith(prefix):
+                rel = path[len(prefix):]
+                break
+        else:
+            return None
+        parts = [ p for p in rel.split("/") if p ]
+        if any( p in (".", "..") or "\\" in p for p in parts ):
+            return None
+        filename = os.path.join(base_dir, *parts)
+        if os.path.isdir(filename):
+            filename = os.path.join(filename, ENTITY_DATA_FILE)
+        return filename
+
+    def serve(self, send_body):
+        filename = self.resolve(self.path)
+        try:
+            st = os.stat(filename) if filename else None
+        except OSError, e:
+            st = None
+        if st is None or not os.path.isfile(filename):
+            self.send_error(404, "Not found")
+            return
+        try:
+            (etag, data) = self.server.cache.get(filename, st)
+        except IOError, e:
+            self.send_error(404, "Not found")
+            return
+        size     = st.st_size if data is None else len(data)
+        modified = email.utils.formatdate(st.st_mtime, usegmt=True)
+        # Conditional request
+        inm = self.headers.getheader("If-None-Match")
+        ims = self.headers.getheader("If-Modified-Since")
+        not_modified = False
+        if inm is not None:
+            not_modified = etag_matches(inm, etag)
+        elif ims is not None:
+            t = email.utils.parsedate_tz(ims)
+            not_modified = t is not None and int(st.st_mtime) <= email.utils.mktime_tz(t)
+        if not_modified:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", modified)
+            self.end_headers()
+            return
+        # Range request
+        byte_range = None
+        rng = self.headers.getheader("Range")
+        if rng is not None:
+            if_range = self.headers.getheader("If-Range")
+            if if_range is None or if_range.strip() == etag:
+                byte_range = parse_range(rng, size)
+        if byte_range is False:
+            self.send_response(416)
+            self.send_header("Content-Range", "bytes */%d"%(size,))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        (first, last) = byte_range or (0, size-1)
+        self.send_response(206 if byte_range else 200)
+        self.send_header("Content-Type",
+            CONTENT_TYPES.get(os.path.splitext(filename)[1], "application/octet-stream")
+            )
+        self.send_header("Content-Length", str(last-first+1))
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", modified)
+        self.send_header("Accept-Ranges", "bytes")
+        if byte_range:
+            self.send_header("Content-Range", "bytes %d-%d/%d"%(first, last, size))
+        self.end_headers()
+        if not send_body:
+            return
+        if data is not None:
+            self.wfile.write(data[first:last+1])
+        else:
+            self.stream(filename, first, last-first+1)
+        return
+
+    def stream(self, filename, offset, length):
+        with open(filename, "rb") as f:
+            f.seek(offset)
+            while length > 0:
+                block = f.read(min(STREAM_BLOCK_SIZE, length))
+                if not block:
+                    break
+                self.wfile.write(block)
+                length -= len(block)
+        return
+
+class ClimbServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    Threaded HTTP server for a collection 'd/' directory and MEI directory.
+
+    @param address:     (host, port) to listen on; port 0 selects a free port.
+    @param base_dir:    collection 'd/' directory, served under "/d/".
+    @param meidir:      MEI directory, served under "/mei/".
+    @param cache:       FileCache (a new one is created if not supplied).
+    """
+
+    daemon_threads      = True
+    allow_reuse_address = True
+    request_queue_size  = 128
+
+    def __init__(self, address, base_dir="d/", meidir="mei", cache=None):
+        self.roots = [("/d/", base_dir), ("/mei/", meidir)]
+        self.cache = cache or FileCache()
+        BaseHTTPServer.HTTPServer.__init__(self, address, ClimbRequestHandler)
+        return
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog=os.path.basename(argv[0]),
+        description="Serve collection entities and stage MEI files"
+        )
+    parser.add_argument("--host", default="localhost",
+        help="Host name or address to listen on (default: %(default)s)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT,
+        help="Port to listen on (default: %(default)s)")
+    parser.add_argument("--dir", default="d/",
+        help="Annalist collection entity directory (default: %(default)s)")
+    parser.add_argument("--mei-dir", default="mei",
+        help="Directory containing stage MEI files (default: %(default)s)")
+    return parser.parse_args(argv[1:])
+
+def runMain():
+    options = parse_args(sys.argv)
+    server  = ClimbServer((options.host, options.port), options.dir, options.mei_dir)
+    print("Serving %s and %s on http://%s:%d/"%((options.dir, options.mei_dir) + server.server_address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    return 0
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    sys.exit(runMain())
+
+# End.
@@ -0,0 +1,159 @@
+"""
+Muzicode-to-actions dispatcher built from generated MELD entities
+
+The collection is read once, and for each stage a dictionary is built that maps
+each Muzicode name (its entity id) to an ActionRecord holding the actions from
+the 'climb_Actions' entity that is the body of the Muzicode's annotation.
+Dispatching a trigger is then a two-level dictionary lookup, with no JSON-LD
+access.
+"""
+
+__author__      = "Graham Klyne (GK@ACM.ORG)"
+__copyright__   = "Copyright 2017, G. Klyne"
+__license__     = "MIT (http://opensource.org/licenses/MIT)"
+
+import json
+
+from refgraph import collection_files
+
+import logging
+log = logging.getLogger(__name__)
+
+# ActionRecord attribute, climb_Actions property
+ACTION_PROPERTIES = (
+    [ ("cue_stage",         "climb:cue_stage")
+    , ("midi",              "climb:action_midi")
+    , ("midi2",             "climb:action_midi2_delayed")
+    , ("midi2_delay",       "climb:action_midi2_delay_value")
+    , ("monitor_visual",    "climb:action_monitor_visual")
+    , ("background_visual", "climb:action_background_visual")
+    , ("animation",         "climb:action_animation")
+    , ("animation_delay",   "climb:action_animation_delay_value")
+    , ("mc_visual",         "climb:action_mc_visual")
+    , ("mc_delay",          "climb:action_mc_delay")
+    , ("app_message",       "climb:action_app_message")
+    ])
+
+def ref_id(ref):
+    """
+    Return entity id from an entity reference, or None.
+    """
+    return ref.rsplit("/", 1)[-1] if ref else None
+
+class ActionRecord(object):
+    """
+    Actions to be performed when a Muzicode is recognized (or a stage starts).
+    Attributes are per ACTION_PROPERTIES, plus 'stage' and 'muzicode'; the cue
+    stage is an entity id, or None.
+    """
+
+    __slots__ = ["stage", "muzicode"] + [ a for (a, p) in ACTION_PROPERTIES ]
+
+    def __init__(self, stage, muzicode, actions):
+        self.stage    = stage
+        self.muzicode = muzicode
+        for (a, p) in ACTION_PROPERTIES:
+            setattr(self, a, actions.get(p))
+        self.cue_stage = ref_id(self.cue_stage)
+        return
+
+    def __repr__(self):
+        return "ActionRecord(%s)"%(
+            ", ".join( "%s=%r"%(a, getattr(self, a)) for a in self.__slots__
+                       if getattr(self, a) is not None )
+            )
+
+class Dispatcher(object):
+    """
+    Dispatcher of actions for Muzicodes recognized during a performance.
+
+    @param emit:    if supplied, a function called with the ActionRecord for each
+                    dispatched trigger.  It is expected to send the MIDI data, and
+                    to display the visual and app messages, that are defined.
+    """
+
+    def __init__(self, emit=None):
+        self._emit   = emit
+        self._stages = {}           # stage id -> { Muzicode name -> ActionRecord }
+        self._auto   = {}           # stage id -> ActionRecord
+        return
+
+    def load_entities(self, entities):
+        """
+        Build action records from an iterable of (entity_ref, jsondata), such as
+        'bundle.load_bundle' or 'EntityStore.entities'.
+        """
+        by_type = {}
+        for (entity_ref, jsondata) in entities:
+            by_type.setdefault(jsondata.get("annal:type_id"), {})[entity_ref] = jsondata
+        actions     = by_type.get("climb_Actions", {})
+        annotations = by_type.get("climb_Annotation", {})
+        # Muzicode reference -> actions reference
+        bodies = dict(
+            (a.get("oa:hasTarget"), a.get("oa:hasBody")) for a in annotations.values()
+            )
+        for (stage_ref, stage) in by_type.get("climb_Stage_Score", {}).items():
+            stage_id = stage["annal:id"]
+            records  = self._stages.setdefault(stage_id, {})
+            for part in stage.get("frbr:part", []):
+                mc_ref  = part["@id"]
+                act_ref = bodies.get(mc_ref)
+                if act_ref in actions:
+                    mc_name = ref_id(mc_ref)
+                    records[mc_name] = ActionRecord(stage_id, mc_name, actions[act_ref])
+                else:
+                    log.warning("Dispatcher: no actions for %s in stage %s"%(mc_ref, stage_id))
+            auto_ref = "climb_Actions/%s"%(stage.get("climb:auto"),)
+            if auto_ref in actions:
+                self._auto[stage_id] = ActionRecord(stage_id, None, actions[auto_ref])
+        return self
+
+    def load_collection(self, base_dir):
+        """
+        Build action records from an Annalist collection 'd/' directory.
+        """
+        def entities():
+            for (entity_ref, filename) in collection_files(base_dir):
+                try:
+                    with open(filename, "r") as instr:
+                        jsondata = json.load(instr)
+                except IOError, e:
+                    continue
+                yield (entity_ref, jsondata)
+            return
+        return self.load_entities(entities())
+
+    def stages(self):
+        return sorted(self._stages)
+
+    def muzicodes(self, stage_id):
+        return sorted(self._stages.get(stage_id, {}))
+
+    def lookup(self, stage_id, mc_name):
+        """
+        Return ActionRecord for a Muzicode in a stage, or None.
+        """
+        records = self._stages.get(stage_id)
+        return records.get(mc_name) if records else None
+
+    def dispatch(self, stage_id, mc_name):
+        """
+        Dispatch actions for a Muzicode recognized in a stage: returns the
+        ActionRecord (or None), having passed it to the emit function.
+        """
+        records = self._stages.get(stage_id)
+        record  = records.get(mc_name) if records else None
+        if record is not None and self._emit:
+            self._emit(record)
+        return record
+
+    def dispatch_auto(self, stage_id):
+        """
+        Dispatch the actions for the start of a stage.
+        """
+        record = self._auto.get(stage_id)
+        if record is not None and self._emit:
+            self._emit(record)
+        return record
+
+# End.
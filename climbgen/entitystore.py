@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+
+"""
+SQLite-backed indexed store for generated MELD entities
+
+Entities are stored as JSON text, keyed by entity reference ("<type_id>/<entity_id>",
+which is also the entity '@id'), with indexed columns for the entity type and for
+the stage and Muzicode type values used to select entities:
+
+    type_id         annal:type_id
+    cue_stage       climb:cue_stage
+    next_stage      climb:next_stage
+    mc_type         mc:type
+
+Stage and Muzicode type values are indexed by entity id (e.g. "5a" for both "5a"
+and "climb_Stage_Score/5a", and "DISKLAVIER" for "climb_Muzicode_Type/DISKLAVIER"),
+and are queried the same way.
+
+An EntityStore can be used as the output sink for generated entities, in which case
+each entity is inserted or replaced (climbgen first clears the store, so that it
+holds just the entities generated, except when generating incrementally, when
+unchanged entities are kept and stale entities are deleted), or can be loaded from an Annalist collection
+'d/' directory, and exported back to that layout.
+
+Usage:
+    python entitystore.py ingest DB [DIR]
+    python entitystore.py export DB [DIR]
+    python entitystore.py query DB [--type TYPE] [--cue-stage STAGE]
+                                   [--next-stage STAGE] [--mc-type MCTYPE]
+"""
+
+__author__      = "Graham Klyne (GK@ACM.ORG)"
+__copyright__   = "Copyright 2017, G. Klyne"
+__license__     = "MIT (http://opensource.org/licenses/MIT)"
+
+import sys
+import os
+import os.path
+import json
+import sqlite3
+import argparse
+
+from entitywriter import EntityWriter, ENTITY_DATA_FILE
+from bundle import bundle_json_text
+from profiling import profiler
+
+import logging
+log = logging.getLogger(__name__)
+
+# Indexed columns: column name, entity property, query option
+INDEX_COLUMNS = (
+    [ ("type_id",    "annal:type_id",    "type")
+    , ("cue_stage",  "climb:cue_stage",  "cue_stage")
+    , ("next_stage", "climb:next_stage", "next_stage")
+    , ("mc_type",    "mc:type",          "mc_type")
+    ])
+
+SCHEMA = (
+    [ """CREATE TABLE IF NOT EXISTS entity (
+            ref         TEXT PRIMARY KEY,
+            type_id     TEXT,
+            cue_stage   TEXT,
+            next_stage  TEXT,
+            mc_type     TEXT,
+            data        TEXT NOT NULL
+            )"""
+    ] +
+    [ "CREATE INDEX IF NOT EXISTS entity_%s ON entity (%s)"%(c, c)
+      for (c, p, o) in INDEX_COLUMNS
+    ])
+
+def index_value(value):
+    """
+    Return value for an indexed column: the final path segment of a non-empty
+    reference, or None.
+    """
+    if not value:
+        return None
+    return value.rsplit("/", 1)[-1]
+
+class EntityStore(object):
+    """
+    Indexed entity store in an SQLite database file.
+
+    Writes are made in a single transaction, which is committed by 'commit' or
+    'close', or rolled back if the store is used as a context manager and an 
+    exception occurs.  The sink interface is the same as EntityWriter.
+
+    @param dbfilename:  name of SQLite database file, created if not present.
+    """
+
+    def __init__(self, dbfilename):
+        self._db = sqlite3.connect(dbfilename)
+        for stmt in SCHEMA:
+            self._db.execute(stmt)
+        self._db.commit()
+        self.written = 0
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type:
+            self._db.rollback()
+        self.close()
+        return False
+
+    def write(self, entity_ref, jsondata):
+        """
+        Insert or replace entity data in the store.
+
+        @param entity_ref:  entity reference of the form "<type_id>/<entity_id>"
+        @param jsondata:    entity data.
+        """
+        log.info("EntityStore.write: %s"%(entity_ref,))
+        profiler.count("entities:%s"%(jsondata.get("annal:type_id"),))
+        self._insert(entity_ref, jsondata)
+        return
+
+    def write_text(self, entity_ref, text):
+        """
+        Insert or replace already-serialized entity data in the store.
+
+        @param entity_ref:  entity reference of the form "<type_id>/<entity_id>"
+        @param text:        serialized entity data, per 'entitywriter.entity_json_text'.
+        """
+        log.info("EntityStore.write_text: %s"%(entity_ref,))
+        self._insert(entity_ref, json.loads(text))
+        return
+
+    def _insert(self, entity_ref, jsondata):
+        self._db.execute(
+            "INSERT OR REPLACE INTO entity VALUES (?, ?, ?, ?, ?, ?)",
+            [entity_ref, jsondata.get("annal:type_id")] +
+            [ index_value(jsondata.get(p)) for (c, p, o) in INDEX_COLUMNS[1:] ] +
+            [bundle_json_text(jsondata)]
+            )
+        self.written += 1
+        return
+
+    def has_entity(self, entity_ref):
+        return self._db.execute(
+            "SELECT 1 FROM entity WHERE ref = ?", (entity_ref,)
+            ).fetchone() is not None
+
+    def delete(self, entity_ref):
+        self._db.execute("DELETE FROM entity WHERE ref = ?", (entity_ref,))
+        return
+
+    def clear(self):
+        """
+        Delete all entities (in the current transaction, so that entities are 
+        restored if the transaction is rolled back).
+        """
+        self._db.execute("DELETE FROM entity")
+        return
+
+    def commit(self):
+        self._db.commit()
+        return
+
+    def close(self):
+        """
+        Commit outstanding writes and close the database.
+        """
+        if self._db:
+            self._db.commit()
+            self._db.close()
+            self._db = None
+        return
+
+    def get(self, entity_ref):
+        """
+        Return entity data for the indicated entity, or None.
+        """
+        row = self._db.execute(
+            "SELECT data FROM entity WHERE ref = ?", (entity_ref,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def refs(self, **selectors):
+        """
+        Return sorted list of references of entities selected by keyword arguments
+        'type', 'cue_stage', 'next_stage' and 'mc_type' (see 'entities').
+        """
+        return [ ref for (ref, data) in self._select("ref, NULL", selectors) ]
+
+    def entities(self, **selectors):
+        """
+        Generator yields (entity_ref, jsondata) for entities selected by keyword
+        arguments, in reference order.
+
+        type:       annal:type_id value
+        cue_stage:  climb:cue_stage stage id
+        next_stage: climb:next_stage stage id
+        mc_type:    mc:type Muzicode type id
+        """
+        for (ref, data) in self._select("ref, data", selectors):
+            yield (ref, json.loads(data))
+        return
+
+    def _select(self, columns, selectors):
+        options = dict( (o, (c, p)) for (c, p, o) in INDEX_COLUMNS )
+        where   = []
+        params  = []
+        for (o, v) in selectors.items():
+            if o not in options:
+                raise ValueError("Unknown entity selector: %s"%(o,))
+            (c, p) = options[o]
+            where.append("%s = ?"%(c,))
+            params.append(v if c == "type_id" else index_value(v))
+        stmt = "SELECT %s FROM entity"%(columns,)
+        if where:
+            stmt += " WHERE " + " AND ".join(where)
+        stmt += " ORDER BY ref"
+        return self._db.execute(stmt, params)
+
+    def ingest(self, base_dir):
+        """
+        Load all entities from an Annalist collection 'd/' directory.  Returns the
+        number of entities loaded.
+        """
+        count = 0
+        for type_id in sorted(os.listdir(base_dir)):
+            type_dir = os.path.join(base_dir, type_id)
+            if not os.path.isdir(type_dir):
+                continue
+            for entity_id in sorted(os.listdir(type_dir)):
+                filename = os.path.join(type_dir, entity_id, ENTITY_DATA_FILE)
+                if os.path.isfile(filename):
+                    with open(filename, "r") as instr:
+                        self.write(type_id+"/"+entity_id, json.load(instr))
+                    count += 1
+        self.commit()
+        return count
+
+    def export(self, base_dir, sink=None, **selectors):
+        """
+        Write selected entities (default all) to the Annalist 'd/' layout under
+        'base_dir', or to the supplied sink.  Returns the number of entities written.
+        """
+        if sink is None:
+            with EntityWriter(base_dir) as sink:
+                return self.export(base_dir, sink=sink, **selectors)
+        count = 0
+        for (entity_ref, jsondata) in self.entities(**selectors):
+            sink.write(entity_ref, jsondata)
+            count += 1
+        return count
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog=os.path.basename(argv[0]),
+        description="Load, export and query an indexed store of MELD entities"
+        )
+    parser.add_argument("command", choices=["ingest", "export", "query"])
+    parser.add_argument("db", help="SQLite database file")
+    parser.add_argument("dir", nargs="?", default="d/",
+        help="Annalist collection entity directory (default: %(default)s)")
+    for (c, p, o) in INDEX_COLUMNS:
+        parser.add_argument("--"+o.replace("_", "-"), dest=o, metavar=o.upper(),
+            help="Select entities with %s value %s"%(p, o.upper()))
+    return parser.parse_args(argv[1:])
+
+def runMain():
+    options   = parse_args(sys.argv)
+    selectors = dict( (o, getattr(options, o)) for (c, p, o) in INDEX_COLUMNS
+                      if getattr(options, o) is not None )
+    with EntityStore(options.db) as store:
+        if options.command == "ingest":
+            count = store.ingest(options.dir)
+            print("%d entities loaded from %s"%(count, options.dir))
+        elif options.command == "export":
+            count = store.export(options.dir, **selectors)
+            print("%d entities written to %s"%(count, options.dir))
+        else:
+            for ref in store.refs(**selectors):
+                print(ref)
+    return 0
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    sys.exit(runMain())
+
+# End.
@@ -0,0 +1,210 @@
+"""
+Batched, atomic entity writer for generated MELD data
+"""
+
+__author__      = "Graham Klyne (GK@ACM.ORG)"
+__copyright__   = "Copyright 2017, G. Klyne"
+__license__     = "MIT (http://opensource.org/licenses/MIT)"
+
+import os
+import os.path
+import errno
+import json
+import shutil
+import tempfile
+import threading
+from multiprocessing.pool import ThreadPool
+
+from profiling import profiler
+
+import logging
+log = logging.getLogger(__name__)
+
+ENTITY_DATA_FILE = "entity_data.jsonld"
+
+# Permissions for written files (mkstemp creates files readable by owner only)
+_umask = os.umask(0)
+os.umask(_umask)
+FILE_MODE = 0o666 & ~_umask
+
+def entity_json_text(jsondata):
+    """
+    Return serialized JSON for an entity, formatted as written to an Annalist collection.
+    """
+    return json.dumps(jsondata, sort_keys=True, indent=2, separators=(',', ': '))
+
+def replace_file(tmpname, filename):
+    """
+    Rename a file into place, replacing any existing file of that name.
+    """
+    try:
+        os.rename(tmpname, filename)
+    except OSError, e:
+        # Windows does not allow rename over an existing file; elsewhere, the
+        # existing file is left in place
+        if os.name != "nt" or not os.path.exists(filename):
+            raise
+        os.remove(filename)
+        os.rename(tmpname, filename)
+    return
+
+def write_file_atomic(filename, text):
+    """
+    Write text to a named file via a temporary file in the same directory, which is 
+    then renamed into place.  A reader never sees a partially written file.
+    """
+    dirname = os.path.dirname(filename)
+    fd, tmpname = tempfile.mkstemp(dir=dirname, prefix=".tmp_", suffix=".jsonld")
+    try:
+        with os.fdopen(fd, "w") as outstr:
+            outstr.write(text)
+        os.chmod(tmpname, FILE_MODE)
+        replace_file(tmpname, filename)
+    except:
+        if os.path.exists(tmpname):
+            os.remove(tmpname)
+        raise
+    return
+
+class EntityWriter(object):
+    """
+    Output sink for generated entities.
+
+    Entities are queued by calling 'write', then serialized and written on a bounded 
+    pool of worker threads.  If an entity is written more than once, the data last
+    queued is what remains.  Each type directory is created once.  Call 'close' to 
+    wait for all queued writes to complete: if any write failed, the first error is 
+    raised at that point.
+
+    @param base_dir:    directory in which entity type directories are created
+                        (i.e. the 'd/' directory of an Annalist collection).
+    @param threads:     number of worker threads.
+    @param maxpending:  maximum number of queued writes, after which 'write' blocks.
+    """
+
+    def __init__(self, base_dir, threads=4, maxpending=None):
+        self._base_dir  = base_dir
+        self._pool      = ThreadPool(threads)
+        self._pending   = threading.BoundedSemaphore(maxpending or threads*8)
+        self._lock      = threading.Lock()
+        self._ref_locks = [ threading.Lock() for i in range(64) ]
+        self._queued    = {}        # entity_ref -> number of last queued write
+        self._nqueued   = 0
+        self._type_dirs = set()
+        self._errors    = []
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def write(self, entity_ref, jsondata):
+        """
+        Queue entity data to be written to '<base_dir>/<entity_ref>/entity_data.jsonld'
+
+        @param entity_ref:  entity reference of the form "<type_id>/<entity_id>"
+        @param jsondata:    entity data; not modified after being passed to the writer.
+        """
+        log.info("EntityWriter.write: %s"%(entity_ref,))
+        profiler.count("entities:%s"%(jsondata.get("annal:type_id"),))
+        self._queue(entity_ref, jsondata, None)
+        return
+
+    def write_text(self, entity_ref, text):
+        """
+        Queue already-serialized entity data to be written.
+
+        @param entity_ref:  entity reference of the form "<type_id>/<entity_id>"
+        @param text:        serialized entity data, per 'entity_json_text'.
+        """
+        log.info("EntityWriter.write_text: %s"%(entity_ref,))
+        self._queue(entity_ref, None, text)
+        return
+
+    def has_entity(self, entity_ref):
+        """
+        Return True if data for the indicated entity has been written.
+        """
+        return os.path.exists(os.path.join(self._base_dir, entity_ref, ENTITY_DATA_FILE))
+
+    def delete(self, entity_ref):
+        """
+        Remove the indicated entity directory.  Queued writes are not affected, so
+        this should not be used for an entity that has been queued for writing.
+        """
+        shutil.rmtree(os.path.join(self._base_dir, entity_ref), ignore_errors=True)
+        return
+
+    def close(self):
+        """
+        Wait for all queued writes to complete.
+        """
+        if self._pool:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+        if self._errors:
+            (entity_ref, e) = self._errors[0]
+            log.error("EntityWriter: %d write(s) failed"%(len(self._errors),))
+            raise e
+        return
+
+    def _queue(self, entity_ref, jsondata, text):
+        self._pending.acquire()
+        with self._lock:
+            self._nqueued += 1
+            self._queued[entity_ref] = self._nqueued
+            n = self._nqueued
+        self._pool.apply_async(self._write_entity, (entity_ref, jsondata, text, n))
+        return
+
+    @profiler.profiled("write_entity", threaded=True)
+    def _write_entity(self, entity_ref, jsondata, text, n):
+        # Writes of the same entity are serialized, and a write superseded by one 
+        # queued later is skipped, so the last data queued is what remains
+        ref_lock = self._ref_locks[hash(entity_ref) % len(self._ref_locks)]
+        try:
+            with ref_lock:
+                with self._lock:
+                    if self._queued[entity_ref] != n:
+                        return
+                self._write_entity_data(entity_ref, jsondata, text)
+        except Exception, e:
+            log.error("EntityWriter: %s: %s"%(entity_ref, e))
+            with self._lock:
+                self._errors.append((entity_ref, e))
+        finally:
+            self._pending.release()
+        return
+
+    def _write_entity_data(self, entity_ref, jsondata, text):
+        if text is None:
+            text = entity_json_text(jsondata)
+        entity_dir = os.path.join(self._base_dir, entity_ref)
+        self._make_entity_dir(entity_dir)
+        write_file_atomic(os.path.join(entity_dir, ENTITY_DATA_FILE), text)
+        profiler.count("files_written")
+        profiler.count("bytes_written", len(text))
+        return
+
+    def _make_entity_dir(self, entity_dir):
+        type_dir = os.path.dirname(entity_dir)
+        with self._lock:
+            if type_dir not in self._type_dirs:
+                try:
+                    os.makedirs(type_dir)
+                except OSError, e:
+                    if e.errno != errno.EEXIST:
+                        raise
+                self._type_dirs.add(type_dir)
+        try:
+            os.mkdir(entity_dir)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+        return
+
+# End.
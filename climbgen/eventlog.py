@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+
+"""
+Append-only log of performance events
+
+During a performance, each recognized Muzicode (or other trigger) is recorded as an
+instance of a generated 'climb_Annotation' template.  Events are appended to an
+in-memory buffer and written to the log by a background thread, which writes and
+fsyncs each batch together (group commit), so appending never waits for the disk.
+
+The log is a directory of segment files, "events-<first sequence number>.ndjson",
+each holding one JSON object per line:
+
+    seq:        event sequence number, from 1
+    time:       event time (seconds since the epoch)
+    template:   annotation template id (e.g. "1a_1")
+    stage:      stage id
+    input:      performer input (any JSON value), or null
+
+A new segment is started when the current one exceeds the segment size.  A partly
+written last line (e.g. after a crash) is ignored when reading, and removed when
+the log is reopened.
+
+After a performance, 'materialise' writes each event as a 'climb_Annotation'
+entity in an Annalist collection.
+
+Usage:
+    python eventlog.py materialise LOGDIR [DIR]
+"""
+
+__author__      = "Graham Klyne (GK@ACM.ORG)"
+__copyright__   = "Copyright 2017, G. Klyne"
+__license__     = "MIT (http://opensource.org/licenses/MIT)"
+
+import sys
+import os
+import os.path
+import errno
+import json
+import time
+import threading
+
+from entitywriter import EntityWriter, ENTITY_DATA_FILE
+
+import logging
+log = logging.getLogger(__name__)
+
+SEGMENT_PREFIX  = "events-"
+SEGMENT_SUFFIX  = ".ndjson"
+SEGMENT_SIZE    = 64*1024*1024
+SYNC_INTERVAL   = 0.05
+
+# Events are serialized with fixed key order; sorting keys is several times slower
+_encode         = json.JSONEncoder(separators=(',', ':')).encode
+EVENT_FORMAT    = '{"seq":%d,"time":%s,"template":%s,"stage":%s,"input":%s}\n'
+
+def _event_fields(event_time, template, stage, performer_input):
+    return (
+        repr(float(event_time)), _encode(template), _encode(stage), _encode(performer_input)
+        )
+
+def event_json_text(seq, event_time, template, stage, performer_input):
+    """
+    Return serialized event, as a line of a log segment.
+    """
+    return EVENT_FORMAT%((seq,) + _event_fields(event_time, template, stage, performer_input))
+
+def segment_files(log_dir):
+    """
+    Return list of segment file names in a log directory, in sequence order.
+    """
+    segs = []
+    for f in os.listdir(log_dir):
+        if f.startswith(SEGMENT_PREFIX) and f.endswith(SEGMENT_SUFFIX):
+            segs.append((int(f[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]), f))
+    return [ os.path.join(log_dir, f) for (n, f) in sorted(segs) ]
+
+def segment_name(log_dir, seq):
+    return os.path.join(log_dir, "%s%010d%s"%(SEGMENT_PREFIX, seq, SEGMENT_SUFFIX))
+
+def read_events(log_dir):
+    """
+    Generator yields each event in a log, in sequence order, as a dictionary.
+    """
+    for filename in segment_files(log_dir):
+        with open(filename, "rb") as instr:
+            for line in instr:
+                if not line.endswith("\n"):
+                    log.warning("read_events: ignoring incomplete event in %s"%(filename,))
+                    break
+                yield json.loads(line)
+    return
+
+class EventLog(object):
+    """
+    Append-only, segmented performance event log.
+
+    @param log_dir:         directory containing log segments; created if needed.
+    @param segment_size:    size in bytes after which a new segment is started.
+    @param sync_interval:   maximum time in seconds between group commits.
+    @param fsync:           if False, batches are written but not fsynced.
+    """
+
+    def __init__(self, log_dir, segment_size=SEGMENT_SIZE, sync_interval=SYNC_INTERVAL, fsync=True):
+        self._log_dir       = log_dir
+        self._segment_size  = segment_size
+        self._sync_interval = sync_interval
+        self._fsync         = fsync
+        self._lock          = threading.Lock()
+        self._cond          = threading.Condition(self._lock)
+        self._pending       = []        # Serialized events awaiting write
+        self._seq           = 0         # Last sequence number allocated
+        self._synced        = 0         # Last sequence number written and synced
+        self._closing       = False
+        self._error         = None
+        try:
+            os.makedirs(log_dir)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+        self._open_last_segment()
+        self._thread = threading.Thread(target=self._writer, name="EventLog")
+        self._thread.daemon = True
+        self._thread.start()
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def _open_last_segment(self):
+        """
+        Find last sequence number, removing any incomplete last line, and open the
+        last segment (or a new one) for appending.
+        """
+        segs = segment_files(self._log_dir)
+        if segs:
+            filename = segs[-1]
+            with open(filename, "r+b") as f:
+                data = f.read()
+                end  = data.rfind("\n") + 1
+                if end < len(data):
+                    log.warning("EventLog: removing incomplete event from %s"%(filename,))
+                    f.truncate(end)
+            lines = data[:end].splitlines()
+            if lines:
+                self._seq = json.loads(lines[-1])["seq"]
+            else:
+                seg_first = int(os.path.basename(filename)[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+                self._seq = seg_first - 1
+            self._synced = self._seq
+            self._segment = open(filename, "ab")
+            self._segsize = end
+        else:
+            self._new_segment()
+        return
+
+    def _new_segment(self):
+        self._segment = open(segment_name(self._log_dir, self._seq+1), "ab")
+        self._segsize = 0
+        return
+
+    def append(self, template, stage, performer_input=None, event_time=None):
+        """
+        Record an event, returning its sequence number.  The event is serialized 
+        here, so an error (e.g. 'performer_input' that is not JSON-serializable) is
+        raised to the caller and the event is not logged, and written by a background
+        thread; use 'sync' to wait until it is on disk.
+        """
+        if event_time is None:
+            event_time = time.time()
+        fields = _event_fields(event_time, template, stage, performer_input)
+        with self._lock:
+            if self._error:
+                raise self._error
+            if self._closing:
+                raise ValueError("EventLog is closed")
+            self._seq += 1
+            seq = self._seq
+            self._pending.append(EVENT_FORMAT%((seq,) + fields))
+        return seq
+
+    def sync(self, seq=None):
+        """
+        Wait until the indicated event (default: all events appended) is written
+        and synced.
+        """
+        with self._lock:
+            if seq is None:
+                seq = self._seq
+            while self._synced < seq and not self._error:
+                self._cond.notify_all()
+                self._cond.wait(self._sync_interval)
+            if self._error:
+                raise self._error
+        return
+
+    def close(self):
+        """
+        Write all outstanding events, and stop the writer thread.
+        """
+        with self._lock:
+            if self._closing:
+                return
+            self._closing = True
+            self._cond.notify_all()
+        self._thread.join()
+        self._segment.close()
+        if self._error:
+            raise self._error
+        return
+
+    def _writer(self):
+        while True:
+            with self._lock:
+                if not self._pending and not self._closing:
+                    self._cond.wait(self._sync_interval)
+                batch = self._pending
+                self._pending = []
+                last  = self._seq
+                done  = self._closing and not batch
+            if done:
+                return
+            if batch:
+                try:
+                    self._write_batch(batch, last)
+                except Exception, e:
+                    log.error("EventLog: %s"%(e,))
+                    with self._lock:
+                        self._error = e
+                        self._cond.notify_all()
+                    return
+            with self._lock:
+                self._synced = last
+                self._cond.notify_all()
+        return
+
+    def _write_batch(self, batch, last):
+        data = "".join(batch)
+        self._segment.write(data)
+        self._segment.flush()
+        if self._fsync:
+            os.fsync(self._segment.fileno())
+        self._segsize += len(data)
+        if self._segsize >= self._segment_size:
+            self._segment.close()
+            self._segment = open(segment_name(self._log_dir, last+1), "ab")
+            self._segsize = 0
+        return
+
+def event_annotation(event, template):
+    """
+    Return 'climb_Annotation' entity data for an event, based on the annotation
+    template, or None if there is no template.
+    """
+    if template is None:
+        return None
+    event_id  = "%s_event_%d"%(event["template"], event["seq"])
+    timestamp = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(event["time"]))
+    timestamp += ("%.6f"%(event["time"] % 1))[1:] + "Z"
+    annotation = dict(template)
+    annotation.update(
+        { "@id":                "climb_Annotation/" + event_id
+        , "annal:id":           event_id
+        , "rdfs:label":         "%s (event %d)"%(template.get("rdfs:label"), event["seq"])
+        , "rdfs:comment":       "# %s (event %d)\r\n\r\nStage %s at %s\r\n"%
+                                (template.get("rdfs:label"), event["seq"], event["stage"], timestamp)
+        , "climb:template":     "climb_Annotation/" + event["template"]
+        , "climb:event_stage":  "climb_Stage_Score/" + event["stage"]
+        , "climb:event_time":   timestamp
+        , "climb:event_seq":    event["seq"]
+        , "climb:performer_input": event["input"]
+        })
+    return annotation
+
+def materialise(log_dir, base_dir, sink=None):
+    """
+    Write each event in a log as a 'climb_Annotation' entity under 'base_dir' (or to
+    the supplied sink), based on the annotation templates under 'base_dir'.  Returns
+    the number of entities written.
+    """
+    if sink is None:
+        with EntityWriter(base_dir) as sink:
+            return materialise(log_dir, base_dir, sink=sink)
+    templates = {}
+    count = 0
+    for event in read_events(log_dir):
+        template_id = event["template"]
+        if template_id not in templates:
+            filename = os.path.join(base_dir, "climb_Annotation", template_id, ENTITY_DATA_FILE)
+            try:
+                with open(filename, "r") as instr:
+                    templates[template_id] = json.load(instr)
+            except IOError, e:
+                log.warning("materialise: no annotation template %s"%(template_id,))
+                templates[template_id] = None
+        annotation = event_annotation(event, templates[template_id])
+        if annotation:
+            sink.write(annotation["@id"], annotation)
+            count += 1
+    return count
+
+def runMain():
+    if len(sys.argv) not in (3, 4) or sys.argv[1] != "materialise":
+        print("Usage: %s materialise LOGDIR [DIR]"%(sys.argv[0],))
+        return 2
+    base_dir = sys.argv[3] if len(sys.argv) > 3 else "d/"
+    count = materialise(sys.argv[2], base_dir)
+    print("%d events written to %s"%(count, base_dir))
+    return 0
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    sys.exit(runMain())
+
+# End.
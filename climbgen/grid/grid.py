@@ -10,8 +10,13 @@ __author__      = "Graham Klyne (GK@ACM.ORG)"
 __copyright__   = "Copyright 2017, Graham Klyne"
 __license__     = "MIT (http://opensource.org/licenses/MIT)"
 
+import os
 import urlparse
+import bisect
 import csv
+import mmap
+import array
+import collections
 import openpyxl
 import logging
 import traceback
@@ -27,6 +32,7 @@ class Grid(object):
     def __init__(self, baseuri=None):
         ### self._baseuri = ro_uriutils.resolveFileAsUri(baseuri or "")
         self._baseuri = (baseuri or "")
+        self._colindexes = {}
         return
 
     def baseUri(self, uriref=None):
@@ -48,6 +54,33 @@ class Grid(object):
     def __getitem__(self, row):
         return GridRow(self, row)
 
+    def count_cells(self):
+        """
+        Start counting calls to 'cell' in attribute 'cells_accessed'.
+
+        The counting wrapper is installed only when requested, so there is no cost
+        to grids that are not counted.
+        """
+        self.cells_accessed = 0
+        cell = self.cell
+        def counting_cell(row, col):
+            self.cells_accessed += 1
+            return cell(row, col)
+        self.cell = counting_cell
+        return
+
+    def column_index(self, col):
+        """
+        Return a GridColumnIndex for the indicated column, or None if the column 
+        is outside the grid.  The index is built when first requested.
+        """
+        if col not in self._colindexes:
+            try:
+                self._colindexes[col] = GridColumnIndex(self, col)
+            except ValueError, e:
+                self._colindexes[col] = None
+        return self._colindexes[col]
+
     def __iter__(self):
         row = 0
         while True:
@@ -74,11 +107,62 @@ class Grid(object):
                 break
         return
 
+class GridColumnIndex(object):
+    """
+    Inverted index of values in a grid column: maps each cell value to a sorted
+    list of the rows in which it appears.
+
+    @param grid:    grid to be indexed
+    @param col:     column to be indexed
+    @param values:  if supplied, the column values, used instead of reading cells 
+                    from the grid.
+
+    Rows are read until the grid reports a row index out of range, which gives the 
+    number of rows.  A ValueError is raised if the column is out of range.
+    """
+
+    def __init__(self, grid, col, values=None):
+        self._rows = {}
+        if values is None:
+            values = self._column_values(grid, col)
+        row = 0
+        for v in values:
+            if v in self._rows:
+                self._rows[v].append(row)
+            else:
+                self._rows[v] = [row]
+            row += 1
+        self.nrows = row
+        return
+
+    @staticmethod
+    def _column_values(grid, col):
+        row = 0
+        while True:
+            try:
+                v = grid.cell(row, col)
+            except IndexError, e:
+                break
+            yield v
+            row += 1
+        return
+
+    def rows(self, value, start=0):
+        """
+        Return sorted list of rows at or after 'start' in which 'value' appears.
+        """
+        rows = self._rows.get(value)
+        if not rows:
+            return []
+        return rows[bisect.bisect_left(rows, start):]
+
 class GridRow(object):
     """
     Interface for auxiliary grid or spreadsheet row.
     """
 
+    __slots__ = ("_grid", "_row")
+
     def __init__(self, grid, row):
         self._grid = grid
         self._row  = row
@@ -125,7 +209,7 @@ class GridCSV(Grid):
         self._maxcol = 0
         self._maxrow = 0
         for row in reader:
-            log.info("- row: %s"%(repr(row)))
+            # log.debug("- row: %s"%(repr(row)))
             self._rows.append(row)
             if len(row) > self._maxcol: self._maxcol = len(row)
             self._maxrow += 1
@@ -133,8 +217,7 @@ class GridCSV(Grid):
         return
 
     def cell(self, row, col):
-        if row < 10:
-            log.info("GridCSV cell %d %d"%(row, col))
+        # log.debug("GridCSV cell %d %d"%(row, col))
         if col >= self._maxcol:
             raise ValueError("Column out of range")
         return self._rows[row][col] if col < len(self._rows[row]) else ""
@@ -172,6 +255,137 @@ class GridTSV(Grid):
             raise ValueError("Column out of range")
         return self._rows[row][col] if col < len(self._rows[row]) else ""
 
+class GridCSVLazy(Grid):
+    """
+    Initialize a grid object based on a CSV file, parsing rows only when accessed
+
+    @param csvfilename: Name of a file that contains CSV data
+    @param baseuri:     A string used as the base URI for references in the grid.
+    @param dialect:     An optional dialect parameter (e.g. 'excel', 'excel-tab').
+                        If not specified, the system sniffs the content of the CSV 
+                        to guess the CSV dialect used.
+    @param cache_rows:  Number of parsed rows retained, most recently used first.
+
+    The file is memory-mapped, and a single scan records the starting offset of 
+    each row (a row may span several lines if a quoted value contains newlines) 
+    and the maximum number of columns.  Thereafter, memory used is the offset array 
+    plus a small cache of parsed rows, independent of the size of the file.  Cell 
+    values and out-of-range behaviour are the same as GridCSV.
+    """
+
+    def __init__(self, csvfilename, baseuri=None, dialect=None, cache_rows=256):
+        super(GridCSVLazy, self).__init__(baseuri=baseuri)
+        self._file     = open(csvfilename, "rb")
+        self._map      = None
+        self._cache    = collections.OrderedDict()
+        self._cachemax = cache_rows
+        self._lastrow  = None
+        self._lastdata = None
+        self._offsets  = array.array('L')
+        self._maxcol   = 0
+        self._maxrow   = 0
+        size = os.fstat(self._file.fileno()).st_size
+        if size > 0:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if not dialect:
+            dialect = csv.Sniffer().sniff(self._map[:1024] if self._map else "")
+        self._dialect = dialect
+        log.debug("%s: %s, %s"%(type(self).__name__, csvfilename, dialect))
+        if self._map:
+            self._scan_rows()
+        self._offsets.append(size)
+        log.debug("%s: maxrow %d, maxcol %d"%(type(self).__name__, self._maxrow, self._maxcol))
+        return
+
+    def _scan_rows(self):
+        """
+        Scan file, recording start offset of each row and the maximum row length
+        """
+        pending = []
+        def lines():
+            m = self._map
+            m.seek(0)
+            while True:
+                pending.append(m.tell())
+                line = m.readline()
+                if not line:
+                    return
+                yield line
+        for row in csv.reader(lines(), self._dialect):
+            self._offsets.append(pending[0])
+            del pending[:]
+            if len(row) > self._maxcol: self._maxcol = len(row)
+            self._maxrow += 1
+        return
+
+    def close(self):
+        """
+        Release the memory map and file
+        """
+        if self._map:
+            self._map.close()
+            self._map = None
+        self._file.close()
+        return
+
+    def _row(self, row):
+        """
+        Return parsed data for indicated row, raising IndexError if out of range
+        """
+        if row == self._lastrow:
+            return self._lastdata
+        if row < 0:
+            row += self._maxrow
+        if not (0 <= row < self._maxrow):
+            raise IndexError("Row out of range")
+        try:
+            rowdata = self._cache.pop(row)
+        except KeyError:
+            text = self._map[self._offsets[row]:self._offsets[row+1]]
+            rowdata = next(csv.reader(text.splitlines(True), self._dialect), [])
+            if len(self._cache) >= self._cachemax:
+                self._cache.popitem(last=False)
+        self._cache[row] = rowdata
+        self._lastrow  = row
+        self._lastdata = rowdata
+        return rowdata
+
+    def cell(self, row, col):
+        if col >= self._maxcol:
+            raise ValueError("Column out of range")
+        rowdata = self._row(row)
+        return rowdata[col] if col < len(rowdata) else ""
+
+class GridTSVLazy(GridCSVLazy):
+    """
+    Initialize a grid object based on a TSV file, parsing rows only when accessed
+
+    See GridCSVLazy for parameters.  Out-of-range behaviour is the same as GridTSV.
+    """
+
+    def cell(self, row, col):
+        if col > self._maxcol:
+            raise ValueError("Column out of range")
+        rowdata = self._row(row)
+        return rowdata[col] if col < len(rowdata) else ""
+
+def excel_cell_value(cell):
+    """
+    Return string value for an Excel cell, or None if the cell is empty.
+
+    The same conversion rules are used for cells read from a fully loaded workbook
+    and for cells read in read-only mode, so both modes present identical values.
+    """
+    if cell.data_type == openpyxl.cell.Cell.TYPE_NULL: # or cell.value is None:
+        return None
+    if cell.data_type == openpyxl.cell.Cell.TYPE_STRING:
+        return cell.value
+    if cell.data_type == openpyxl.cell.Cell.TYPE_NUMERIC:
+        return str(cell.value)
+    if cell.data_type == openpyxl.cell.Cell.TYPE_BOOL:
+        return "True" if cell.value else "False"
+    return "????%s"%(cell.data_type)
+    #     raise ValueError("Cell type must be empty or string (got %d)"%(cell.data_type))
 
 class GridExcel(Grid):
     """
@@ -179,33 +393,240 @@ class GridExcel(Grid):
 
     @param xlsfile:     Filename of an Excel spreadsheet file
     @param baseuri:     A string used as the base URI for references in the grid.
+    @param readonly:    If True, the workbook is opened in read-only (streaming) mode,
+                        and every row is converted once into a cached tuple of cell 
+                        values.  Subsequent access is served from the cache.
     """
 
-    def __init__(self, xlsfilename, baseuri=None):
+    def __init__(self, xlsfilename, baseuri=None, readonly=False):
         super(GridExcel, self).__init__(baseuri=baseuri)
         log.debug("GridExcel: %s"%(xlsfilename))
-        self._workbook = openpyxl.load_workbook(filename=xlsfilename)
-        # Assume first and only worksheet
-        self._sheet  = self._workbook.active
-        self._maxrow = self._sheet.max_row
-        self._maxcol = self._sheet.max_column
+        self._rows     = None
+        self._fastrows = readonly
+        self._rowclass = GridExcelRow
+        if readonly:
+            self._load_rows(xlsfilename)
+        else:
+            self._workbook = openpyxl.load_workbook(filename=xlsfilename)
+            # Assume first and only worksheet
+            self._sheet  = self._workbook.active
+            self._maxrow = self._sheet.max_row
+            self._maxcol = self._sheet.max_column
         log.info("GridExcel sheet size: %d, %d"%(self._maxrow, self._maxcol))
         return
 
+    def _load_rows(self, xlsfilename):
+        """
+        Read all rows from a read-only workbook into a list of value tuples.
+
+        Trailing empty cells are dropped from each row tuple: cells beyond the end
+        of a row but within the sheet width are reported as None.
+        """
+        workbook = openpyxl.load_workbook(filename=xlsfilename, read_only=True)
+        # Assume first and only worksheet
+        sheet   = workbook.active
+        rows    = []
+        maxcol  = 0
+        for sheetrow in sheet.iter_rows():
+            rowvals = [ excel_cell_value(c) for c in sheetrow ]
+            while rowvals and rowvals[-1] is None:
+                rowvals.pop()
+            rows.append(tuple(rowvals))
+            if len(sheetrow) > maxcol: maxcol = len(sheetrow)
+        workbook.close()
+        self._workbook = None
+        self._sheet    = None
+        self._rows     = rows
+        self._maxrow   = len(rows)
+        self._maxcol   = maxcol
+        return
+
+    def count_cells(self):
+        # Values served from cached rows are counted by the row objects
+        super(GridExcel, self).count_cells()
+        self._rowclass = GridExcelCountingRow
+        return
+
+    def __getitem__(self, row):
+        if self._fastrows and 0 <= row < self._maxrow:
+            return self._rowclass(self, row, self._rows[row])
+        return GridRow(self, row)
+
+    def rows(self, rowfrom, rowto=100000):
+        if not self._fastrows:
+            for rowdata in super(GridExcel, self).rows(rowfrom, rowto):
+                yield rowdata
+            return
+        for i in range(rowfrom, min(rowto, self._maxrow)):
+            yield self._rowclass(self, i, self._rows[i])
+        return
+
     def cell(self, row, col):
-        if row in range(self._maxrow) and col in range(self._maxcol):
+        if 0 <= row < self._maxrow and 0 <= col < self._maxcol:
+            if self._rows is not None:
+                rowvals = self._rows[row]
+                return rowvals[col] if col < len(rowvals) else None
             cell = self._sheet.cell(row=row+1, column=col+1)
             # log.debug("GridExcel.cell [%d,%d] = %r:%s"%(row, col, cell.value, cell.data_type))
-            # log.debug("GridExcel.cell data_type: %s"%(cell.data_type))
-            if cell.data_type == openpyxl.cell.Cell.TYPE_NULL: # or cell.value is None:
-                return None
-            if cell.data_type == openpyxl.cell.Cell.TYPE_STRING:
-                return cell.value
-            if cell.data_type == openpyxl.cell.Cell.TYPE_NUMERIC:
-                return str(cell.value)
-            if cell.data_type == openpyxl.cell.Cell.TYPE_BOOL:
-                return "True" if cell.value else "False"
-            return "????%s"%(cell.data_type)
-            #     raise ValueError("Cell type must be empty or string (got %d)"%(cell.data_type))
+            return excel_cell_value(cell)
         raise IndexError("Index outside bound of spreadsheet: %d,%d (%d,%d)"%(row, col, self._maxrow, self._maxcol))
 
+class GridExcelRow(GridRow):
+    """
+    Row of a read-only GridExcel, served directly from the cached row tuple.
+    """
+
+    __slots__ = ("_vals",)
+
+    def __init__(self, grid, row, rowvals):
+        super(GridExcelRow, self).__init__(grid, row)
+        self._vals = rowvals
+        return
+
+    def __getitem__(self, col):
+        if 0 <= col < len(self._vals):
+            return self._vals[col]
+        return self._grid.cell(self._row, col)
+
+class GridExcelCountingRow(GridExcelRow):
+    """
+    Row of a read-only GridExcel whose cell accesses are being counted.
+    """
+
+    __slots__ = ()
+
+    def __getitem__(self, col):
+        if 0 <= col < len(self._vals):
+            self._grid.cells_accessed += 1
+            return self._vals[col]
+        return self._grid.cell(self._row, col)
+
+class GridColumnar(Grid):
+    """
+    Initialize a compact, column-oriented grid object from any other grid
+
+    @param grid:        Grid whose contents are copied.
+    @param baseuri:     A string used as the base URI for references in the grid.
+                        If not specified, the base URI of the source grid is used.
+
+    Each distinct cell value is stored once, in a table of values, and each column
+    is stored as an array of indexes into that table.  Rows shorter than the widest
+    row are padded with None.  Whole columns and slices of rows are available 
+    without accessing individual cells.
+
+    As for GridCSV, a ValueError is raised for a column out of range, and an 
+    IndexError for a row out of range.
+    """
+
+    def __init__(self, grid, baseuri=None):
+        super(GridColumnar, self).__init__(baseuri=baseuri or grid.baseUri())
+        self._values  = [None]
+        self._ids     = {None: 0}
+        self._columns = []
+        nrows = 0
+        while True:
+            try:
+                rowdata = grid[nrows]
+                _probe  = rowdata[0]
+            except (IndexError, ValueError), e:
+                break
+            self._add_row(nrows, rowdata)
+            nrows += 1
+        self._nrows = nrows
+        self._ncols = len(self._columns)
+        log.debug("GridColumnar: %d rows, %d columns, %d values"%
+            (self._nrows, self._ncols, len(self._values))
+            )
+        return
+
+    def _add_row(self, row, rowdata):
+        # Each column is kept at the length of the rows added so far
+        values  = self._values
+        ids     = self._ids
+        columns = self._columns
+        rowids  = []
+        for v in rowdata:
+            i = ids.get(v)
+            if i is None:
+                i = ids[v] = len(values)
+                values.append(v)
+            rowids.append(i)
+        while len(columns) < len(rowids):
+            columns.append(array.array('I', [0]*row))
+        for column, i in zip(columns, rowids):
+            column.append(i)
+        for column in columns[len(rowids):]:
+            column.append(0)
+        return
+
+    def nrows(self):
+        return self._nrows
+
+    def ncols(self):
+        return self._ncols
+
+    def cell(self, row, col):
+        if not (0 <= col < self._ncols):
+            raise ValueError("Column out of range")
+        if not (0 <= row < self._nrows):
+            raise IndexError("Row out of range")
+        return self._values[self._columns[col][row]]
+
+    def column(self, col, rowfrom=0, rowto=None):
+        """
+        Return list of values in the indicated column, optionally limited to a range
+        of rows.  A ValueError is raised if the column is out of range.
+        """
+        if not (0 <= col < self._ncols):
+            raise ValueError("Column out of range")
+        values = self._values
+        return [ values[i] for i in self._columns[col][rowfrom:rowto] ]
+
+    def row_values(self, row, colfrom=0, colto=None):
+        """
+        Return list of values in the indicated row, optionally limited to a range
+        of columns.  An IndexError is raised if the row is out of range.
+        """
+        if not (0 <= row < self._nrows):
+            raise IndexError("Row out of range")
+        values = self._values
+        return [ values[column[row]] for column in self._columns[colfrom:colto] ]
+
+    def column_index(self, col):
+        if col not in self._colindexes:
+            try:
+                self._colindexes[col] = GridColumnIndex(self, col, values=self.column(col))
+            except ValueError, e:
+                self._colindexes[col] = None
+        return self._colindexes[col]
+
+    def __getitem__(self, row):
+        return GridColumnarRow(self, row)
+
+    def __iter__(self):
+        for i in xrange(self._nrows):
+            yield GridColumnarRow(self, i)
+        return
+
+    def rows(self, rowfrom, rowto=100000):
+        for i in xrange(rowfrom, min(rowto, self._nrows)):
+            yield GridColumnarRow(self, i)
+        return
+
+class GridColumnarRow(GridRow):
+    """
+    Row of a GridColumnar.  Indexing with a slice returns a list of values.
+    """
+
+    __slots__ = ()
+
+    def __getitem__(self, col):
+        if isinstance(col, slice):
+            return self._grid.row_values(self._row)[col]
+        return self._grid.cell(self._row, col)
+
+    def __iter__(self):
+        return iter(self._grid.row_values(self._row))
+
+    def __len__(self):
+        return self._grid.ncols()
@@ -16,6 +16,7 @@ import re
 import logging
 import csv
 import urlparse
+import threading
 
 log = logging.getLogger(__name__)
 log.setLevel(logging.INFO)
@@ -34,9 +35,7 @@ class GridMatchReport(Exception):
         return
 
     def __str__(self):
-        txt = "%s @[%d,%d]"%(self._msg, self._row, self._col)
-        if self._value:  txt += ": "+repr(self._value)
-        return txt
+        return report_text(self._msg, self._row, self._col, self._value)
 
     def __repr__(self):
         return ( "GridMatchReport(%s (%d,%d), value=%s)"%
@@ -54,6 +53,84 @@ class GridMatchError(GridMatchReport):
         return ( "GridMatchError(%s (%d,%d), value=%s)"%
                  (repr(self._msg), self._row, self._col, repr(self._value)))
 
+def report_text(msg, row, col, value):
+    """
+    Return text for a match failure report
+    """
+    txt = "%s @[%d,%d]"%(msg, row, col)
+    if value:  txt += ": "+repr(value)
+    return txt
+
+class GridMatchMemo(object):
+    """
+    Memo table for packrat matching.
+
+    While a memo is active (see GridMatch.memomatch), the result of applying each 
+    matcher at a given grid position is recorded, and repeated attempts at the same 
+    position (e.g. when an alternative backtracks) return the recorded result or 
+    raise the recorded exception.  Result dictionaries are copied when recorded and 
+    when returned, so that merging results into them does not affect the memo.
+    """
+    def __init__(self):
+        self._results = {}
+        self.hits     = 0
+        self.misses   = 0
+        return
+
+    def match(self, m, grid, row, col):
+        # Base URI is included in the key because refval results depend on it
+        key = (m, row, col, grid, grid.baseUri())
+        try:
+            (ok, val) = self._results[key]
+            self.hits += 1
+        except KeyError:
+            self.misses += 1
+            try:
+                (res, pos) = m.match(grid, row, col)
+                (ok, val)  = (True, (dict(res), pos))
+            except Exception, e:
+                (ok, val)  = (False, e)
+            self._results[key] = (ok, val)
+        if not ok:
+            raise val
+        (res, pos) = val
+        return (dict(res), pos)
+
+    def stats(self):
+        """
+        Return dictionary of memo table statistics
+        """
+        total = self.hits + self.misses
+        return (
+            { "hits":       self.hits
+            , "misses":     self.misses
+            , "entries":    len(self._results)
+            , "hit_rate":   float(self.hits)/total if total else 0.0
+            })
+
+    def __enter__(self):
+        self._saved = getattr(_active, "memo", None)
+        _active.memo = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _active.memo = self._saved
+        return False
+
+# Memo table (if any) used by the current thread
+_active = threading.local()
+
+def submatch(m, grid, row, col):
+    """
+    Apply matcher to grid at given position, using the active memo table if any.
+
+    Combinators use this to match their components.
+    """
+    memo = getattr(_active, "memo", None)
+    if memo is None:
+        return m.match(grid, row, col)
+    return memo.match(m, grid, row, col)
+
 class GridMatch(object):
     """
     Interface for gridmatch combinable parser
@@ -74,6 +151,59 @@ class GridMatch(object):
         """
         assert False, "Unimplemented 'match' method"
 
+    def memomatch(self, grid, row, col, memo=None):
+        """
+        Match something in a grid, using packrat memoization.
+
+        Results are the same as for 'match', but each component matcher is applied 
+        at most once at any grid position.
+
+        @param memo:    a GridMatchMemo object, which may be supplied to collect 
+                        statistics.  If not supplied, a new memo table is used.
+        """
+        with (memo or GridMatchMemo()) as active:
+            return active.match(self, grid, row, col)
+
+    def compile(self):
+        """
+        Return compiled form of this matcher (see GridMatchCompiled).
+        """
+        return GridMatchCompiled(self)
+
+    def compiled(self, cc):
+        """
+        Return match function for this matcher, using compilations already in 'cc'
+        (a dictionary keyed by matcher id) for matchers that occur more than once.
+        """
+        if id(self) not in cc:
+            cc[id(self)] = self._compile(cc)
+        return cc[id(self)]
+
+    def _compile(self, cc):
+        """
+        Return match function for this matcher.
+
+        A match function is called as f(grid, row, col, res, st), and adds results 
+        to dictionary 'res' using 'put'.  It returns the new (row, col) on success.  
+        On failure, it sets 'st.err' to (msg, row, col, value) for the GridMatchError 
+        that 'match' would raise, and returns None.  Other exceptions propagate as 
+        for 'match'.
+
+        This default implementation calls 'match'; subclasses provide direct 
+        implementations.
+        """
+        m = self
+        def f(grid, row, col, res, st):
+            try:
+                (r, pos) = m.match(grid, row, col)
+            except GridMatchError, e:
+                st.err = (e._msg, e._row, e._col, e._value)
+                return None
+            for k in r:
+                put(res, st, k, r[k])
+            return pos
+        return f
+
     def __add__(self, other):
         return GridMatchNextCol(self, other)
 
@@ -95,6 +225,82 @@ class GridMatch(object):
     def usebaseuri(self, other, key):
         return GridMatchBaseUri(self, other, key)
 
+# Compiled matching
+
+_MISSING = object()
+
+class GridMatchState(object):
+    """
+    State for a compiled match: details of the most recent failure, and a journal
+    of result values set within alternatives, used to undo them if an alternative 
+    fails.
+    """
+    __slots__ = ("err", "journal", "guards")
+    def __init__(self):
+        self.err     = None
+        self.journal = []
+        self.guards  = 0
+        return
+
+    def guard(self):
+        """
+        Start a region in which result values may need to be undone
+        """
+        self.guards += 1
+        return len(self.journal)
+
+    def unguard(self):
+        self.guards -= 1
+        if not self.guards:
+            del self.journal[:]
+        return
+
+    def rollback(self, mark):
+        """
+        Undo result values set since guard() returned 'mark'
+        """
+        j = self.journal
+        while len(j) > mark:
+            (d, k, old) = j.pop()
+            if old is _MISSING:
+                del d[k]
+            else:
+                d[k] = old
+        return
+
+def put(res, st, k, v):
+    """
+    Set result value in compiled match
+    """
+    if st.guards:
+        st.journal.append((res, k, res.get(k, _MISSING)))
+    res[k] = v
+    return
+
+class GridMatchCompiled(GridMatch):
+    """
+    Compiled matcher.
+
+    The combinator tree is compiled into nested match functions (see 
+    GridMatch._compile) that signal failure by return value rather than by 
+    raising an exception, and which add results to a single dictionary.  
+    A GridMatchError is raised only if the overall match fails.  Results and 
+    errors are the same as for the original matcher.
+    """
+    def __init__(self, m):
+        self._m = m
+        self._f = m.compiled({})
+        return
+    def match(self, grid, row, col):
+        st  = GridMatchState()
+        res = {}
+        pos = self._f(grid, row, col, res, st)
+        if pos is None:
+            raise GridMatchError(*st.err)
+        return (res, pos)
+    def _compile(self, cc):
+        return self._f
+
 class GridMatchNextRow(GridMatch):
     """
     Match-next-row combinator
@@ -104,10 +310,19 @@ class GridMatchNextRow(GridMatch):
         self._b = b
         return
     def match(self, grid, row, col):
-        (rt,(rnew,cnew)) = self._t.match(grid, row, col)
-        (rb,(rnew,cnew)) = self._b.match(grid, rnew, col)
+        (rt,(rnew,cnew)) = submatch(self._t, grid, row, col)
+        (rb,(rnew,cnew)) = submatch(self._b, grid, rnew, col)
         rt.update(rb)
         return (rt, (rnew, cnew))
+    def _compile(self, cc):
+        t = self._t.compiled(cc)
+        b = self._b.compiled(cc)
+        def f(grid, row, col, res, st):
+            pos = t(grid, row, col, res, st)
+            if pos is None:
+                return None
+            return b(grid, pos[0], col, res, st)
+        return f
 
 # Combinator classes
 
@@ -120,10 +335,19 @@ class GridMatchNextCol(GridMatch):
         self._r = r
         return
     def match(self, grid, row, col):
-        (rl,(rnew,cnew)) = self._l.match(grid, row, col)
-        (rr,(rnew,cnew)) = self._r.match(grid, row, cnew)
+        (rl,(rnew,cnew)) = submatch(self._l, grid, row, col)
+        (rr,(rnew,cnew)) = submatch(self._r, grid, row, cnew)
         rl.update(rr)
         return (rl, (rnew, cnew))
+    def _compile(self, cc):
+        l = self._l.compiled(cc)
+        r = self._r.compiled(cc)
+        def f(grid, row, col, res, st):
+            pos = l(grid, row, col, res, st)
+            if pos is None:
+                return None
+            return r(grid, row, pos[1], res, st)
+        return f
 
 class GridMatchAlt(GridMatch):
     """
@@ -135,10 +359,26 @@ class GridMatchAlt(GridMatch):
         return
     def match(self, grid, row, col):
         try:
-            (res,(rnew,cnew)) = self._l.match(grid, row, col)
+            (res,(rnew,cnew)) = submatch(self._l, grid, row, col)
         except Exception, e:
-            (res,(rnew,cnew)) = self._r.match(grid, row, col)
+            (res,(rnew,cnew)) = submatch(self._r, grid, row, col)
         return (res, (rnew, cnew))
+    def _compile(self, cc):
+        l = self._l.compiled(cc)
+        r = self._r.compiled(cc)
+        def f(grid, row, col, res, st):
+            mark = st.guard()
+            try:
+                pos = l(grid, row, col, res, st)
+            except Exception, e:
+                pos = None
+            if pos is None:
+                st.rollback(mark)
+            st.unguard()
+            if pos is None:
+                return r(grid, row, col, res, st)
+            return pos
+        return f
 
 class GridMatchOpt(GridMatch):
     """
@@ -149,10 +389,23 @@ class GridMatchOpt(GridMatch):
         return
     def match(self, grid, row, col):
         try:
-            return self._m.match(grid, row, col)
+            return submatch(self._m, grid, row, col)
         except GridMatchError, e:
             pass
         return ({}, (row, col))
+    def _compile(self, cc):
+        m = self._m.compiled(cc)
+        def f(grid, row, col, res, st):
+            mark = st.guard()
+            try:
+                pos = m(grid, row, col, res, st)
+                if pos is None:
+                    st.rollback(mark)
+                    pos = (row, col)
+            finally:
+                st.unguard()
+            return pos
+        return f
 
 class GridMatchRepeatDown(GridMatch):
     """
@@ -183,7 +436,7 @@ class GridMatchRepeatDown(GridMatch):
         while count < self._max:
             log.debug("- rnew %d, cmax %d"%(rnew, cmax))
             try:
-                (res,(rnew,cnew)) = self._m.match(grid, rnew, col)
+                (res,(rnew,cnew)) = submatch(self._m, grid, rnew, col)
                 resultlist.append(res)
                 if cnew > cmax: cmax = cnew
                 count += 1
@@ -197,29 +450,155 @@ class GridMatchRepeatDown(GridMatch):
         else:
             res = resultlist
         return ({self._key: res}, (rnew, cmax))
+    def _compile(self, cc):
+        m = self._m.compiled(cc)
+        (key, rmin, rmax, dk, dv) = (self._key, self._min, self._max, self._dk, self._dv)
+        def f(grid, row, col, res, st):
+            resultlist = []
+            count      = 0
+            rnew       = row
+            cmax       = col
+            while count < rmax:
+                d   = {}
+                pos = m(grid, rnew, col, d, st)
+                if pos is None:
+                    break
+                resultlist.append(d)
+                (rnew, cnew) = pos
+                if cnew > cmax: cmax = cnew
+                count += 1
+            if count < rmin:
+                st.err = ("Repeat down < min", rnew, col, report_text(*st.err))
+                return None
+            if dk and dv:
+                put(res, st, key, dict( [ (r[dk], r[dv]) for r in resultlist ] ))
+            else:
+                put(res, st, key, resultlist)
+            return (rnew, cmax)
+        return f
+
+def anchor_text(m):
+    """
+    Return text that must appear in the starting cell of any match by 'm', 
+    or None if there is no such text.
+    """
+    if isinstance(m, text):
+        return m._t
+    if isinstance(m, (GridMatchNextCol, GridMatchBaseUri)):
+        if isinstance(m._l, (start, value)):
+            return anchor_text(m._r)
+        return anchor_text(m._l)
+    if isinstance(m, GridMatchNextRow):
+        return anchor_text(m._t)
+    if isinstance(m, GridMatchCompiled):
+        return anchor_text(m._m)
+    return None
 
 class GridMatchSkipDown(GridMatch):
     """
     Skip down over non matching rows until a match is found.
     Downwards matching continues with the matched item; mno m,atych result is returned.
+
+    If the skipped-to pattern starts with a text() match, the grid's column index
+    is used to try only rows in which that text appears.  Results and errors are 
+    the same as when every row is tried.
     """
     def __init__(self, m):
-        self._m   = m
+        self._m      = m
+        self._anchor = anchor_text(m)
         return
     def match(self, grid, row, col):
         log.debug("GridMatchSkipDown.match %d, %d"%(row, col))
+        candidates = self._candidates(grid, row, col)
+        if candidates:
+            return self._match_candidates(grid, row, col, *candidates)
+        savedexc = None
         while True:
             log.debug("- row %d, col %d"%(row, col))
             try:
-                self._m.match(grid, row, col)
+                submatch(self._m, grid, row, col)
                 break
             except GridMatchError, e:
                 savedexc = e
                 row += 1
                 continue
             except IndexError, e:
-                raise GridMatchError("GridMatchSkipDown: target not found", row, col, str(savedexc))
+                raise GridMatchError( "GridMatchSkipDown: target not found", row, col, 
+                                      str(savedexc) if savedexc else None )
         return ({}, (row, col))
+    def _candidates(self, grid, row, col):
+        """
+        Return (candidate rows, number of rows) using the column index, or None.
+        """
+        if self._anchor is None:
+            return None
+        index = grid.column_index(col)
+        if index is None or row >= index.nrows:
+            return None
+        return (index.rows(self._anchor, row), index.nrows)
+    def _previous_error(self, saved, r, row, col):
+        """
+        Return error (msg, row, col, value) for row r-1 of a row-by-row scan 
+        starting at 'row', given (error, row) for the last candidate tried.
+        Rows that are not candidates fail on the anchor text.
+        """
+        if saved and saved[1] == r-1:
+            return saved[0]
+        if r-1 >= row:
+            return ("gridmatch.text not matched", r-1, col, self._anchor)
+        return None
+    def _match_candidates(self, grid, row, col, rows, nrows):
+        saved = None
+        for r in rows:
+            log.debug("- row %d, col %d"%(r, col))
+            try:
+                submatch(self._m, grid, r, col)
+                return ({}, (r, col))
+            except GridMatchError, e:
+                saved = ((e._msg, e._row, e._col, e._value), r)
+            except IndexError, e:
+                nrows = r
+                break
+        err = self._previous_error(saved, nrows, row, col)
+        raise GridMatchError( "GridMatchSkipDown: target not found", nrows, col, 
+                              report_text(*err) if err else None )
+    def _compile(self, cc):
+        m    = self._m.compiled(cc)
+        skip = self
+        def f(grid, row, col, res, st):
+            scratch    = {}
+            saved      = None
+            candidates = skip._candidates(grid, row, col)
+            if candidates:
+                (rows, nrows) = candidates
+                for r in rows:
+                    try:
+                        pos = m(grid, r, col, scratch, st)
+                    except IndexError, e:
+                        nrows = r
+                        break
+                    if pos is not None:
+                        return (r, col)
+                    saved = (st.err, r)
+                    scratch.clear()
+                err = skip._previous_error(saved, nrows, row, col)
+                st.err = ( "GridMatchSkipDown: target not found", nrows, col, 
+                           report_text(*err) if err else None )
+                return None
+            while True:
+                try:
+                    pos = m(grid, row, col, scratch, st)
+                except IndexError, e:
+                    st.err = ( "GridMatchSkipDown: target not found", row, col, 
+                               report_text(*saved) if saved else None )
+                    return None
+                if pos is not None:
+                    break
+                saved = st.err
+                scratch.clear()
+                row += 1
+            return (row, col)
+        return f
 
 class GridMatchBaseUri(GridMatch):
     """
@@ -231,11 +610,21 @@ class GridMatchBaseUri(GridMatch):
         self._key = key
         return
     def match(self, grid, row, col):
-        (rl,(rnew,cnew)) = self._l.match(grid, row, col)
-        grid.baseUri(res[self._key])
-        (rr,(rnew,cnew)) = self._r.match(grid, row, col)
+        (rl,(rnew,cnew)) = submatch(self._l, grid, row, col)
+        grid.baseUri(rl[self._key])
+        (rr,(rnew,cnew)) = submatch(self._r, grid, row, col)
         rl.update(rr)
         return (rl, (rnew, cnew))
+    def _compile(self, cc):
+        l   = self._l.compiled(cc)
+        r   = self._r.compiled(cc)
+        key = self._key
+        def f(grid, row, col, res, st):
+            if l(grid, row, col, res, st) is None:
+                return None
+            grid.baseUri(res[key])
+            return r(grid, row, col, res, st)
+        return f
 
 # Match primitive classes
 
@@ -247,6 +636,10 @@ class start(GridMatch):
         return
     def match(self, grid, row, col):
         return ({}, (row, col))
+    def _compile(self, cc):
+        def f(grid, row, col, res, st):
+            return (row, col)
+        return f
 
 class text(GridMatch):
     """
@@ -259,6 +652,14 @@ class text(GridMatch):
         if grid.cell(row, col) != self._t:
             raise GridMatchError("gridmatch.text not matched", row, col, self._t)
         return ({}, (row+1, col+1))
+    def _compile(self, cc):
+        t = self._t
+        def f(grid, row, col, res, st):
+            if grid.cell(row, col) != t:
+                st.err = ("gridmatch.text not matched", row, col, t)
+                return None
+            return (row+1, col+1)
+        return f
 
 class anyval(GridMatch):
     """
@@ -270,6 +671,13 @@ class anyval(GridMatch):
     def match(self, grid, row, col):
         d = {self._k: grid.cell(row, col)} if self._k else {}
         return (d, (row+1, col+1))
+    def _compile(self, cc):
+        k = self._k
+        def f(grid, row, col, res, st):
+            if k:
+                put(res, st, k, grid.cell(row, col))
+            return (row+1, col+1)
+        return f
 
 class regexval(GridMatch):
     """
@@ -285,6 +693,17 @@ class regexval(GridMatch):
             raise GridMatchError("gridmatch.regexval not matched", row, col, self._r)
         d = {self._k: v} if self._k else {}
         return (d, (row+1, col+1))
+    def _compile(self, cc):
+        (r, rmatch, k) = (self._r, re.compile(self._r).match, self._k)
+        def f(grid, row, col, res, st):
+            v = grid.cell(row, col)
+            if not rmatch(v):
+                st.err = ("gridmatch.regexval not matched", row, col, r)
+                return None
+            if k:
+                put(res, st, k, v)
+            return (row+1, col+1)
+        return f
 
 class refval(GridMatch):
     """
@@ -299,6 +718,14 @@ class refval(GridMatch):
         u = grid.resolveUri(grid.cell(row, col))
         d = {self._k: u} if self._k else {}
         return (d, (row+1, col+1))
+    def _compile(self, cc):
+        k = self._k
+        def f(grid, row, col, res, st):
+            u = grid.resolveUri(grid.cell(row, col))
+            if k:
+                put(res, st, k, u)
+            return (row+1, col+1)
+        return f
 
 class intval(GridMatch):
     """
@@ -315,6 +742,19 @@ class intval(GridMatch):
             raise GridMatchError("gridmatch.intval not matched", row, col, t)
         d = {self._k: v} if self._k else {}
         return (d, (row+1, col+1))
+    def _compile(self, cc):
+        k = self._k
+        def f(grid, row, col, res, st):
+            t = grid.cell(row, col)
+            try:
+                v = int(t)
+            except Exception, e:
+                st.err = ("gridmatch.intval not matched", row, col, t)
+                return None
+            if k:
+                put(res, st, k, v)
+            return (row+1, col+1)
+        return f
 
 class save(GridMatch):
     """
@@ -325,6 +765,12 @@ class save(GridMatch):
         return
     def match(self, grid, row, col):
         return ({self._k: grid.cell(row, col)}, (row, col))
+    def _compile(self, cc):
+        k = self._k
+        def f(grid, row, col, res, st):
+            put(res, st, k, grid.cell(row, col))
+            return (row, col)
+        return f
 
 class value(GridMatch):
     """
@@ -335,6 +781,13 @@ class value(GridMatch):
         return
     def match(self, grid, row, col):
         return (self._d, (row, col))
+    def _compile(self, cc):
+        d = self._d
+        def f(grid, row, col, res, st):
+            for k in d:
+                put(res, st, k, d[k])
+            return (row, col)
+        return f
 
 class error(GridMatch):
     """
@@ -346,6 +799,12 @@ class error(GridMatch):
         return
     def match(self, grid, row, col):
         raise GridMatchError(self._msg, row, col, self._val)
+    def _compile(self, cc):
+        (msg, val) = (self._msg, self._val)
+        def f(grid, row, col, res, st):
+            st.err = (msg, row, col, val)
+            return None
+        return f
 
 class trace(GridMatch):
     """
@@ -0,0 +1,182 @@
+"""
+Input/output content manifest for incremental MELD data generation
+
+The manifest records a hash of each input file, a hash of the inputs used to 
+generate each stage (its spreadsheet row and JSON entry), and a hash of each
+entity emitted.  It is used to regenerate only stages whose inputs have changed, 
+to avoid rewriting files whose content is unchanged, and to find previously 
+generated entities that are no longer produced from any input.
+"""
+
+__author__      = "Graham Klyne (GK@ACM.ORG)"
+__copyright__   = "Copyright 2017, G. Klyne"
+__license__     = "MIT (http://opensource.org/licenses/MIT)"
+
+import os
+import os.path
+import json
+import hashlib
+
+import logging
+log = logging.getLogger(__name__)
+
+from profiling import profiler
+from entitywriter import entity_json_text, write_file_atomic
+
+MANIFEST_FILE = "climbgen_manifest.json"
+
+def text_hash(text):
+    """
+    Return hex digest of the supplied text (str or unicode)
+    """
+    if isinstance(text, unicode):
+        text = text.encode("utf-8")
+    return hashlib.sha1(text).hexdigest()
+
+def file_hash(filename):
+    """
+    Return hex digest of the content of the named file
+    """
+    h = hashlib.sha1()
+    with open(filename, "rb") as inpstr:
+        for chunk in iter(lambda: inpstr.read(65536), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def data_hash(*values):
+    """
+    Return hex digest of JSON-serializable values
+    """
+    return text_hash(json.dumps(values, sort_keys=True, separators=(',', ':')))
+
+class GenerationManifest(object):
+    """
+    Manifest of inputs and generated entities for incremental generation.
+
+    A manifest object also serves as the output sink for generated entities: 
+    entities are recorded against the stage being generated and passed on to 
+    the underlying writer only if their content differs from that previously 
+    generated.
+
+    @param filename:    name of manifest file; if the file does not exist, an empty 
+                        manifest is used, and all stages are generated.
+    @param writer:      sink to which new or changed entities are passed, which
+                        also provides 'write_text', 'has_entity' and 'delete'
+                        (see 'entitywriter.EntityWriter', 'entitystore.EntityStore').
+    """
+
+    def __init__(self, filename, writer):
+        self._filename = filename
+        self._writer   = writer
+        old = { "inputs": {}, "stages": {}, "entities": {} }
+        if os.path.exists(filename):
+            with open(filename) as inpstr:
+                old = json.load(inpstr)
+        self._old      = old
+        self._new      = { "inputs": {}, "stages": {}, "entities": {} }
+        self._stage    = None
+        self.written   = 0
+        self.unchanged = 0
+        return
+
+    def _entities_present(self, entity_refs):
+        for ref in entity_refs:
+            if not self._writer.has_entity(ref):
+                return False
+        return True
+
+    def inputs_unchanged(self, filenames):
+        """
+        Record hashes of input files.
+
+        Returns True if all of the files have the same content as when the manifest 
+        was last saved, and all previously generated entities are present.
+        """
+        unchanged = True
+        for f in filenames:
+            h = file_hash(f)
+            self._new["inputs"][f] = h
+            if self._old["inputs"].get(f) != h:
+                unchanged = False
+        return unchanged and self._entities_present(self._old["entities"])
+
+    def start_stage(self, stage_id, *inputs):
+        """
+        Start generation for a stage, and test whether it needs to be generated.
+
+        @param stage_id:    stage identifier
+        @param inputs:      JSON-serializable values from which the stage is generated.
+        @return             True if the stage must be generated, or False if its inputs 
+                            are unchanged and previously generated entities are present.
+        """
+        h   = data_hash(*inputs)
+        old = self._old["stages"].get(stage_id)
+        if old and old["inputs"] == h and self._entities_present(old["entities"]):
+            self._new["stages"][stage_id] = old
+            for ref in old["entities"]:
+                self._new["entities"][ref] = self._old["entities"][ref]
+            self._stage = None
+            log.info("GenerationManifest: stage %s unchanged"%(stage_id,))
+            return False
+        self._stage = { "inputs": h, "entities": [] }
+        self._new["stages"][stage_id] = self._stage
+        return True
+
+    def write(self, entity_ref, jsondata):
+        """
+        Sink interface: record entity, and write it if the content has changed.
+        """
+        profiler.count("entities:%s"%(jsondata.get("annal:type_id"),))
+        text = entity_json_text(jsondata)
+        h    = text_hash(text)
+        if self._stage is not None:
+            self._stage["entities"].append(entity_ref)
+        self._new["entities"][entity_ref] = h
+        if ( self._old["entities"].get(entity_ref) == h and 
+             self._writer.has_entity(entity_ref) ):
+            self.unchanged += 1
+            return
+        self._writer.write_text(entity_ref, text)
+        self.written += 1
+        return
+
+    def stale_entities(self):
+        """
+        Return list of previously generated entities that are no longer generated.
+        """
+        return sorted( ref for ref in self._old["entities"] 
+                           if ref not in self._new["entities"] )
+
+    def remove_stale(self, remove=False):
+        """
+        Report (and optionally remove, using the underlying writer) stale entities.
+
+        Call this before the underlying writer is closed.
+
+        @return     list of stale entity references.
+        """
+        stale = self.stale_entities()
+        for ref in stale:
+            if remove:
+                log.warning("GenerationManifest: removing stale entity %s"%(ref,))
+                self._writer.delete(ref)
+            else:
+                log.warning("GenerationManifest: stale entity %s"%(ref,))
+        log.info("GenerationManifest: %d written, %d unchanged, %d stale"%
+                 (self.written, self.unchanged, len(stale)))
+        return stale
+
+    def save(self):
+        """
+        Save the updated manifest.
+
+        Call this after the underlying writer has been closed, so that the manifest
+        is saved only if all entities have been written.
+        """
+        write_file_atomic(
+            self._filename, 
+            json.dumps(self._new, sort_keys=True, indent=2, separators=(',', ': '))
+            )
+        return
+
+# End.
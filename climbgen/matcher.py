@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+
+"""
+Streaming Muzicode matcher for live performance
+
+The Muzicodes of each stage are compiled into a single automaton that recognizes
+any of them in a stream of played notes.  The pattern for a Muzicode is taken from
+its note sequence (see noteseq): the highest note at each onset (so a chord is
+matched by its top note), either as MIDI pitches or, for transposition-invariant
+matching, as the intervals between them.
+
+The automaton is a bit-parallel (shift-and) matcher: each pattern position is a
+bit in one integer, and a note advances every active position at once with a
+shift and a mask, so the work per note does not depend on how much has been
+played.  In "pitch" mode, up to 'max_extra' extra notes are allowed between
+consecutive pattern notes, by keeping the positions reached after 0..max_extra
+extra notes.  In "interval" mode each interval is between consecutive played
+notes, so no extra notes are allowed.
+
+Automata for all stages are compiled in advance, so a stage switch just selects a
+different automaton.  A recorded performance can be replayed from a MIDI file.
+
+Usage:
+    python matcher.py NOTESEQDIR STAGE MIDIFILE [--mode pitch|interval]
+        [--max-extra N] [--dir DIR]
+
+replays MIDIFILE starting at STAGE, reporting recognized Muzicodes.  With --dir,
+the actions of each recognized Muzicode are dispatched from the collection 'd/'
+directory DIR, and matching continues at its cue stage.
+"""
+
+__author__      = "Graham Klyne (GK@ACM.ORG)"
+__copyright__   = "Copyright 2017, G. Klyne"
+__license__     = "MIT (http://opensource.org/licenses/MIT)"
+
+import sys
+import os
+import os.path
+import argparse
+
+from noteseq import read_npz
+from midifile import read_midi_notes
+
+import logging
+log = logging.getLogger(__name__)
+
+MATCH_MODES     = ["pitch", "interval"]
+MAX_EXTRA_NOTES = 2
+
+def melody(pitch, onset):
+    """
+    Return list of the highest pitch at each onset, in onset order.
+    """
+    top = {}
+    for (p, t) in zip(pitch, onset):
+        if t not in top or p > top[t]:
+            top[t] = p
+    return [ top[t] for t in sorted(top) ]
+
+def pattern_symbols(pitches, mode):
+    if mode == "interval":
+        return [ b - a for (a, b) in zip(pitches, pitches[1:]) ]
+    return list(pitches)
+
+class Automaton(object):
+    """
+    Compiled matcher for a set of patterns.
+
+    @param patterns:    list of (name, [symbol, ...]).
+    @param mode:        "pitch" or "interval".
+    @param max_extra:   maximum number of extra notes between pattern notes (pitch
+                        mode only).
+    """
+
+    def __init__(self, patterns, mode="pitch", max_extra=MAX_EXTRA_NOTES):
+        if mode not in MATCH_MODES:
+            raise ValueError("Unknown match mode %r"%(mode,))
+        self.mode      = mode
+        self.max_extra = max_extra if mode == "pitch" else 0
+        self.masks     = {}         # symbol -> positions with that symbol
+        self.init      = 0          # first positions of patterns
+        self.final     = 0          # last positions of patterns
+        self.ends      = {}         # last position -> pattern name
+        self.names     = []
+        pos = 0
+        for (name, symbols) in patterns:
+            if not symbols:
+                log.warning("Automaton: empty pattern for %s"%(name,))
+                continue
+            self.names.append(name)
+            self.init |= 1 << pos
+            for s in symbols:
+                self.masks[s] = self.masks.get(s, 0) | (1 << pos)
+                pos += 1
+            self.final |= 1 << (pos-1)
+            self.ends[pos-1] = name
+        self.notinit = ~self.init
+        return
+
+    def matches(self, hits):
+        """
+        Return names of patterns whose last positions are set in 'hits'.
+        """
+        names = []
+        while hits:
+            low = hits & -hits
+            names.append(self.ends[low.bit_length()-1])
+            hits ^= low
+        return names
+
+def compile_stage(arrays, mode="pitch", max_extra=MAX_EXTRA_NOTES):
+    """
+    Return Automaton for the Muzicodes in a stage's note sequence arrays (as read
+    by 'noteseq.read_npz').
+    """
+    patterns = []
+    for key in sorted(arrays):
+        if key.endswith(".pitch"):
+            name    = key[:-len(".pitch")]
+            pitches = melody(arrays[key], arrays[name+".onset"])
+            patterns.append((name, pattern_symbols(pitches, mode)))
+    return Automaton(patterns, mode, max_extra)
+
+def load_automata(noteseq_dir, mode="pitch", max_extra=MAX_EXTRA_NOTES):
+    """
+    Return {stage id: Automaton} for the "<stage>.npz" files in a directory.
+    """
+    automata = {}
+    for f in sorted(os.listdir(noteseq_dir)):
+        if f.endswith(".npz"):
+            automata[f[:-4]] = compile_stage(read_npz(os.path.join(noteseq_dir, f)), mode, max_extra)
+    return automata
+
+class Matcher(object):
+    """
+    Recognizes Muzicodes in a stream of notes, using the automaton for the
+    current stage.
+
+    @param automata:    {stage id: Automaton}.
+    @param stage:       initial stage id.
+    """
+
+    def __init__(self, automata, stage=None):
+        self._automata = automata
+        self.set_stage(stage)
+        return
+
+    def set_stage(self, stage):
+        """
+        Switch to the automaton for a stage, discarding any partial matches.
+        """
+        self.stage      = stage
+        self._automaton = self._automata.get(stage)
+        self._states    = [0]*((self._automaton.max_extra if self._automaton else 0) + 1)
+        self._last      = None
+        return
+
+    def note_on(self, pitch):
+        """
+        Process a played note, returning list of names of Muzicodes that it
+        completes (usually empty).
+        """
+        a = self._automaton
+        if a is None:
+            return []
+        if a.mode == "interval":
+            last       = self._last
+            self._last = pitch
+            if last is None:
+                return []
+            symbol = pitch - last
+        else:
+            symbol = pitch
+        states = self._states
+        active = 0
+        for s in states:
+            active |= s
+        reached = (((active << 1) & a.notinit) | a.init) & a.masks.get(symbol, 0)
+        states.pop()
+        states.insert(0, reached)
+        hits = reached & a.final
+        return a.matches(hits) if hits else []
+
+def replay(matcher, notes, dispatcher=None):
+    """
+    Feed recorded notes (as returned by 'midifile.read_midi_notes') to a matcher.
+    If a Dispatcher is supplied, the actions for each match are dispatched, and
+    matching continues at the cue stage (if any).  Returns list of
+    (time, stage, Muzicode name).
+    """
+    matched = []
+    for (event_time, pitch, velocity, channel) in notes:
+        if not velocity:
+            continue
+        for mc_name in matcher.note_on(pitch):
+            matched.append((event_time, matcher.stage, mc_name))
+            if dispatcher:
+                record = dispatcher.dispatch(matcher.stage, mc_name)
+                if record and record.cue_stage:
+                    matcher.set_stage(record.cue_stage)
+                    break
+    return matched
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog=os.path.basename(argv[0]),
+        description="Replay a MIDI file, reporting recognized Muzicodes"
+        )
+    parser.add_argument("noteseq_dir", help="Directory of note sequence (.npz) files")
+    parser.add_argument("stage", help="Initial stage id")
+    parser.add_argument("midifile", help="Recorded performance")
+    parser.add_argument("--mode", choices=MATCH_MODES, default="pitch",
+        help="Match pitches or intervals (default: %(default)s)")
+    parser.add_argument("--max-extra", type=int, default=MAX_EXTRA_NOTES,
+        help="Extra notes allowed between pattern notes (default: %(default)s)")
+    parser.add_argument("--dir", default=None,
+        help="Annalist collection entity directory for dispatching actions")
+    return parser.parse_args(argv[1:])
+
+def runMain():
+    options    = parse_args(sys.argv)
+    automata   = load_automata(options.noteseq_dir, options.mode, options.max_extra)
+    dispatcher = None
+    if options.dir:
+        from dispatch import Dispatcher
+        dispatcher = Dispatcher().load_collection(options.dir)
+    matcher = Matcher(automata, options.stage)
+    for (event_time, stage, mc_name) in replay(matcher, read_midi_notes(options.midifile), dispatcher):
+        print("%9.3f %s %s"%(event_time, stage, mc_name))
+    return 0
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    sys.exit(runMain())
+
+# End.
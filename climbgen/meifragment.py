@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+
+"""
+Extraction of MEI fragments for Muzicodes, with caching
+
+A Muzicode's MEI embodiment ('meld_Manifestation_Bag' entity) lists references to
+measures and notes in a stage MEI file (e.g. "5cFallingTrees.mei#note-...").  The
+fragment for a Muzicode is a small standalone MEI document containing the measures
+that are referenced, or that contain a referenced element, in document order,
+preceded by the score definition in effect at the first of them.
+
+Elements are located using the xml:id index (see meiindex), and copied as text
+from the source file, so the source need not be well-formed XML.
+
+Fragments are cached in memory and in a cache directory, each limited in total
+size, with least recently used fragments discarded first.  Cache keys include the
+SHA-1 digest of the source MEI file, so a fragment is regenerated only when its
+source file changes.
+
+Usage:
+    python meifragment.py OUTDIR [DIR] [--mei-dir MEIDIR]
+
+writes a fragment "<muzicode id>.mei" in OUTDIR for each Muzicode MEI embodiment
+in the collection 'd/' directory DIR (default "d/").
+"""
+
+__author__      = "Graham Klyne (GK@ACM.ORG)"
+__copyright__   = "Copyright 2017, G. Klyne"
+__license__     = "MIT (http://opensource.org/licenses/MIT)"
+
+import sys
+import os
+import os.path
+import errno
+import json
+import hashlib
+import collections
+import argparse
+
+from meiindex import MEIIndex, TAG_RE, local_name
+from entitywriter import write_file_atomic, ENTITY_DATA_FILE
+
+import logging
+log = logging.getLogger(__name__)
+
+FRAGMENT_CACHE_DIR  = ".meifragments"
+FRAGMENT_VERSION    = 1
+MEMORY_CACHE_SIZE   = 4*1024*1024
+DISK_CACHE_SIZE     = 64*1024*1024
+
+FRAGMENT_TEMPLATE = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'+
+    '%(mei)s\n'+
+    '<music><body><mdiv><score>\n'+
+    '%(scoredef)s\n'+
+    '<section>\n'+
+    '%(elements)s\n'+
+    '</section>\n'+
+    '</score></mdiv></body></music>\n'+
+    '</mei>\n'
+    )
+DEFAULT_MEI_TAG = '<mei xmlns="http://www.music-encoding.org/ns/mei">'
+
+def element_end(data, offset):
+    """
+    Return offset following the end of the element whose start tag is at 'offset'
+    in 'data', or None if the element is not closed.
+    """
+    depth = 0
+    pos   = offset
+    while True:
+        lt = data.find(b"<", pos)
+        if lt < 0:
+            return None
+        m = TAG_RE.match(data, lt)
+        if not m:
+            pos = lt + 1
+            continue
+        pos = m.end()
+        if m.group(2):
+            if not m.group(1):
+                depth += 1
+            if m.group(1) or m.group(4):
+                depth -= 1
+            if depth == 0:
+                return pos
+    return None
+
+def element_text(data, offset):
+    end = element_end(data, offset)
+    return data[offset:end] if end is not None else None
+
+def root_tag(data):
+    """
+    Return the start tag of the root 'mei' element, or None.
+    """
+    pos = 0
+    while True:
+        lt = data.find(b"<", pos)
+        if lt < 0:
+            return None
+        m = TAG_RE.match(data, lt)
+        if not m:
+            pos = lt + 1
+            continue
+        if m.group(2) and local_name(m.group(2)) == "mei" and not m.group(1):
+            return m.group(0)
+        pos = m.end()
+    return None
+
+def bag_members(jsondata):
+    """
+    Return list of (MEI file name, [xml:id, ...]) for the members of a Muzicode MEI
+    embodiment entity, in order of first appearance of each file.
+    """
+    files = collections.OrderedDict()
+    for member in jsondata.get("rdfs:member", []):
+        (meifile, sep, xmlid) = member["@id"].partition("#")
+        if sep:
+            files.setdefault(meifile, []).append(xmlid)
+    return list(files.items())
+
+class FragmentExtractor(object):
+    """
+    Extracts and caches MEI fragments.
+
+    @param meidir:      directory containing MEI files.
+    @param cache_dir:   directory for cached fragments (default: ".meifragments" in
+                        'meidir'), or False for no disk cache.
+    @param memory_size: maximum total size of fragments cached in memory.
+    @param disk_size:   maximum total size of fragments cached on disk.
+    @param meiindex:    MEIIndex for 'meidir' (created if not supplied).
+    """
+
+    def __init__(self, meidir, cache_dir=None, memory_size=MEMORY_CACHE_SIZE,
+                 disk_size=DISK_CACHE_SIZE, meiindex=None):
+        self._meidir      = meidir
+        self._cache_dir   = (
+            os.path.join(meidir, FRAGMENT_CACHE_DIR) if cache_dir is None else cache_dir
+            )
+        self._memory_size = memory_size
+        self._disk_size   = disk_size
+        self._meiindex    = meiindex or MEIIndex(meidir)
+        self._cache       = collections.OrderedDict()
+        self._cached_size = 0
+        self.hits         = 0
+        self.disk_hits    = 0
+        self.misses       = 0
+        return
+
+    def fragment_key(self, meifile, xmlids):
+        h = hashlib.sha1()
+        h.update("%d\n%s\n%s\n"%(FRAGMENT_VERSION, meifile, self._meiindex.file_hash(meifile)))
+        for xmlid in xmlids:
+            h.update(xmlid.encode("utf-8") + b"\n")
+        return h.hexdigest()
+
+    def fragment(self, meifile, xmlids):
+        """
+        Return MEI fragment document (bytes) for the given xml:id values in an MEI
+        file, from cache if possible.  Values may have a leading "#".
+        """
+        xmlids = [ x.lstrip("#") for x in xmlids ]
+        key    = self.fragment_key(meifile, xmlids)
+        text   = self._cache.pop(key, None)
+        if text is not None:
+            self.hits += 1
+        else:
+            text = self._read_disk_cache(key)
+            if text is not None:
+                self.disk_hits += 1
+            else:
+                self.misses += 1
+                text = self.extract(meifile, xmlids)
+                self._write_disk_cache(key, text)
+            self._cached_size += len(text)
+            while self._cached_size > self._memory_size and self._cache:
+                (k, t) = self._cache.popitem(last=False)
+                self._cached_size -= len(t)
+        self._cache[key] = text
+        return text
+
+    def muzicode_fragments(self, jsondata):
+        """
+        Return list of (MEI file name, fragment) for a Muzicode MEI embodiment
+        ('meld_Manifestation_Bag') entity.
+        """
+        return [ (meifile, self.fragment(meifile, xmlids))
+                 for (meifile, xmlids) in bag_members(jsondata) ]
+
+    def extract(self, meifile, xmlids):
+        """
+        Extract MEI fragment document for the given xml:id values in an MEI file.
+        """
+        index = self._meiindex.get_index(meifile)["ids"]
+        with open(os.path.join(self._meidir, meifile), "rb") as meistr:
+            data = meistr.read()
+        # Offsets of measures containing referenced elements, or of the elements
+        offsets = set()
+        for xmlid in xmlids:
+            entry = index.get(xmlid)
+            if entry is None:
+                log.warning("FragmentExtractor: %s#%s not found"%(meifile, xmlid))
+                continue
+            (elem, offset, measure) = entry
+            if elem != "measure" and measure is not None and measure in index:
+                offset = index[measure][1]
+            offsets.add(offset)
+        offsets  = sorted(offsets)
+        elements = [ element_text(data, o) for o in offsets ]
+        # Score definition in effect at the first element
+        scoredef = ""
+        if offsets:
+            scoredefs = [ entry[1] for entry in index.values()
+                          if entry[0] == "scoreDef" and entry[1] < offsets[0] ]
+            if scoredefs:
+                scoredef = element_text(data, max(scoredefs)) or ""
+        return FRAGMENT_TEMPLATE%(
+            { "mei":        root_tag(data) or DEFAULT_MEI_TAG
+            , "scoredef":   scoredef
+            , "elements":   "\n".join( e for e in elements if e )
+            })
+
+    def _cache_filename(self, key):
+        return os.path.join(self._cache_dir, key+".mei")
+
+    def _read_disk_cache(self, key):
+        if not self._cache_dir:
+            return None
+        filename = self._cache_filename(key)
+        try:
+            with open(filename, "rb") as f:
+                text = f.read()
+        except IOError, e:
+            return None
+        os.utime(filename, None)        # Mark as recently used
+        return text
+
+    def _write_disk_cache(self, key, text):
+        if not self._cache_dir:
+            return
+        try:
+            os.makedirs(self._cache_dir)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+        write_file_atomic(self._cache_filename(key), text)
+        self._trim_disk_cache()
+        return
+
+    def _trim_disk_cache(self):
+        """
+        Remove least recently used cached fragments while over the size limit.
+        """
+        entries = []
+        total   = 0
+        for f in os.listdir(self._cache_dir):
+            if f.endswith(".mei"):
+                st = os.stat(os.path.join(self._cache_dir, f))
+                entries.append((st.st_mtime, st.st_size, f))
+                total += st.st_size
+        entries.sort()
+        while total > self._disk_size and entries:
+            (mtime, size, f) = entries.pop(0)
+            os.remove(os.path.join(self._cache_dir, f))
+            total -= size
+        return
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog=os.path.basename(argv[0]),
+        description="Extract MEI fragments for Muzicodes"
+        )
+    parser.add_argument("outdir", help="Directory for extracted fragments")
+    parser.add_argument("dir", nargs="?", default="d/",
+        help="Annalist collection entity directory (default: %(default)s)")
+    parser.add_argument("--mei-dir", default="mei",
+        help="Directory containing stage MEI files (default: %(default)s)")
+    return parser.parse_args(argv[1:])
+
+def runMain():
+    options   = parse_args(sys.argv)
+    extractor = FragmentExtractor(options.mei_dir)
+    bag_dir   = os.path.join(options.dir, "meld_Manifestation_Bag")
+    if not os.path.isdir(options.outdir):
+        os.makedirs(options.outdir)
+    for mc_id in sorted(os.listdir(bag_dir)):
+        with open(os.path.join(bag_dir, mc_id, ENTITY_DATA_FILE)) as instr:
+            jsondata = json.load(instr)
+        for (meifile, text) in extractor.muzicode_fragments(jsondata):
+            write_file_atomic(os.path.join(options.outdir, mc_id+".mei"), text)
+            print("%s: %s, %d bytes"%(mc_id, meifile, len(text)))
+    return 0
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    sys.exit(runMain())
+
+# End.
@@ -0,0 +1,256 @@
+"""
+Persistent xml:id index for MEI files
+
+For each MEI file, an index maps every xml:id to the name of the element that 
+carries it, the byte offset of that element's start tag, and the xml:id of the 
+enclosing measure (if any).  Indexes are built with a streaming parser, so memory
+use does not depend on file size, and saved in an index directory alongside the 
+MEI files.  An index is rebuilt only when its MEI file changes.
+"""
+
+__author__      = "Graham Klyne (GK@ACM.ORG)"
+__copyright__   = "Copyright 2017, G. Klyne"
+__license__     = "MIT (http://opensource.org/licenses/MIT)"
+
+import os
+import os.path
+import errno
+import json
+import hashlib
+import re
+import multiprocessing
+
+import logging
+log = logging.getLogger(__name__)
+
+from entitywriter import write_file_atomic
+
+INDEX_DIR     = ".meiindex"
+INDEX_VERSION = 1
+CHUNK_SIZE    = 65536
+
+# Some MEI files are not well-formed XML (e.g. repeated attributes on a note), so 
+# tags are scanned with a tolerant tokenizer rather than an XML parser.
+MAX_TAG_SIZE  = 1024*1024
+TAG_RE        = re.compile(
+    r"<(?:!--.*?--|\?.*?\?|!\[CDATA\[.*?\]\]|![^>]*|"+
+    r"(/?)([\w:.\-]+)((?:\s+[\w:.\-]+\s*=\s*(?:\"[^\"]*\"|'[^']*'))*)\s*(/?))>",
+    re.S
+    )
+XML_ID_RE     = re.compile(r"\sxml:id\s*=\s*(?:\"([^\"]*)\"|'([^']*)')")
+
+def local_name(tag):
+    """
+    Return element name without namespace prefix
+    """
+    return tag.rsplit(":", 1)[-1]
+
+def scan_tags(meistr, digest=None):
+    """
+    Generate (byte offset, element name, attribute text, is_start, is_end) for each 
+    element tag in a stream of XML bytes, reading the stream in chunks.  
+    A self-closing tag is reported with both is_start and is_end true.
+
+    @param meistr:  stream from which XML bytes are read
+    @param digest:  if supplied, a hashlib object that is updated with all bytes read
+    """
+    buf  = b""
+    base = 0            # Stream offset of buf[0]
+    eof  = False
+    while not eof:
+        chunk = meistr.read(CHUNK_SIZE)
+        eof   = not chunk
+        if digest:
+            digest.update(chunk)
+        buf  += chunk
+        pos   = 0
+        while True:
+            lt = buf.find(b"<", pos)
+            if lt < 0:
+                pos = len(buf)
+                break
+            m = TAG_RE.match(buf, lt)
+            if not m:
+                if not eof and len(buf) - lt < MAX_TAG_SIZE:
+                    pos = lt        # Incomplete tag: read more
+                    break
+                pos = lt + 1        # Stray '<': skip
+                continue
+            pos = m.end()
+            if m.group(2):
+                is_end   = bool(m.group(1) or m.group(4))
+                is_start = not m.group(1)
+                yield (base+lt, local_name(m.group(2)), m.group(3), is_start, is_end)
+        buf   = buf[pos:]
+        base += pos
+    return
+
+def scan_mei_file(meifilename):
+    """
+    Scan MEI file, and return dictionary mapping each xml:id to a list
+    [element name, byte offset, enclosing measure id], and the SHA-1 digest 
+    of the file content.
+    """
+    ids      = {}
+    measures = []       # Stack of enclosing measure ids
+    h        = hashlib.sha1()
+    with open(meifilename, "rb") as meistr:
+        for (offset, elem, attrs, is_start, is_end) in scan_tags(meistr, digest=h):
+            if is_start:
+                m     = XML_ID_RE.search(attrs)
+                xmlid = (m.group(1) if m.group(1) is not None else m.group(2)) if m else None
+                if xmlid is not None:
+                    ids[xmlid] = [elem, offset, measures[-1] if measures else None]
+                if elem == "measure":
+                    measures.append(xmlid)
+            if is_end and elem == "measure" and measures:
+                measures.pop()
+    return (ids, h.hexdigest())
+
+def file_stamp(filename):
+    """
+    Return size and modification time used to detect changes to a file
+    """
+    st = os.stat(filename)
+    return [st.st_size, st.st_mtime]
+
+def index_filename(meifilename, index_dir=None):
+    """
+    Return name of index file for supplied MEI file
+    """
+    meidir, meiname = os.path.split(meifilename)
+    if index_dir is None:
+        index_dir = os.path.join(meidir, INDEX_DIR)
+    return os.path.join(index_dir, meiname+".json")
+
+def load_index(meifilename, index_dir=None):
+    """
+    Return saved index for MEI file if it is present and up to date, otherwise None
+    """
+    idxname = index_filename(meifilename, index_dir)
+    try:
+        with open(idxname) as idxstr:
+            index = json.load(idxstr)
+    except (IOError, ValueError), e:
+        return None
+    if ( index.get("version") != INDEX_VERSION or
+         index.get("stamp")   != file_stamp(meifilename) ):
+        return None
+    return index
+
+def build_index(meifilename, index_dir=None):
+    """
+    Return index for MEI file, rebuilding and saving it if the file has changed.
+    """
+    index = load_index(meifilename, index_dir)
+    if index is None:
+        log.info("build_index: %s"%(meifilename,))
+        stamp       = file_stamp(meifilename)
+        (ids, sha1) = scan_mei_file(meifilename)
+        index = (
+            { "version":    INDEX_VERSION
+            , "source":     os.path.basename(meifilename)
+            , "stamp":      stamp
+            , "sha1":       sha1
+            , "ids":        ids
+            })
+        idxname = index_filename(meifilename, index_dir)
+        try:
+            os.makedirs(os.path.dirname(idxname))
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+        write_file_atomic(idxname, json.dumps(index, separators=(',', ':')))
+    return index
+
+def _build_index_worker(args):
+    (meifilename, index_dir) = args
+    return build_index(meifilename, index_dir)
+
+class MEIIndex(object):
+    """
+    Index of xml:id values in a collection of MEI files.
+
+    @param meidir:      directory containing MEI files
+    @param index_dir:   directory for saved indexes (default: ".meiindex" in 'meidir')
+    """
+
+    def __init__(self, meidir, index_dir=None):
+        self._meidir    = meidir
+        self._index_dir = index_dir
+        self._indexes   = {}
+        return
+
+    def _meifilename(self, meifile):
+        return os.path.join(self._meidir, meifile)
+
+    def has_file(self, meifile):
+        """
+        Test if named MEI file is present in the MEI directory
+        """
+        return os.path.exists(self._meifilename(meifile))
+
+    def build(self, meifiles=None, processes=None):
+        """
+        Load or build indexes for the named MEI files (default: all files in the 
+        MEI directory), building changed indexes in parallel.
+        """
+        if meifiles is None:
+            meifiles = sorted( f for f in os.listdir(self._meidir) if f.endswith(".mei") )
+        todo = []
+        for f in meifiles:
+            index = load_index(self._meifilename(f), self._index_dir)
+            if index is None:
+                todo.append(f)
+            else:
+                self._indexes[f] = index
+        # Worker processes of a pool (e.g. batchgen) cannot start a pool of their own
+        daemon = multiprocessing.current_process().daemon
+        if len(todo) > 1 and processes != 1 and not daemon:
+            pool = multiprocessing.Pool(processes)
+            try:
+                built = pool.map(
+                    _build_index_worker, 
+                    [ (self._meifilename(f), self._index_dir) for f in todo ]
+                    )
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            built = [ build_index(self._meifilename(f), self._index_dir) for f in todo ]
+        for f, index in zip(todo, built):
+            self._indexes[f] = index
+        return self
+
+    def get_index(self, meifile):
+        """
+        Return index for named MEI file, building it if needed.
+        """
+        if meifile not in self._indexes:
+            self._indexes[meifile] = build_index(self._meifilename(meifile), self._index_dir)
+        return self._indexes[meifile]
+
+    def lookup(self, meifile, xmlid):
+        """
+        Return (element name, byte offset, measure id) for xml:id in MEI file, or None.
+        """
+        entry = self.get_index(meifile)["ids"].get(xmlid)
+        return tuple(entry) if entry else None
+
+    def file_hash(self, meifile):
+        """
+        Return SHA-1 digest of MEI file content, as recorded when it was indexed.
+        """
+        return self.get_index(meifile)["sha1"]
+
+    def dangling_refs(self, meifile, fragrefs):
+        """
+        Return list of fragment references (e.g. "#note-000000182051123") that do not 
+        identify any element in the named MEI file.
+        """
+        if not self.has_file(meifile):
+            return list(fragrefs)
+        ids = self.get_index(meifile)["ids"]
+        return [ r for r in fragrefs if r.lstrip("#") not in ids ]
+
+# End.
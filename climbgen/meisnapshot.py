@@ -0,0 +1,389 @@
+#!/usr/bin/env python
+
+"""
+Compact binary snapshots of parsed MEI files
+
+A snapshot holds the element tree of an MEI file in a form that can be used through
+a memory map without parsing or building the whole tree.  All tag names, attribute
+names and values, and text are interned in a string table.  Sections (all integers
+are unsigned 32-bit, little-endian):
+
+    header:     magic, SHA-1 digest of source (40 bytes), counts of strings,
+                elements, attributes, children and ids
+    strings:    nstrings+1 offsets into the UTF-8 string data, then the data
+    elements:   per element: tag, first attribute, attribute count, first child,
+                child count, text, tail, parent (NONE for no text or parent)
+    attributes: per attribute: name, value
+    children:   element numbers; the children of each element are contiguous
+    ids:        (xml:id string, element) pairs sorted by xml:id, for binary search
+
+Element 0 is the root element.  Text and attribute values are stored as they
+appear in the source (entity references are not expanded), and the source need
+not be well-formed XML (e.g. repeated attributes are kept).
+
+Snapshots are saved in a ".meisnapshot" directory next to the source files,
+named by the SHA-1 digest of the source content, so a changed source file gets a
+new snapshot.
+
+Usage:
+    python meisnapshot.py [MEIDIR]
+
+creates snapshots for all MEI files in MEIDIR (default "mei").
+"""
+
+__author__      = "Graham Klyne (GK@ACM.ORG)"
+__copyright__   = "Copyright 2017, G. Klyne"
+__license__     = "MIT (http://opensource.org/licenses/MIT)"
+
+import sys
+import os
+import os.path
+import errno
+import re
+import mmap
+import array
+import struct
+import hashlib
+
+from meiindex import TAG_RE
+from entitywriter import write_file_atomic
+
+import logging
+log = logging.getLogger(__name__)
+
+SNAPSHOT_DIR    = ".meisnapshot"
+SNAPSHOT_MAGIC  = b"MEISNAP1"
+HEADER          = struct.Struct("<8s40s5I")
+ELEMENT         = struct.Struct("<8I")
+NONE            = 0xFFFFFFFF
+ATTR_RE         = re.compile(r"([\w:.\-]+)\s*=\s*(?:\"([^\"]*)\"|'([^']*)')")
+
+def _uint_array(values=()):
+    a = array.array('I', values)
+    if a.itemsize != 4:
+        a = array.array('L', values)
+    return a
+
+def _le_bytes(a):
+    if sys.byteorder != "little":
+        a = array.array(a.typecode, a)
+        a.byteswap()
+    return a.tostring()
+
+class _Builder(object):
+    """
+    Accumulates the parsed tree in the snapshot layout.
+    """
+
+    def __init__(self):
+        self.strings  = []
+        self.string_nums = {}
+        self.elements = []      # [tag, attr_first, attr_count, text, tail, parent]
+        self.children = []      # element -> list of child elements
+        self.attrs    = []      # (name, value)
+        self.ids      = []      # (xml:id, element)
+        return
+
+    def string(self, s):
+        n = self.string_nums.get(s)
+        if n is None:
+            n = self.string_nums[s] = len(self.strings)
+            self.strings.append(s)
+        return n
+
+    def start(self, tag, attrtext, parent):
+        e = len(self.elements)
+        first = len(self.attrs)
+        for m in ATTR_RE.finditer(attrtext):
+            value = m.group(2) if m.group(2) is not None else m.group(3)
+            self.attrs.append((self.string(m.group(1)), self.string(value)))
+            if m.group(1) == "xml:id":
+                self.ids.append((value, e))
+        self.elements.append([self.string(tag), first, len(self.attrs)-first, NONE, NONE, parent])
+        self.children.append([])
+        if parent != NONE:
+            self.children[parent].append(e)
+        return e
+
+    def text(self, text, parent):
+        if not text or parent == NONE:
+            return
+        siblings = self.children[parent]
+        if siblings:
+            self.elements[siblings[-1]][4] = self.string(text)
+        else:
+            self.elements[parent][3] = self.string(text)
+        return
+
+    def tobytes(self, digest):
+        # Strings
+        data    = []
+        offsets = _uint_array([0])
+        pos     = 0
+        for s in self.strings:
+            b = s if isinstance(s, bytes) else s.encode("utf-8")
+            data.append(b)
+            pos += len(b)
+            offsets.append(pos)
+        # Elements and children
+        elems    = []
+        children = _uint_array()
+        for (e, (tag, attr_first, attr_count, text, tail, parent)) in enumerate(self.elements):
+            elems.append(ELEMENT.pack(
+                tag, attr_first, attr_count, len(children), len(self.children[e]),
+                text, tail, parent
+                ))
+            children.extend(self.children[e])
+        attrs = _uint_array()
+        for (n, v) in self.attrs:
+            attrs.extend((n, v))
+        ids = _uint_array()
+        for (xmlid, e) in sorted(self.ids):
+            ids.extend((self.string(xmlid), e))
+        header = HEADER.pack(
+            SNAPSHOT_MAGIC, digest, len(self.strings), len(self.elements),
+            len(self.attrs), len(children), len(ids)//2
+            )
+        return b"".join(
+            [ header, _le_bytes(offsets), b"".join(data) ] +
+            [ b"\0"*(-pos % 4) ] +
+            elems + [ _le_bytes(attrs), _le_bytes(children), _le_bytes(ids) ]
+            )
+
+def parse_mei(data, digest):
+    """
+    Parse MEI file content, and return snapshot bytes.
+    """
+    b      = _Builder()
+    stack  = []
+    parent = NONE
+    pos    = 0
+    while True:
+        lt = data.find(b"<", pos)
+        if lt < 0:
+            break
+        m = TAG_RE.match(data, lt)
+        if not m:
+            pos = lt + 1
+            continue
+        b.text(data[pos:lt], parent)
+        pos = m.end()
+        if not m.group(2):
+            continue            # Comment, processing instruction, etc.
+        if m.group(1):
+            # End tag
+            if stack:
+                parent = stack.pop()
+            continue
+        e = b.start(m.group(2), m.group(3), parent)
+        if not m.group(4):
+            stack.append(parent)
+            parent = e
+    return b.tobytes(digest)
+
+def snapshot_filename(meifilename, digest, snapshot_dir=None):
+    if snapshot_dir is None:
+        snapshot_dir = os.path.join(os.path.dirname(meifilename), SNAPSHOT_DIR)
+    return os.path.join(snapshot_dir, digest+".snap")
+
+def build_snapshot(meifilename, snapshot_dir=None, digest=None):
+    """
+    Create snapshot for an MEI file if there is none for its current content, and
+    return the snapshot file name.  A supplied digest may be str or unicode.
+    """
+    with open(meifilename, "rb") as f:
+        data = f.read()
+    # The digest is packed into the snapshot header, which needs a byte string
+    digest  = str(digest) if digest else hashlib.sha1(data).hexdigest()
+    snapname = snapshot_filename(meifilename, digest, snapshot_dir)
+    if not os.path.exists(snapname):
+        log.info("build_snapshot: %s"%(meifilename,))
+        try:
+            os.makedirs(os.path.dirname(snapname))
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+        write_file_atomic(snapname, parse_mei(data, digest))
+    return snapname
+
+def open_snapshot(meifilename, snapshot_dir=None, digest=None):
+    """
+    Return MEISnapshot for an MEI file, creating the snapshot if needed.  If the
+    SHA-1 digest of the file is known (e.g. from meiindex), the file is not read
+    when its snapshot exists.
+    """
+    if digest:
+        snapname = snapshot_filename(meifilename, digest, snapshot_dir)
+        if os.path.exists(snapname):
+            return MEISnapshot(snapname)
+    return MEISnapshot(build_snapshot(meifilename, snapshot_dir, digest))
+
+class MEISnapshot(object):
+    """
+    Memory-mapped snapshot of an MEI file.  Only the parts of the snapshot that are
+    used are read.
+
+    @param snapname:    snapshot file name.
+    """
+
+    def __init__(self, snapname):
+        with open(snapname, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, digest, nstrings, nelements, nattrs, nchildren, nids) = HEADER.unpack_from(self._map, 0)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError("%s is not an MEI snapshot"%(snapname,))
+        self.digest     = digest
+        self.nelements  = nelements
+        self._stroffs   = HEADER.size
+        self._strdata   = self._stroffs + 4*(nstrings+1)
+        strsize         = struct.unpack_from("<I", self._map, self._stroffs + 4*nstrings)[0]
+        self._elements  = self._strdata + strsize + (-strsize % 4)
+        self._attrs     = self._elements + ELEMENT.size*nelements
+        self._children  = self._attrs + 8*nattrs
+        self._ids       = self._children + 4*nchildren
+        self._nids      = nids
+        self._strcache  = {}
+        return
+
+    def close(self):
+        self._map.close()
+        return
+
+    def string(self, n):
+        if n == NONE:
+            return None
+        s = self._strcache.get(n)
+        if s is None:
+            (beg, end) = struct.unpack_from("<2I", self._map, self._stroffs + 4*n)
+            s = self._strcache[n] = self._map[self._strdata+beg:self._strdata+end].decode("utf-8")
+        return s
+
+    def _element(self, e):
+        return ELEMENT.unpack_from(self._map, self._elements + ELEMENT.size*e)
+
+    def root(self):
+        return SnapshotElement(self, 0)
+
+    def element(self, e):
+        return SnapshotElement(self, e)
+
+    def element_by_id(self, xmlid):
+        """
+        Return element with the given xml:id, or None.
+        """
+        lo = 0
+        hi = self._nids
+        while lo < hi:
+            mid = (lo + hi) // 2
+            (s, e) = struct.unpack_from("<2I", self._map, self._ids + 8*mid)
+            v = self.string(s)
+            if v < xmlid:
+                lo = mid + 1
+            elif v > xmlid:
+                hi = mid
+            else:
+                return SnapshotElement(self, e)
+        return None
+
+class SnapshotElement(object):
+    """
+    View of an element in a snapshot.
+    """
+
+    __slots__ = ("_snap", "index")
+
+    def __init__(self, snap, index):
+        self._snap = snap
+        self.index = index
+        return
+
+    @property
+    def tag(self):
+        return self._snap.string(self._snap._element(self.index)[0])
+
+    @property
+    def text(self):
+        return self._snap.string(self._snap._element(self.index)[5])
+
+    @property
+    def tail(self):
+        return self._snap.string(self._snap._element(self.index)[6])
+
+    def parent(self):
+        p = self._snap._element(self.index)[7]
+        return SnapshotElement(self._snap, p) if p != NONE else None
+
+    def items(self):
+        """
+        Return list of (name, value) for attributes, in source order.
+        """
+        snap = self._snap
+        (tag, first, count) = snap._element(self.index)[:3]
+        vals = struct.unpack_from("<%dI"%(2*count,), snap._map, snap._attrs + 8*first)
+        return [ (snap.string(vals[i]), snap.string(vals[i+1])) for i in range(0, len(vals), 2) ]
+
+    def get(self, name, default=None):
+        for (n, v) in self.items():
+            if n == name:
+                return v
+        return default
+
+    def children(self):
+        snap = self._snap
+        (first, count) = snap._element(self.index)[3:5]
+        return [ SnapshotElement(snap, c)
+                 for c in struct.unpack_from("<%dI"%(count,), snap._map, snap._children + 4*first) ]
+
+    def __iter__(self):
+        return iter(self.children())
+
+    def iter(self, tag=None):
+        """
+        Generate this element and its descendants in document order, optionally
+        only those with the given tag.
+        """
+        stack = [self]
+        while stack:
+            e = stack.pop()
+            if tag is None or e.tag == tag:
+                yield e
+            stack.extend(reversed(e.children()))
+        return
+
+    def to_xml(self):
+        """
+        Return XML text for this element and its content (without its tail).
+        """
+        parts = []
+        self._to_xml(parts)
+        return u"".join(parts)
+
+    def _to_xml(self, parts):
+        attrs = u"".join( u' %s="%s"'%(n, v) for (n, v) in self.items() )
+        kids  = self.children()
+        text  = self.text
+        if not kids and text is None:
+            parts.append(u"<%s%s/>"%(self.tag, attrs))
+            return
+        parts.append(u"<%s%s>"%(self.tag, attrs))
+        if text:
+            parts.append(text)
+        for k in kids:
+            k._to_xml(parts)
+            if k.tail:
+                parts.append(k.tail)
+        parts.append(u"</%s>"%(self.tag,))
+        return
+
+def runMain():
+    meidir = sys.argv[1] if len(sys.argv) > 1 else "mei"
+    for meifile in sorted(f for f in os.listdir(meidir) if f.endswith(".mei")):
+        snapname = build_snapshot(os.path.join(meidir, meifile))
+        print("%s: %s, %d bytes"%(meifile, os.path.basename(snapname), os.path.getsize(snapname)))
+    return 0
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    sys.exit(runMain())
+
+# End.
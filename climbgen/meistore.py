@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+
+"""
+Content-addressed store for MEI files
+
+Each distinct MEI file content is stored once, under its SHA-1 digest, in
+"objects/<first 2 hex digits>/<digest>" within the store directory.  A manifest
+("manifest.json") maps MEI file names (as used in 'climbstage:<meifile>' URLs) to
+digests, so files with identical content share a single stored object.
+
+Consumers resolve a file name through the manifest.  Stores are synchronized by
+comparing digests, so content already present at the destination is never copied.
+
+Stored objects are made read-only.  Exported files are copies of stored content,
+unless hard links are requested, in which case a linked file that is changed in
+place (e.g. by a process with permission to write read-only files) also changes
+the stored object.
+
+Usage:
+    python meistore.py import STORE MEIDIR
+    python meistore.py verify STORE MEIDIR
+    python meistore.py export STORE DIR
+    python meistore.py push STORE DESTSTORE
+    python meistore.py gc STORE
+"""
+
+__author__      = "Graham Klyne (GK@ACM.ORG)"
+__copyright__   = "Copyright 2017, G. Klyne"
+__license__     = "MIT (http://opensource.org/licenses/MIT)"
+
+import sys
+import os
+import os.path
+import errno
+import json
+import hashlib
+import shutil
+import tempfile
+
+from entitywriter import write_file_atomic, FILE_MODE
+
+import logging
+log = logging.getLogger(__name__)
+
+STORE_MANIFEST  = "manifest.json"
+STORE_OBJECTS   = "objects"
+HASH_BLOCK_SIZE = 65536
+OBJECT_MODE     = FILE_MODE & 0o444
+
+def content_hash(filename):
+    """
+    Return SHA-1 digest of file content (as recorded by meiindex).
+    """
+    h = hashlib.sha1()
+    with open(filename, "rb") as f:
+        while True:
+            block = f.read(HASH_BLOCK_SIZE)
+            if not block:
+                break
+            h.update(block)
+    return h.hexdigest()
+
+def make_dirs(dirname):
+    try:
+        os.makedirs(dirname)
+    except OSError, e:
+        if e.errno != errno.EEXIST:
+            raise
+    return
+
+class MEIStore(object):
+    """
+    Content-addressed MEI file store.
+
+    @param store_dir:   store directory, created if needed.
+    """
+
+    def __init__(self, store_dir):
+        self._store_dir = store_dir
+        make_dirs(os.path.join(store_dir, STORE_OBJECTS))
+        try:
+            with open(os.path.join(store_dir, STORE_MANIFEST)) as f:
+                self._manifest = json.load(f)
+        except IOError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            self._manifest = {}
+        return
+
+    def save(self):
+        write_file_atomic(
+            os.path.join(self._store_dir, STORE_MANIFEST),
+            json.dumps(self._manifest, sort_keys=True, indent=2, separators=(',', ': '))
+            )
+        return
+
+    def object_path(self, digest):
+        return os.path.join(self._store_dir, STORE_OBJECTS, digest[:2], digest)
+
+    def has_object(self, digest):
+        return os.path.exists(self.object_path(digest))
+
+    def names(self):
+        return sorted(self._manifest)
+
+    def digest(self, meifile):
+        """
+        Return digest for named MEI file, or None.
+        """
+        return self._manifest.get(meifile)
+
+    def resolve(self, meifile):
+        """
+        Return file name of stored content for named MEI file, or None.
+        """
+        digest = self._manifest.get(meifile)
+        return self.object_path(digest) if digest else None
+
+    def add_file(self, filename, meifile=None, digest=None):
+        """
+        Add file to the store under the given name (default: the file's base name),
+        storing its content only if not already present.  Returns the digest.  Call
+        'save' to save the updated manifest.
+        """
+        meifile = meifile or os.path.basename(filename)
+        digest  = digest or content_hash(filename)
+        if not self.has_object(digest):
+            self._add_object(filename, digest)
+        self._manifest[meifile] = digest
+        return digest
+
+    def _add_object(self, filename, digest):
+        objpath = self.object_path(digest)
+        objdir  = os.path.dirname(objpath)
+        make_dirs(objdir)
+        # A unique temporary file, so that concurrent imports do not collide
+        fd, tmppath = tempfile.mkstemp(dir=objdir, prefix=".tmp_")
+        try:
+            with os.fdopen(fd, "wb") as outstr, open(filename, "rb") as instr:
+                shutil.copyfileobj(instr, outstr, HASH_BLOCK_SIZE)
+            os.chmod(tmppath, OBJECT_MODE)
+            try:
+                os.rename(tmppath, objpath)
+            except OSError, e:
+                # Windows does not allow rename over an existing file; an object
+                # stored meanwhile by another import has the same content
+                if not os.path.exists(objpath):
+                    raise
+        finally:
+            if os.path.exists(tmppath):
+                os.remove(tmppath)
+        return
+
+    def import_dir(self, meidir, meiindex=None):
+        """
+        Add all MEI files in a directory.  If an MEIIndex for the directory is
+        supplied, digests recorded in its indexes are used.  Returns list of
+        (meifile, digest, stored) where 'stored' is True if new content was stored.
+        """
+        added = []
+        for meifile in sorted(f for f in os.listdir(meidir) if f.endswith(".mei")):
+            digest = meiindex.file_hash(meifile) if meiindex else None
+            digest = digest or content_hash(os.path.join(meidir, meifile))
+            stored = not self.has_object(digest)
+            self.add_file(os.path.join(meidir, meifile), meifile, digest)
+            added.append((meifile, digest, stored))
+        self.save()
+        return added
+
+    def verify(self, meifile, filename=None, digest=None):
+        """
+        Return True if the named MEI file is in the store, its stored content is
+        present, and (if given) the digest of a local copy or a known digest matches.
+        """
+        expected = self._manifest.get(meifile)
+        if not expected or not self.has_object(expected):
+            return False
+        if digest is None and filename is not None:
+            digest = content_hash(filename)
+        return digest is None or digest == expected
+
+    def export(self, dest_dir, link=False):
+        """
+        Make the stored MEI files available by name in a directory, as copies of
+        stored content, or if 'link' is True as (read-only) hard links to stored 
+        content where possible.
+        """
+        make_dirs(dest_dir)
+        for (meifile, digest) in sorted(self._manifest.items()):
+            dest = os.path.join(dest_dir, meifile)
+            if os.path.exists(dest):
+                if content_hash(dest) == digest:
+                    continue
+                os.remove(dest)
+            if link and hasattr(os, "link"):
+                try:
+                    # Objects stored by earlier versions may still be writable
+                    os.chmod(self.object_path(digest), OBJECT_MODE)
+                    os.link(self.object_path(digest), dest)
+                    continue
+                except OSError, e:
+                    pass
+            shutil.copyfile(self.object_path(digest), dest)
+        return
+
+    def push(self, other):
+        """
+        Copy to another store the stored content that it does not have, and update
+        its manifest.  Returns the number of objects copied.
+        """
+        copied = 0
+        for digest in sorted(set(self._manifest.values())):
+            if not other.has_object(digest):
+                other._add_object(self.object_path(digest), digest)
+                copied += 1
+        other._manifest.update(self._manifest)
+        other.save()
+        return copied
+
+    def gc(self):
+        """
+        Remove stored content that is not referenced by the manifest.  Returns the
+        number of objects removed.
+        """
+        live    = set(self._manifest.values())
+        removed = 0
+        objdir  = os.path.join(self._store_dir, STORE_OBJECTS)
+        for sub in os.listdir(objdir):
+            for digest in os.listdir(os.path.join(objdir, sub)):
+                if digest not in live:
+                    os.remove(os.path.join(objdir, sub, digest))
+                    removed += 1
+        return removed
+
+def check_stage_mei(stage_meifiles, store, meiindex=None):
+    """
+    Return list of (meifile, problem) for stage MEI files that are not in the store,
+    or whose content differs from the indexed MEI file (if an MEIIndex is supplied).
+    """
+    problems = []
+    for meifile in stage_meifiles:
+        if store.digest(meifile) is None:
+            problems.append((meifile, "not in MEI store"))
+        elif not store.verify(meifile):
+            problems.append((meifile, "stored content missing"))
+        elif meiindex and meiindex.has_file(meifile):
+            if meiindex.file_hash(meifile) != store.digest(meifile):
+                problems.append((meifile, "differs from MEI store"))
+    return problems
+
+def runMain():
+    usage = "Usage: %s import|verify|export|push|gc STORE [MEIDIR|DIR|DESTSTORE]"
+    if len(sys.argv) < 3 or sys.argv[1] not in ("import", "verify", "export", "push", "gc"):
+        print(usage%(sys.argv[0],))
+        return 2
+    (command, store) = (sys.argv[1], MEIStore(sys.argv[2]))
+    arg = sys.argv[3] if len(sys.argv) > 3 else None
+    if command != "gc" and arg is None:
+        print(usage%(sys.argv[0],))
+        return 2
+    status = 0
+    if command == "import":
+        added  = store.import_dir(arg)
+        stored = len([ a for a in added if a[2] ])
+        print("%d files imported, %d new objects stored"%(len(added), stored))
+    elif command == "verify":
+        for meifile in sorted(f for f in os.listdir(arg) if f.endswith(".mei")):
+            if not store.verify(meifile, filename=os.path.join(arg, meifile)):
+                print("%s: does not match MEI store"%(meifile,))
+                status = 1
+    elif command == "export":
+        store.export(arg)
+    elif command == "push":
+        copied = store.push(MEIStore(arg))
+        print("%d objects copied"%(copied,))
+    else:
+        print("%d unreferenced objects removed"%(store.gc(),))
+    return status
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    sys.exit(runMain())
+
+# End.
@@ -0,0 +1,147 @@
+"""
+Reading and writing note events in Standard MIDI Files
+
+Only what is needed to record and replay performances is supported: note-on and
+note-off events (a note-on with velocity 0 is a note-off), and tempo changes.
+Other events are skipped when reading.  Events from all tracks are merged, and
+times are converted to seconds.
+"""
+
+__author__      = "Graham Klyne (GK@ACM.ORG)"
+__copyright__   = "Copyright 2017, G. Klyne"
+__license__     = "MIT (http://opensource.org/licenses/MIT)"
+
+import struct
+
+from entitywriter import write_file_atomic
+
+import logging
+log = logging.getLogger(__name__)
+
+DEFAULT_TEMPO   = 500000        # Microseconds per quarter note (120 bpm)
+DEFAULT_DIVISION = 480          # Ticks per quarter note
+
+def _read_varlen(data, pos):
+    value = 0
+    while True:
+        b = ord(data[pos])
+        pos += 1
+        value = (value << 7) | (b & 0x7F)
+        if not b & 0x80:
+            return (value, pos)
+
+def _track_events(data, pos, end):
+    """
+    Generate (tick, status, data bytes) for events in a track chunk.
+    """
+    tick    = 0
+    running = None
+    while pos < end:
+        (delta, pos) = _read_varlen(data, pos)
+        tick  += delta
+        status = ord(data[pos])
+        if status == 0xFF:
+            # Meta event
+            mtype = ord(data[pos+1])
+            (length, pos) = _read_varlen(data, pos+2)
+            yield (tick, 0xFF, (mtype, data[pos:pos+length]))
+            pos += length
+            if mtype == 0x2F:
+                return
+            continue
+        if status in (0xF0, 0xF7):
+            # System exclusive
+            (length, pos) = _read_varlen(data, pos+1)
+            pos += length
+            continue
+        if status & 0x80:
+            running = status
+            pos += 1
+        elif running is None:
+            raise ValueError("MIDI data byte without status at offset %d"%(pos,))
+        nbytes = 1 if (running & 0xF0) in (0xC0, 0xD0) else 2
+        yield (tick, running, data[pos:pos+nbytes])
+        pos += nbytes
+    return
+
+def read_midi_notes(filename):
+    """
+    Return list of (time in seconds, pitch, velocity, channel) for the notes in a
+    Standard MIDI File, in time order.  Velocity is 0 for note-off events.
+    """
+    with open(filename, "rb") as f:
+        data = f.read()
+    if data[:4] != b"MThd":
+        raise ValueError("%s is not a Standard MIDI File"%(filename,))
+    (hdrlen,) = struct.unpack_from(">I", data, 4)
+    (fmt, ntracks, division) = struct.unpack_from(">HHH", data, 8)
+    if division & 0x8000:
+        raise ValueError("%s: SMPTE time division is not supported"%(filename,))
+    pos    = 8 + hdrlen
+    events = []
+    tempos = [(0, DEFAULT_TEMPO)]
+    while pos + 8 <= len(data):
+        (chunk, length) = struct.unpack_from(">4sI", data, pos)
+        pos += 8
+        if chunk == b"MTrk":
+            for (tick, status, body) in _track_events(data, pos, pos+length):
+                if status == 0xFF:
+                    if body[0] == 0x51:
+                        tempos.append((tick, struct.unpack(">I", b"\0"+body[1])[0]))
+                    continue
+                kind = status & 0xF0
+                if kind in (0x80, 0x90):
+                    velocity = ord(body[1]) if kind == 0x90 else 0
+                    events.append((tick, ord(body[0]), velocity, status & 0x0F))
+        pos += length
+    # Convert ticks to seconds
+    # Sort by tick only (a stable sort), so a file's tick 0 tempo follows, and so 
+    # replaces, the default tempo
+    tempos.sort(key=lambda t: t[0])
+    events.sort()
+    notes = []
+    (seg_tick, seg_time, tempo, t) = (0, 0.0, DEFAULT_TEMPO, 0)
+    for (tick, pitch, velocity, channel) in events:
+        while t < len(tempos) and tempos[t][0] <= tick:
+            seg_time += (tempos[t][0] - seg_tick)*tempo/(1e6*division)
+            seg_tick  = tempos[t][0]
+            tempo     = tempos[t][1]
+            t += 1
+        notes.append(
+            (seg_time + (tick - seg_tick)*tempo/(1e6*division), pitch, velocity, channel)
+            )
+    return notes
+
+def _varlen(value):
+    b = [value & 0x7F]
+    value >>= 7
+    while value:
+        b.append(0x80 | (value & 0x7F))
+        value >>= 7
+    return b"".join(chr(x) for x in reversed(b))
+
+def write_midi_notes(filename, notes, division=DEFAULT_DIVISION, tempo=DEFAULT_TEMPO):
+    """
+    Write (time in seconds, pitch, velocity, channel) note events to a format 0
+    Standard MIDI File.  Velocity 0 is written as a note-off event.
+    """
+    track = [ b"\0\xFF\x51\x03" + struct.pack(">I", tempo)[1:] ]
+    ticks_per_sec = 1e6*division/tempo
+    last  = 0
+    for (event_time, pitch, velocity, channel) in sorted(notes):
+        tick = int(round(event_time*ticks_per_sec))
+        if velocity:
+            event = chr(0x90 | channel) + chr(pitch) + chr(velocity)
+        else:
+            event = chr(0x80 | channel) + chr(pitch) + chr(0)
+        track.append(_varlen(tick - last) + event)
+        last = tick
+    track.append(b"\0\xFF\x2F\0")
+    trackdata = b"".join(track)
+    write_file_atomic(filename,
+        b"MThd" + struct.pack(">IHHH", 6, 0, 1, division) +
+        b"MTrk" + struct.pack(">I", len(trackdata)) + trackdata
+        )
+    return
+
+# End.
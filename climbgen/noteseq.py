@@ -0,0 +1,411 @@
+#!/usr/bin/env python
+
+"""
+Note sequences for stage scores and Muzicodes
+
+For each stage MEI file, the notes of the score are extracted as parallel arrays:
+
+    pitch:      MIDI note number, from 'pname', 'oct' and the sounding accidental
+                ('accid.ges' or 'accid', on the note or a child 'accid' element,
+                else an accidental earlier in the measure, else the key signature)
+    onset:      start time in quarter notes from the start of the score
+    duration:   duration in quarter notes, from 'dur' and 'dots' (of the note, or
+                its chord) and any enclosing tuplets; grace notes have duration 0
+    staff:      staff number
+    measure:    measure number, counting from 0 in document order
+
+ordered by onset, staff and pitch.  Notes without 'pname' or 'oct' are timed but
+not included.  Each layer of a measure is timed separately,
+starting at the end of the preceding measure (the end of its longest layer).
+
+The notes of a Muzicode are the notes (or chords) referenced by its 'meielements';
+if it references only measures, all notes in those measures are used.  These are
+saved as arrays "<name>.pitch", "<name>.onset" and "<name>.duration".
+
+Arrays are saved in a NumPy ".npz" file for each stage, written using the standard
+'array' module (NumPy is not required), so feature computations over many
+sequences can be done as array operations instead of traversing MEI.  'read_npz'
+reads the files back as 'array' values.
+
+Usage:
+    python noteseq.py OUTDIR [--mei-dir MEIDIR] [--json JSONFILE]
+"""
+
+__author__      = "Graham Klyne (GK@ACM.ORG)"
+__copyright__   = "Copyright 2017, G. Klyne"
+__license__     = "MIT (http://opensource.org/licenses/MIT)"
+
+import sys
+import os
+import os.path
+import json
+import ast
+import array
+import struct
+import zipfile
+import io
+import argparse
+from fractions import Fraction
+
+from meiindex import MEIIndex, local_name
+from meisnapshot import open_snapshot
+from entitywriter import write_file_atomic
+
+import logging
+log = logging.getLogger(__name__)
+
+PNAME_PC        = {"c": 0, "d": 2, "e": 4, "f": 5, "g": 7, "a": 9, "b": 11}
+ACCID_ALTER     = {"s": 1, "f": -1, "ss": 2, "x": 2, "ff": -2, "n": 0, "su": 1, "fd": -1}
+SHARP_ORDER     = "fcgdaeb"
+FLAT_ORDER      = "beadgcf"
+DUR_QUARTERS    = {"long": Fraction(16), "breve": Fraction(8)}
+WHOLE_MEASURE   = Fraction(4)
+NOTE_ARRAYS     = [("pitch", "h"), ("onset", "d"), ("duration", "d"), ("staff", "h"), ("measure", "i")]
+MUZICODE_ARRAYS = ["pitch", "onset", "duration"]
+
+NPY_MAGIC       = b"\x93NUMPY\x01\x00"
+NPY_DESCR       = {"b": "|i1", "h": "<i2", "i": "<i4", "f": "<f4", "d": "<f8"}
+
+def note_pitch(pname, octave, alter=0):
+    """
+    Return MIDI note number for pitch name, octave and alteration in semitones.
+    """
+    return 12*(int(octave)+1) + PNAME_PC[pname.lower()] + alter
+
+def duration_quarters(dur, dots=None):
+    """
+    Return duration in quarter notes (a Fraction) for MEI 'dur' and 'dots' values.
+    """
+    if dur in DUR_QUARTERS:
+        d = DUR_QUARTERS[dur]
+    else:
+        d = Fraction(4, int(dur))
+    if dots:
+        d *= 2 - Fraction(1, 2**int(dots))
+    return d
+
+def key_alters(keysig):
+    """
+    Return {pname: alteration} for an MEI key signature (e.g. "0", "2s", "3f").
+    """
+    if not keysig or keysig in ("0", "mixed"):
+        return {}
+    (n, acc) = (int(keysig[:-1]), keysig[-1])
+    order = SHARP_ORDER if acc == "s" else FLAT_ORDER
+    return dict( (p, ACCID_ALTER[acc]) for p in order[:n] )
+
+def meter_quarters(count, unit):
+    return Fraction(4*int(count), int(unit))
+
+def intervals(pitch):
+    """
+    Return array of successive pitch intervals (a transposition-invariant profile).
+    """
+    return array.array(pitch.typecode, [ b - a for (a, b) in zip(pitch, pitch[1:]) ])
+
+class NoteSequence(object):
+    """
+    Notes extracted from an MEI file, and the notes under each element with an
+    xml:id.
+    """
+
+    def __init__(self):
+        self.arrays = dict( (name, array.array(code)) for (name, code) in NOTE_ARRAYS )
+        self._ids   = {}        # xml:id -> list of note numbers
+        self._tags  = {}        # xml:id -> element name
+        return
+
+    def __len__(self):
+        return len(self.arrays["pitch"])
+
+    def _add(self, pitch, onset, duration, staff, measure, xmlids):
+        i = len(self)
+        for (name, v) in zip(("pitch", "onset", "duration", "staff", "measure"),
+                             (pitch, onset, duration, staff, measure)):
+            self.arrays[name].append(v)
+        for xmlid in xmlids:
+            if xmlid:
+                self._ids.setdefault(xmlid, []).append(i)
+        return
+
+    def _sort(self):
+        a     = self.arrays
+        order = sorted(range(len(self)), key=lambda i: (a["onset"][i], a["staff"][i], a["pitch"][i]))
+        new   = array.array('i', [0]*len(order))
+        for (n, i) in enumerate(order):
+            new[i] = n
+        for (name, code) in NOTE_ARRAYS:
+            a[name] = array.array(code, [ a[name][i] for i in order ])
+        for xmlid in self._ids:
+            self._ids[xmlid] = [ new[i] for i in self._ids[xmlid] ]
+        return
+
+    def select(self, xmlids):
+        """
+        Return sorted note numbers for a Muzicode's MEI element references: the
+        referenced notes and chords, or if there are none, all notes in the
+        referenced measures.
+        """
+        xmlids   = [ x.lstrip("#") for x in xmlids ]
+        notes    = [ x for x in xmlids if self._tags.get(x) != "measure" ]
+        selected = set()
+        for xmlid in (notes or xmlids):
+            selected.update(self._ids.get(xmlid, []))
+        return sorted(selected)
+
+    def take(self, indexes, names=MUZICODE_ARRAYS):
+        """
+        Return {name: array} of values for the given note numbers.
+        """
+        return dict( (name, array.array(self.arrays[name].typecode,
+                                        [ self.arrays[name][i] for i in indexes ]))
+                     for name in names )
+
+class _Extractor(object):
+    """
+    Walks a snapshot of an MEI file, accumulating a NoteSequence.
+    """
+
+    def __init__(self):
+        self.notes    = NoteSequence()
+        self.keysig   = {}          # staff (or None for default) -> {pname: alter}
+        self.meter    = {}          # staff (or None for default) -> quarters per measure
+        self.time     = Fraction(0)
+        self.measure  = -1
+        return
+
+    def _staff_value(self, values, staff, default):
+        return values.get(staff, values.get(None, default))
+
+    def walk(self, elem):
+        tag = local_name(elem.tag)
+        if tag == "scoreDef":
+            self._score_def(elem, None)
+        elif tag == "staffDef":
+            self._score_def(elem, int(elem.get("n", 0)))
+        elif tag == "measure":
+            self._measure(elem)
+            return
+        for child in elem.children():
+            self.walk(child)
+        return
+
+    def _score_def(self, elem, staff):
+        if elem.get("key.sig") is not None:
+            self.keysig[staff] = key_alters(elem.get("key.sig"))
+            if staff is None:
+                self.keysig = { None: self.keysig[None] }
+        if elem.get("meter.count") and elem.get("meter.unit"):
+            self.meter[staff] = meter_quarters(elem.get("meter.count"), elem.get("meter.unit"))
+            if staff is None:
+                self.meter = { None: self.meter[None] }
+        return
+
+    def _measure(self, elem):
+        self.measure += 1
+        start   = self.time
+        end     = start
+        mid     = elem.get("xml:id")
+        self.notes._tags[mid] = "measure"
+        for staff in elem.children():
+            tag = local_name(staff.tag)
+            if tag in ("scoreDef", "staffDef"):
+                self.walk(staff)
+            if tag != "staff":
+                continue
+            n       = int(staff.get("n", 0))
+            carried = {}            # (pname, oct) -> alter, for accidentals in measure
+            for layer in staff.children():
+                if local_name(layer.tag) == "layer":
+                    self._ctx = (n, carried, [mid, staff.get("xml:id"), layer.get("xml:id")])
+                    t = self._events(layer, start, Fraction(1), None)
+                    end = max(end, t)
+        if end == start:
+            end = start + self._staff_value(self.meter, None, WHOLE_MEASURE)
+        self.time = end
+        return
+
+    def _events(self, elem, t, factor, chord):
+        """
+        Process events in a layer (or nested element) starting at time 't', and
+        return the time following them.  'chord' is the attributes of an enclosing
+        chord, or None.
+        """
+        (staff, carried, ids) = self._ctx
+        for e in elem.children():
+            tag   = local_name(e.tag)
+            attrs = dict(e.items())
+            if tag == "note":
+                d = self._duration(attrs, chord, factor)
+                self._note(e, attrs, t, d, staff, carried, ids)
+                if chord is None:
+                    t += d
+            elif tag == "chord":
+                ids.append(attrs.get("xml:id"))
+                self._events(e, t, factor, attrs)
+                ids.pop()
+                t += self._duration(attrs, None, factor)
+            elif tag in ("rest", "space"):
+                t += self._duration(attrs, None, factor)
+            elif tag in ("mRest", "mSpace"):
+                t += self._staff_value(self.meter, staff, WHOLE_MEASURE)
+            elif tag in ("beam", "tuplet", "ftrem", "bTrem", "fTrem", "graceGrp"):
+                f = factor
+                if tag == "tuplet" and attrs.get("num") and attrs.get("numbase"):
+                    f = factor*Fraction(int(attrs["numbase"]), int(attrs["num"]))
+                ids.append(attrs.get("xml:id"))
+                t = self._events(e, t, f, chord)
+                ids.pop()
+        return t
+
+    def _duration(self, attrs, chord, factor):
+        if attrs.get("grace") or (chord and chord.get("grace")):
+            return 0
+        if attrs.get("dur"):
+            return duration_quarters(attrs["dur"], attrs.get("dots"))*factor
+        if chord and chord.get("dur"):
+            return duration_quarters(chord["dur"], chord.get("dots"))*factor
+        return 0
+
+    def _note(self, e, attrs, t, d, staff, carried, ids):
+        pname  = attrs.get("pname")
+        octave = attrs.get("oct")
+        if not pname or octave is None:
+            return
+        accid = attrs.get("accid.ges") or attrs.get("accid")
+        if accid is None:
+            for c in e.children():
+                if local_name(c.tag) == "accid":
+                    accid = c.get("accid.ges") or c.get("accid")
+        if accid is not None:
+            alter = ACCID_ALTER.get(accid, 0)
+            carried[(pname, octave)] = alter
+        else:
+            alter = carried.get(
+                (pname, octave), self._staff_value(self.keysig, staff, {}).get(pname, 0)
+                )
+        self.notes._add(
+            note_pitch(pname, octave, alter), float(t), float(d), staff, self.measure,
+            ids + [attrs.get("xml:id")]
+            )
+        return
+
+def extract_notes(snapshot):
+    """
+    Return NoteSequence for an MEI file snapshot (see meisnapshot).
+    """
+    x = _Extractor()
+    x.walk(snapshot.root())
+    x.notes._sort()
+    return x.notes
+
+def stage_arrays(notes, mcs):
+    """
+    Return list of (name, array) for the notes of a stage score and its Muzicodes
+    (as described in "mkGameEngine2.json").
+    """
+    arrays = [ (name, notes.arrays[name]) for (name, code) in NOTE_ARRAYS ]
+    for mc in mcs:
+        selected = notes.select(mc["meielements"])
+        if not selected:
+            log.warning("stage_arrays: no notes for Muzicode %s"%(mc["name"],))
+        mc_arrays = notes.take(selected)
+        arrays.extend( ("%s.%s"%(mc["name"], name), mc_arrays[name]) for name in MUZICODE_ARRAYS )
+    return arrays
+
+def npy_bytes(a):
+    """
+    Return NumPy ".npy" format data for a one-dimensional 'array' value.
+    """
+    header = "{'descr': '%s', 'fortran_order': False, 'shape': (%d,), }"%(NPY_DESCR[a.typecode], len(a))
+    header += " "*(-(len(NPY_MAGIC) + 2 + len(header) + 1) % 64) + "\n"
+    if sys.byteorder != "little":
+        a = array.array(a.typecode, a)
+        a.byteswap()
+    return NPY_MAGIC + struct.pack("<H", len(header)) + header.encode("latin1") + a.tostring()
+
+def npy_array(data):
+    """
+    Return 'array' value for NumPy ".npy" format data written by 'npy_bytes'.
+    """
+    if data[:6] != NPY_MAGIC[:6]:
+        raise ValueError("Not NumPy array data")
+    hlen   = struct.unpack_from("<H", data, 8)[0]
+    header = ast.literal_eval(data[10:10+hlen].decode("latin1"))
+    codes  = dict( (v, k) for (k, v) in NPY_DESCR.items() )
+    a = array.array(codes[header["descr"]])
+    a.fromstring(data[10+hlen:])
+    if sys.byteorder != "little":
+        a.byteswap()
+    return a
+
+def write_npz(filename, arrays):
+    """
+    Write list of (name, array) to a NumPy ".npz" file.
+    """
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_STORED) as z:
+        for (name, a) in arrays:
+            z.writestr(name+".npy", npy_bytes(a))
+    write_file_atomic(filename, buf.getvalue())
+    return
+
+def read_npz(filename):
+    """
+    Read NumPy ".npz" file written by 'write_npz', returning {name: array}.
+    """
+    arrays = {}
+    with zipfile.ZipFile(filename, "r") as z:
+        for n in z.namelist():
+            arrays[n[:-4] if n.endswith(".npy") else n] = npy_array(z.read(n))
+    return arrays
+
+def extract_stages(jsondata, meidir, outdir, meiindex=None):
+    """
+    Write "<stage>.npz" in 'outdir' for each stage with an MEI file.  Returns list of
+    (stage id, number of notes, number of Muzicodes).
+    """
+    meiindex = meiindex or MEIIndex(meidir)
+    done     = []
+    for stage in jsondata:
+        meifile = stage.get("meifile")
+        if not meifile or not meiindex.has_file(meifile):
+            log.warning("extract_stages: no MEI file for stage %s"%(stage["stage"],))
+            continue
+        snap = open_snapshot(os.path.join(meidir, meifile), digest=meiindex.file_hash(meifile))
+        try:
+            notes = extract_notes(snap)
+        finally:
+            snap.close()
+        mcs = [ mc for mc in stage.get("mcs", []) if mc.get("meielements") ]
+        write_npz(os.path.join(outdir, stage["stage"]+".npz"), stage_arrays(notes, mcs))
+        done.append((stage["stage"], len(notes), len(mcs)))
+    return done
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog=os.path.basename(argv[0]),
+        description="Extract note sequences for stage scores and Muzicodes"
+        )
+    parser.add_argument("outdir", help="Directory for note sequence (.npz) files")
+    parser.add_argument("--mei-dir", default="mei",
+        help="Directory containing stage MEI files (default: %(default)s)")
+    parser.add_argument("--json", default="mkGameEngine2.json",
+        help="Stage and Muzicode descriptions (default: %(default)s)")
+    return parser.parse_args(argv[1:])
+
+def runMain():
+    options = parse_args(sys.argv)
+    with open(options.json, "r") as instr:
+        jsondata = json.load(instr)
+    if not os.path.isdir(options.outdir):
+        os.makedirs(options.outdir)
+    for (stage_id, nnotes, nmcs) in extract_stages(jsondata, options.mei_dir, options.outdir):
+        print("%s: %d notes, %d Muzicodes"%(stage_id, nnotes, nmcs))
+    return 0
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    sys.exit(runMain())
+
+# End.
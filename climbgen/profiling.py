@@ -0,0 +1,163 @@
+"""
+Lightweight profiling and counters for MELD data generation
+
+A single Profiler object ('profiler') records, for each named phase, the number 
+of calls and the accumulated wall-clock and CPU time, together with named 
+counters.  CPU time is process CPU time (time.clock), so for a phase on the main
+thread it includes time used by any worker threads while the phase runs; it is
+not recorded (reported as None) for phases called on other threads.
+
+Optionally, a cProfile capture is made for a chosen phase, which must not be one
+declared as running on worker threads (cProfile is not thread-safe).  When the 
+profiler is disabled (the default), instrumented functions are called directly 
+and counters return immediately, so the instrumentation can be left in place.
+"""
+
+__author__      = "Graham Klyne (GK@ACM.ORG)"
+__copyright__   = "Copyright 2017, G. Klyne"
+__license__     = "MIT (http://opensource.org/licenses/MIT)"
+
+import json
+import time
+import threading
+import functools
+import cProfile
+import pstats
+import StringIO
+
+import logging
+log = logging.getLogger(__name__)
+
+class Profiler(object):
+    """
+    Collects phase timings and counters.
+
+    @param enabled:     if True, start collecting immediately.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled   = enabled
+        self._lock     = threading.Lock()
+        self._active   = threading.local()
+        self._phases   = {}
+        self._counters = {}
+        self._cphase   = None
+        self._cprofile = None
+        self._threaded = set()
+        return
+
+    def threaded(self, name):
+        """
+        Return True if the named phase is declared as running on worker threads.
+        """
+        return name in self._threaded
+
+    def enable(self, cprofile_phase=None):
+        """
+        Start collecting, with cProfile capture for the named phase if given
+        """
+        if cprofile_phase and self.threaded(cprofile_phase):
+            raise ValueError(
+                "cProfile capture is not supported for threaded phase %s"%(cprofile_phase,)
+                )
+        self.enabled = True
+        if cprofile_phase:
+            self._cphase   = cprofile_phase
+            self._cprofile = cProfile.Profile()
+        return
+
+    def disable(self):
+        self.enabled = False
+        return
+
+    def count(self, name, n=1):
+        """
+        Add n to the named counter
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+        return
+
+    def counter(self, name):
+        return self._counters.get(name, 0)
+
+    def profiled(self, name, threaded=False):
+        """
+        Decorator for a function to be recorded as the named phase.
+
+        Only the outermost call is timed if the phase is re-entered on the same thread.
+        'threaded' declares that the function is called on worker threads.
+        """
+        if threaded:
+            self._threaded.add(name)
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                return self._call_phase(name, func, args, kwargs)
+            return wrapper
+        return decorator
+
+    def _call_phase(self, name, func, args, kwargs):
+        active = getattr(self._active, "phases", None)
+        if active is None:
+            active = self._active.phases = set()
+        if name in active:
+            return func(*args, **kwargs)
+        active.add(name)
+        cprofile = self._cprofile if name == self._cphase else None
+        main = threading.current_thread().name == "MainThread"
+        t0 = time.time()
+        c0 = time.clock()
+        try:
+            if cprofile:
+                return cprofile.runcall(func, *args, **kwargs)
+            return func(*args, **kwargs)
+        finally:
+            wall = time.time() - t0
+            cpu  = time.clock() - c0
+            active.discard(name)
+            with self._lock:
+                phase = self._phases.setdefault(
+                    name, {"calls": 0, "wall": 0.0, "cpu": 0.0 if main else None}
+                    )
+                phase["calls"] += 1
+                phase["wall"]  += wall
+                if phase["cpu"] is not None:
+                    phase["cpu"] += cpu
+
+    def report(self, cprofile_lines=25):
+        """
+        Return dictionary reporting phase timings and counters.  CPU time is process
+        CPU time, so includes time spent by other threads, and is None for phases
+        called on threads other than the main thread.
+        """
+        report = (
+            { "phases":     self._phases
+            , "counters":   self._counters
+            })
+        if self._cprofile:
+            s = StringIO.StringIO()
+            stats = pstats.Stats(self._cprofile, stream=s)
+            stats.sort_stats("cumulative").print_stats(cprofile_lines)
+            report["cprofile"] = { "phase": self._cphase, "stats": s.getvalue() }
+        return report
+
+    def save_report(self, filename):
+        """
+        Write JSON report to named file, and cProfile data (if any) to <filename>.prof
+        """
+        with open(filename, "w") as outstr:
+            json.dump(self.report(), outstr, sort_keys=True, indent=2, separators=(',', ': '))
+        if self._cprofile:
+            self._cprofile.dump_stats(filename+".prof")
+        log.info("Profile report written to %s"%(filename,))
+        return
+
+# Profiler used by climbgen modules
+profiler = Profiler()
+
+# End.
@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+
+"""
+Reference graph and integrity checks for generated MELD entities
+
+Entities refer to each other by relative '@id' values ("<type_id>/<entity_id>").
+Some stage and action properties use a bare entity id, which refers to an entity
+of a known type (e.g. climb:cue_stage "5a" refers to "climb_Stage_Score/5a").
+Entity references are interned as integers, and references are held as adjacency
+arrays, from which a single pass reports:
+
+- dangling references, whose target entity does not exist;
+- empty references, where a reference property has an empty string value;
+- orphan entities, which are not referenced by any other entity (annotations are
+  not reported, as nothing refers to them);
+- unreachable stages, which cannot be reached from the starting stage by stage
+  transitions, Muzicode annotations and cued actions.
+
+Usage:
+    python refgraph.py [DIR] [--start STAGE] [--ignore-type TYPE] [--processes N]
+                             [--bundle FILE]
+
+checks the Annalist collection 'd/' directory DIR (default "d/"), or a bundle file.
+The exit status is 1 if there are dangling references or unreachable stages.
+"""
+
+__author__      = "Graham Klyne (GK@ACM.ORG)"
+__copyright__   = "Copyright 2017, G. Klyne"
+__license__     = "MIT (http://opensource.org/licenses/MIT)"
+
+import sys
+import os
+import os.path
+import errno
+import json
+import array
+import collections
+import multiprocessing
+import argparse
+
+from entitywriter import ENTITY_DATA_FILE
+
+import logging
+log = logging.getLogger(__name__)
+
+# Reference properties, and the entity type for references that are a bare id
+REFERENCE_PROPERTIES = collections.OrderedDict(
+    [ ("climb:next_stage",          "climb_Stage_Score")
+    , ("climb:default_cue_stage",   "climb_Stage_Score")
+    , ("climb:cue_stage",           "climb_Stage_Score")
+    , ("climb:auto",                "climb_Actions")
+    , ("frbr:part",                 None)
+    , ("frbr:embodiment",           None)
+    , ("mo:published_as",           None)
+    , ("oa:hasBody",                None)
+    , ("oa:hasTarget",              None)
+    , ("oa:motivatedBy",            None)
+    , ("mc:type",                   None)
+    ])
+
+# Properties followed from a stage to the stages that can follow it.  An annotation
+# also leads from its target (Muzicode) to its body (actions).
+STAGE_PATH_PROPERTIES = (
+    [ "climb:next_stage", "climb:default_cue_stage", "climb:auto", "frbr:part"
+    , "climb:cue_stage"
+    ])
+
+STAGE_TYPE          = "climb_Stage_Score"
+ANNOTATION_TYPE     = "climb_Annotation"
+ROOT_TYPES          = [ANNOTATION_TYPE]
+START_STAGE         = "basecamp"
+
+_REFERENCE_ITEMS    = list(REFERENCE_PROPERTIES.items())
+
+def entity_references(jsondata):
+    """
+    Return list of (property, target) for the references in an entity, where target
+    is an entity reference, or "" for an empty reference.
+    """
+    refs = []
+    for (p, bare_type) in _REFERENCE_ITEMS:
+        vals = jsondata.get(p)
+        if vals is None:
+            continue
+        if not isinstance(vals, list):
+            vals = [vals]
+        for v in vals:
+            if isinstance(v, dict):
+                v = v.get("@id")
+            if v is None:
+                continue
+            if v and bare_type and "/" not in v:
+                v = bare_type + "/" + v
+            refs.append((p, v))
+    return refs
+
+def _read_entity_worker(args):
+    """
+    Read entity file; return (entity_ref, type_id, references), or None if the file
+    cannot be read.
+    """
+    (entity_ref, filename) = args
+    try:
+        with open(filename, "r") as instr:
+            jsondata = json.loads(instr.read())
+    except IOError, e:
+        if e.errno not in (errno.ENOENT, errno.ENOTDIR):
+            log.error("refgraph: %s: %s"%(filename, e))
+        return None
+    except ValueError, e:
+        log.error("refgraph: %s: %s"%(filename, e))
+        return None
+    return (entity_ref, jsondata.get("annal:type_id"), entity_references(jsondata))
+
+def collection_files(base_dir):
+    """
+    Return sorted list of (entity_ref, filename) for entity data files in an Annalist 
+    collection 'd/' directory, omitting Annalist internal types (whose names start 
+    with "_").  Entity directories are not checked for a data file.
+    """
+    files = []
+    for type_id in sorted(os.listdir(base_dir)):
+        type_dir = os.path.join(base_dir, type_id)
+        if type_id.startswith("_") or not os.path.isdir(type_dir):
+            continue
+        for entity_id in sorted(os.listdir(type_dir)):
+            files.append(
+                ( type_id + "/" + entity_id, 
+                  type_dir + "/" + entity_id + "/" + ENTITY_DATA_FILE
+                ))
+    return files
+
+class ReferenceGraph(object):
+    """
+    Graph of references between entities.
+
+    Each entity reference (including references to entities that do not exist) is
+    interned as a node number.  Entities are added with 'add_entity' or 'add_refs',
+    or loaded from a collection with 'load_collection'; then 'check' returns the
+    integrity report.
+    """
+
+    def __init__(self):
+        self._refs     = []                     # node -> entity reference
+        self._nodes    = {}                     # entity reference -> node
+        self._props    = list(REFERENCE_PROPERTIES)
+        self._propnums = dict( (p, i) for (i, p) in enumerate(self._props) )
+        self._types    = {}                     # node -> type_id (existing entities)
+        self._src      = array.array('I')       # edge -> source node
+        self._dst      = array.array('I')       # edge -> target node
+        self._prop     = array.array('B')       # edge -> property number
+        self._empty    = []                     # (source node, property number)
+        return
+
+    def node(self, entity_ref):
+        """
+        Return node number for an entity reference, allocating one if needed.
+        """
+        n = self._nodes.get(entity_ref)
+        if n is None:
+            n = self._nodes[entity_ref] = len(self._refs)
+            self._refs.append(entity_ref)
+        return n
+
+    def add_entity(self, entity_ref, jsondata):
+        self.add_refs(entity_ref, jsondata.get("annal:type_id"), entity_references(jsondata))
+        return
+
+    def add_refs(self, entity_ref, type_id, refs):
+        """
+        Add an entity and its references, per 'entity_references'.
+        """
+        n = self.node(entity_ref)
+        self._types[n] = type_id
+        for (p, target) in refs:
+            if target:
+                self._src.append(n)
+                self._dst.append(self.node(target))
+                self._prop.append(self._propnums[p])
+            else:
+                self._empty.append((n, self._propnums[p]))
+        return
+
+    def load_collection(self, base_dir, processes=None):
+        """
+        Read all entities in an Annalist collection 'd/' directory, parsing files
+        in parallel (default: one process per CPU).  Returns the number of entities 
+        read.
+        """
+        files = collection_files(base_dir)
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        if len(files) > 1 and processes > 1:
+            pool = multiprocessing.Pool(processes)
+            try:
+                results = pool.map(_read_entity_worker, files, chunksize=256)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [ _read_entity_worker(f) for f in files ]
+        count = 0
+        for r in results:
+            if r:
+                self.add_refs(*r)
+                count += 1
+        return count
+
+    def _adjacency(self):
+        """
+        Return (offsets, edges): the edges from node n are edges[offsets[n]:offsets[n+1]],
+        each being an edge number.
+        """
+        nnodes  = len(self._refs)
+        offsets = array.array('I', [0])*(nnodes+1)
+        for s in self._src:
+            offsets[s+1] += 1
+        for n in xrange(nnodes):
+            offsets[n+1] += offsets[n]
+        fill  = array.array('I', offsets)
+        edges = array.array('I', [0])*len(self._src)
+        for (e, s) in enumerate(self._src):
+            edges[fill[s]] = e
+            fill[s] += 1
+        return (offsets, edges)
+
+    def check(self, start_stage=START_STAGE, ignore_types=()):
+        """
+        Return dictionary with integrity report, with sorted lists of:
+
+        dangling:       (source, property, target) for references to missing entities
+        empty:          (source, property) for empty references
+        orphans:        entities that are not referenced by another entity
+        unreachable:    stages not reachable from the starting stage
+
+        References to entities of any type in 'ignore_types' (e.g. types defined 
+        outside the generated data) are not reported as dangling.
+        """
+        refs   = self._refs
+        props  = self._props
+        types  = self._types
+        nnodes = len(refs)
+        # Incoming reference counts, and annotation target -> body links
+        incoming = array.array('I', [0])*nnodes
+        dangling = []
+        bodies   = collections.defaultdict(list)
+        annotation_links = {}
+        prop_target = self._propnums["oa:hasTarget"]
+        prop_body   = self._propnums["oa:hasBody"]
+        for (s, d, p) in zip(self._src, self._dst, self._prop):
+            if s != d:
+                incoming[d] += 1
+            if d not in types and refs[d].split("/", 1)[0] not in ignore_types:
+                dangling.append((refs[s], props[p], refs[d]))
+            if types.get(s) == ANNOTATION_TYPE:
+                if p == prop_target:
+                    annotation_links.setdefault(s, [None, None])[0] = d
+                elif p == prop_body:
+                    annotation_links.setdefault(s, [None, None])[1] = d
+        for (target, body) in annotation_links.values():
+            if target is not None and body is not None:
+                bodies[target].append(body)
+        orphans = [ refs[n] for n in types
+                    if incoming[n] == 0 and types[n] not in ROOT_TYPES and
+                       refs[n] != STAGE_TYPE + "/" + start_stage
+                  ]
+        # Stage reachability
+        (offsets, edges) = self._adjacency()
+        follow  = set( self._propnums[p] for p in STAGE_PATH_PROPERTIES )
+        seen    = bytearray(nnodes)
+        start   = self._nodes.get(STAGE_TYPE + "/" + start_stage)
+        pending = [start] if start is not None else []
+        for n in pending:
+            seen[n] = 1
+        while pending:
+            n = pending.pop()
+            nexts = [ self._dst[e] for e in edges[offsets[n]:offsets[n+1]]
+                      if self._prop[e] in follow ]
+            nexts.extend(bodies.get(n, []))
+            for m in nexts:
+                if not seen[m]:
+                    seen[m] = 1
+                    pending.append(m)
+        unreachable = [ refs[n] for n in types
+                        if types[n] == STAGE_TYPE and not seen[n] ]
+        return (
+            { "dangling":       sorted(dangling)
+            , "empty":          sorted( (refs[n], props[p]) for (n, p) in self._empty )
+            , "orphans":        sorted(orphans)
+            , "unreachable":    sorted(unreachable)
+            })
+
+def print_report(report):
+    for (s, p, d) in report["dangling"]:
+        print("Dangling reference: %s %s %s"%(s, p, d))
+    for r in report["unreachable"]:
+        print("Unreachable stage: %s"%(r,))
+    for r in report["orphans"]:
+        print("Orphan entity: %s"%(r,))
+    empties = collections.Counter( p for (s, p) in report["empty"] )
+    for (p, n) in sorted(empties.items()):
+        print("Empty references: %s (%d)"%(p, n))
+    print("%d dangling, %d empty, %d orphans, %d unreachable stages"%
+        ( len(report["dangling"]), len(report["empty"]),
+          len(report["orphans"]), len(report["unreachable"])
+        ))
+    return
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog=os.path.basename(argv[0]),
+        description="Check references between generated MELD entities"
+        )
+    parser.add_argument("dir", nargs="?", default="d/",
+        help="Annalist collection entity directory (default: %(default)s)")
+    parser.add_argument("--bundle", metavar="FILE",
+        help="Check entities in a bundle file, instead of a directory")
+    parser.add_argument("--start", default=START_STAGE,
+        help="Starting stage for reachability (default: %(default)s)")
+    parser.add_argument("--ignore-type", action="append", default=[], metavar="TYPE",
+        help="Do not report dangling references to entities of type TYPE "+
+             "(may be repeated)")
+    parser.add_argument("--processes", type=int, default=None,
+        help="Number of processes used to read entity files (default: CPU count)")
+    return parser.parse_args(argv[1:])
+
+def runMain():
+    options = parse_args(sys.argv)
+    graph   = ReferenceGraph()
+    if options.bundle:
+        from bundle import load_bundle
+        for (entity_ref, jsondata) in load_bundle(options.bundle):
+            graph.add_entity(entity_ref, jsondata)
+    else:
+        graph.load_collection(options.dir, processes=options.processes)
+    report = graph.check(start_stage=options.start, ignore_types=options.ignore_type)
+    print_report(report)
+    return 1 if (report["dangling"] or report["unreachable"]) else 0
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    sys.exit(runMain())
+
+# End.
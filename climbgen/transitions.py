@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+
+"""
+Precomputed stage transition table for the Climb! game engine
+
+The transitions from each stage are gathered from the analyzed game engine
+spreadsheet, and saved as a compact JSON table in which stages are numbered in
+spreadsheet order:
+
+    stages:     list of stage ids
+    triggers:   list of fixed trigger names (see TRIGGERS)
+    table:      for each stage, the target stage number for each fixed trigger,
+                or -1 if there is no transition
+    muzicodes:  for each stage, a list of [Muzicode name, target stage number]
+    effects:    list of weather effect names (see EFFECTS)
+    enabled:    for each stage, a bit mask of the effects enabled for that stage
+    diagnostics: cycles, dead ends and unknown targets (see 'diagnose')
+
+A TransitionTable loaded from this file answers transition queries with a list
+or dictionary lookup, without reading any generated JSON-LD.
+
+Usage:
+    python transitions.py TABLE
+
+prints the diagnostics from a saved table.
+"""
+
+__author__      = "Graham Klyne (GK@ACM.ORG)"
+__copyright__   = "Copyright 2017, G. Klyne"
+__license__     = "MIT (http://opensource.org/licenses/MIT)"
+
+import sys
+import json
+
+from entitywriter import write_file_atomic
+
+import logging
+log = logging.getLogger(__name__)
+
+TRANSITIONS_VERSION = 1
+
+TRIGGERS = ["next", "default_cue", "auto"]
+EFFECTS  = ["no_effect", "rain_effect", "snow_effect", "wind_effect", "storm_effect", "sun_effect"]
+
+def muzicode_name(stage_id, mc_actions):
+    """
+    Return the name of the Muzicode for a group of Muzicode-triggered actions, or
+    None, as used when generating Muzicode entities.
+    """
+    if not mc_actions:
+        return None
+    mc_name = mc_actions["name"]
+    if not mc_name and mc_actions["midi"]:
+        mc_name = "%s_%s"%(stage_id, mc_actions["mc_hdr"])
+    return mc_name
+
+def build_transitions(data):
+    """
+    Return transition table dictionary for analyzed spreadsheet data (see
+    'climbgen.analyze_table_data').
+    """
+    stages     = [ stage["stage"] for stage in data["stages"] ]
+    stage_nums = dict( (s, i) for (i, s) in enumerate(stages) )
+    unknown    = []
+    def target(stage_id, trigger, cue):
+        if not cue:
+            return -1
+        if cue not in stage_nums:
+            unknown.append([stage_id, trigger, cue])
+            return -1
+        return stage_nums[cue]
+    table     = []
+    muzicodes = []
+    enabled   = []
+    for stage in data["stages"]:
+        stage_id = stage["stage"]
+        cues     = (
+            { "next":           stage["next"]
+            , "default_cue":    stage["default_cue"]
+            , "auto":           stage["auto_actions"]["cue"]
+            })
+        table.append([ target(stage_id, t, cues[t]) for t in TRIGGERS ])
+        mcs = []
+        for mc_actions in stage["mc_actions"]:
+            mc_name = muzicode_name(stage_id, mc_actions)
+            if mc_name:
+                mcs.append([mc_name, target(stage_id, "mc:"+mc_name, mc_actions["cue"])])
+        muzicodes.append(mcs)
+        mask = 0
+        for (i, e) in enumerate(EFFECTS):
+            if (stage[e] or "").upper() == "Y":
+                mask |= 1 << i
+        enabled.append(mask)
+    transitions = (
+        { "version":    TRANSITIONS_VERSION
+        , "stages":     stages
+        , "triggers":   TRIGGERS
+        , "table":      table
+        , "muzicodes":  muzicodes
+        , "effects":    EFFECTS
+        , "enabled":    enabled
+        })
+    transitions["diagnostics"] = diagnose(transitions)
+    transitions["diagnostics"]["unknown_targets"] = unknown
+    return transitions
+
+def stage_successors(transitions):
+    """
+    Return, for each stage number, the sorted list of distinct target stage numbers.
+    """
+    succs = []
+    for (row, mcs) in zip(transitions["table"], transitions["muzicodes"]):
+        targets = set( t for t in row if t >= 0 )
+        targets.update( t for (n, t) in mcs if t >= 0 )
+        succs.append(sorted(targets))
+    return succs
+
+def diagnose(transitions):
+    """
+    Return dictionary of diagnostics for a transition table:
+
+    cycles:     lists of stage ids that can each be reached from the others
+                (strongly connected components with more than one stage, or with
+                a transition from a stage to itself)
+    dead_ends:  stage ids with no outgoing transition
+    """
+    stages = transitions["stages"]
+    succs  = stage_successors(transitions)
+    # Tarjan's strongly connected components, without recursion
+    nstages = len(stages)
+    index   = [None]*nstages
+    lowlink = [0]*nstages
+    onstack = [False]*nstages
+    stack   = []
+    sccs    = []
+    counter = 0
+    for root in range(nstages):
+        if index[root] is not None:
+            continue
+        work = [(root, 0)]
+        while work:
+            (v, i) = work.pop()
+            if i == 0:
+                index[v] = lowlink[v] = counter
+                counter += 1
+                stack.append(v)
+                onstack[v] = True
+            recurse = False
+            while i < len(succs[v]):
+                w = succs[v][i]
+                i += 1
+                if index[w] is None:
+                    work.append((v, i))
+                    work.append((w, 0))
+                    recurse = True
+                    break
+                if onstack[w]:
+                    lowlink[v] = min(lowlink[v], index[w])
+            if recurse:
+                continue
+            if lowlink[v] == index[v]:
+                scc = []
+                while True:
+                    w = stack.pop()
+                    onstack[w] = False
+                    scc.append(w)
+                    if w == v:
+                        break
+                if len(scc) > 1 or v in succs[v]:
+                    sccs.append(sorted(scc))
+            if work:
+                u = work[-1][0]
+                lowlink[u] = min(lowlink[u], lowlink[v])
+    return (
+        { "cycles":     sorted( [ stages[n] for n in scc ] for scc in sccs )
+        , "dead_ends":  [ stages[n] for n in range(nstages) if not succs[n] ]
+        })
+
+def save_transitions(filename, transitions):
+    write_file_atomic(filename, json.dumps(transitions, sort_keys=True, separators=(',', ':')))
+    return
+
+class TransitionTable(object):
+    """
+    Runtime stage transition lookup, using a table saved by 'save_transitions'.
+
+    @param transitions: transition table dictionary.
+    """
+
+    def __init__(self, transitions):
+        if transitions.get("version") != TRANSITIONS_VERSION:
+            raise ValueError("Unsupported transition table version")
+        self.stages       = transitions["stages"]
+        self.diagnostics  = transitions["diagnostics"]
+        self._stage_nums  = dict( (s, i) for (i, s) in enumerate(self.stages) )
+        self._trigger_nums = dict( (t, i) for (i, t) in enumerate(transitions["triggers"]) )
+        self._effect_bits = dict( (e, 1 << i) for (i, e) in enumerate(transitions["effects"]) )
+        self._table       = transitions["table"]
+        self._muzicodes   = [ dict(mcs) for mcs in transitions["muzicodes"] ]
+        self._enabled     = transitions["enabled"]
+        return
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, "r") as instr:
+            return cls(json.load(instr))
+
+    def stage_num(self, stage_id):
+        """
+        Return stage number for stage id; raises KeyError for an unknown stage.
+        """
+        return self._stage_nums[stage_id]
+
+    def target_num(self, stage_num, trigger):
+        """
+        Return target stage number for a stage number and trigger, or -1 if there
+        is no transition.  A trigger is one of TRIGGERS, or "mc:<name>" for a
+        Muzicode.
+        """
+        if trigger.startswith("mc:"):
+            return self._muzicodes[stage_num].get(trigger[3:], -1)
+        return self._table[stage_num][self._trigger_nums[trigger]]
+
+    def target(self, stage_id, trigger):
+        """
+        Return target stage id for a stage id and trigger (see 'target_num'), or None.
+        """
+        t = self.target_num(self._stage_nums[stage_id], trigger)
+        return self.stages[t] if t >= 0 else None
+
+    def effect_enabled(self, stage_id, effect):
+        """
+        Return True if the named weather effect (one of EFFECTS) is enabled for a stage.
+        """
+        return bool(self._enabled[self._stage_nums[stage_id]] & self._effect_bits[effect])
+
+def print_diagnostics(diagnostics):
+    for cycle in diagnostics["cycles"]:
+        print("Cycle: %s"%(", ".join(cycle),))
+    for s in diagnostics["dead_ends"]:
+        print("Dead end: %s"%(s,))
+    for (s, trigger, cue) in diagnostics["unknown_targets"]:
+        print("Unknown target: %s %s %s"%(s, trigger, cue))
+    return
+
+def runMain():
+    if len(sys.argv) != 2:
+        print("Usage: %s TABLE"%(sys.argv[0],))
+        return 2
+    table = TransitionTable.load(sys.argv[1])
+    print_diagnostics(table.diagnostics)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(runMain())
+
+# End.